@@ -0,0 +1,60 @@
+# Description: Background generation of the task "important notes".
+# Tasks are posted without a note, the note is generated by a worker
+# and stored on the task, then the task message is updated.
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from models import Task
+from repository import get_task
+from utils import generate_task_note
+
+
+class AnnotationPipeline:
+    def __init__(
+        self,
+        workers: int,
+        max_queue_size: int,
+        on_ready: Callable[[Task], None],
+    ) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='annotation'
+        )
+        # Running and waiting jobs, new jobs are dropped when it is exhausted
+        self._slots = threading.BoundedSemaphore(workers + max_queue_size)
+        self._on_ready = on_ready
+
+    def submit(self, task_id: int) -> bool:
+        if not self._slots.acquire(blocking=False):
+            logger.warning(
+                'Annotation queue is full, task {} is left without a note',
+                task_id,
+            )
+            return False
+        try:
+            future = self._executor.submit(self._annotate, task_id)
+        except RuntimeError:
+            # Shut down, tasks whose message is sent meanwhile by the send
+            # queue are left without a note
+            self._slots.release()
+            return False
+        future.add_done_callback(lambda _: self._slots.release())
+        return True
+
+    def _annotate(self, task_id: int) -> None:
+        try:
+            task = get_task(task_id)
+            if task is None:
+                return
+            note = generate_task_note(task)
+            if not note:
+                return
+            task.note = note
+            task.save(only=[Task.note])
+            self._on_ready(task)
+        except Exception:
+            logger.exception('Failed to annotate task {}', task_id)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
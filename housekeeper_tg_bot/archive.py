@@ -0,0 +1,127 @@
+# Description: Archive of finished tasks. Tasks finished longer than the
+# retention period ago are moved in batches from the Task table to the
+# ArchivedTask table, and their counts are added to per-user rollups, so
+# statistics and executor loads stay exact while the Task table holds
+# only recent tasks.
+import datetime
+import threading
+from collections import Counter
+
+from database import write_transaction
+from loguru import logger
+from models import ArchivedTask, Task, UserRollup
+from peewee import EXCLUDED, Database
+
+BATCH_SIZE = 1000
+
+
+def archive_batch(before: datetime.datetime, batch_size: int) -> int:
+    # Returns the number of archived tasks
+    finished_before = Task.finished_time < before
+    # Tasks finished before finished_time was recorded are aged by creation
+    unknown_and_old = Task.finished_time.is_null() & (
+        Task.creation_time < before.date()
+    )
+    rows = list(
+        Task.select(
+            Task.id,
+            Task.creation_time,
+            Task.creator,
+            Task.executor,
+            Task.chat,
+            Task.text,
+            Task.deadline,
+            Task.finished_time,
+        )
+        .where(
+            Task.is_finished == True,  # noqa: E712
+            finished_before | unknown_and_old,
+        )
+        .order_by(Task.id)
+        .limit(batch_size)
+        .dicts()
+    )
+    if not rows:
+        return 0
+    ArchivedTask.insert_many(
+        [
+            {key: value for key, value in row.items() if key != 'id'}
+            for row in rows
+        ]
+    ).execute()
+
+    executed: Counter[tuple[int, int]] = Counter()
+    created: Counter[tuple[int, int]] = Counter()
+    for row in rows:
+        if row['executor'] is not None:
+            executed[row['chat'], row['executor']] += 1
+        created[row['chat'], row['creator']] += 1
+    UserRollup.insert_many(
+        [
+            {
+                'chat': chat,
+                'user': user,
+                'executed_count': executed[chat, user],
+                'created_count': created[chat, user],
+            }
+            for chat, user in executed.keys() | created.keys()
+        ]
+    ).on_conflict(
+        conflict_target=[UserRollup.chat, UserRollup.user],
+        update={
+            UserRollup.executed_count: (
+                UserRollup.executed_count + EXCLUDED.executed_count
+            ),
+            UserRollup.created_count: (
+                UserRollup.created_count + EXCLUDED.created_count
+            ),
+        },
+    ).execute()
+
+    Task.delete().where(Task.id.in_([row['id'] for row in rows])).execute()
+    return len(rows)
+
+
+class TaskArchiver:
+    def __init__(
+        self, db: Database, interval: float, retention_days: int
+    ) -> None:
+        self._db = db
+        self._interval = interval
+        self._retention = datetime.timedelta(days=retention_days)
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def tick(self, now: datetime.datetime | None = None) -> int:
+        # Every batch is a transaction of its own, so handlers wait for
+        # the write lock no longer than one batch
+        before = (now or datetime.datetime.now()) - self._retention
+        total = 0
+        while not self._stopped.is_set():
+            with write_transaction(self._db):
+                count = archive_batch(before, BATCH_SIZE)
+            total += count
+            if count < BATCH_SIZE:
+                break
+        if total:
+            logger.info('Archived {} finished tasks', total)
+        return total
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name='archive', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception('Failed to archive finished tasks')
+            self._stopped.wait(self._interval)
@@ -0,0 +1,115 @@
+# Description: asyncio runtime. Updates are fetched with the async bot and
+# handled in a thread pool: different chats are processed concurrently,
+# updates of one chat strictly one after another.
+import asyncio
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import telebot
+from loguru import logger
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+
+POLLING_TIMEOUT = 20
+RETRY_DELAY = 3
+THROUGHPUT_LOG_INTERVAL = 60
+
+
+def update_chat_id(update: Update) -> int | None:
+    message = (
+        update.message
+        or update.edited_message
+        or (update.callback_query and update.callback_query.message)
+    )
+    if message:
+        return int(message.chat.id)
+    return None
+
+
+class ChatSerialDispatcher:
+    def __init__(self, handle: Callable[[Update], None], workers: int) -> None:
+        self._handle = handle
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='update'
+        )
+        self._chat_tails: dict[int | None, asyncio.Task[None]] = {}
+        self.processed = 0
+
+    def submit(self, update: Update) -> None:
+        chat_id = update_chat_id(update)
+        task = asyncio.create_task(
+            self._process(update, self._chat_tails.get(chat_id))
+        )
+        self._chat_tails[chat_id] = task
+        task.add_done_callback(lambda _: self._release(chat_id, task))
+
+    def _release(self, chat_id: int | None, task: asyncio.Task[None]) -> None:
+        if self._chat_tails.get(chat_id) is task:
+            del self._chat_tails[chat_id]
+
+    async def _process(
+        self, update: Update, previous: asyncio.Task[None] | None
+    ) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._handle, update)
+        except Exception:
+            logger.exception('Failed to process update {}', update.update_id)
+        self.processed += 1
+
+    async def drain(self) -> None:
+        if self._chat_tails:
+            await asyncio.wait(list(self._chat_tails.values()))
+        self._executor.shutdown()
+
+
+async def _log_throughput(dispatcher: ChatSerialDispatcher) -> None:
+    processed, started = dispatcher.processed, time.monotonic()
+    while True:
+        await asyncio.sleep(THROUGHPUT_LOG_INTERVAL)
+        now = time.monotonic()
+        logger.info(
+            'Processed {:.1f} updates/s',
+            (dispatcher.processed - processed) / (now - started),
+        )
+        processed, started = dispatcher.processed, now
+
+
+async def _poll(token: str, dispatcher: ChatSerialDispatcher) -> None:
+    async_bot = AsyncTeleBot(token)
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await async_bot.get_updates(
+                    offset=offset, timeout=POLLING_TIMEOUT
+                )
+            except Exception:
+                logger.exception('Failed to get updates')
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                dispatcher.submit(update)
+    finally:
+        await async_bot.close_session()
+
+
+async def serve(bot: telebot.TeleBot, workers: int) -> None:
+    dispatcher = ChatSerialDispatcher(
+        lambda update: bot.process_new_updates([update]), workers
+    )
+    throughput_logger = asyncio.create_task(_log_throughput(dispatcher))
+    try:
+        await _poll(bot.token, dispatcher)
+    finally:
+        throughput_logger.cancel()
+        await dispatcher.drain()
+
+
+def run(bot: telebot.TeleBot, workers: int) -> None:
+    # Blocks until polling is stopped and the queued updates are handled
+    asyncio.run(serve(bot, workers))
@@ -1,10 +1,91 @@
+import functools
+import time
+from collections.abc import Callable
+from itertools import zip_longest
+
+import async_runtime
+import dedup
+import sharding
+import snapshot
 import telebot
-from config import DATABASE_PATH, TELEGRAM_BOT_API_TOKEN
+import webhook
+from annotations import AnnotationPipeline
+from archive import TaskArchiver
+from callbacks import Callback, CallbackRouter, encode
+from config import (
+    ANNOTATION_QUEUE_SIZE,
+    ANNOTATION_WORKERS,
+    ARCHIVE_INTERVAL,
+    ARCHIVE_RETENTION_DAYS,
+    ASYNC_WORKERS,
+    BOT_RUNTIME,
+    DEDUP_CAPACITY,
+    DEDUP_PATH,
+    METRICS_HOST,
+    METRICS_PORT,
+    RECURRING_CHECK_INTERVAL,
+    RECURRING_LEAD_DAYS,
+    SEND_QUEUE_WORKERS,
+    SHARD_ADDRESS,
+    SHARD_AUTHKEY,
+    SHARD_INDEX,
+    SHARD_QUEUE_SIZE,
+    SHARD_THREADS,
+    SHARD_WORKERS,
+    SNAPSHOT_INTERVAL,
+    SNAPSHOT_PATH,
+    TASKS_PAGE_SIZE,
+    TELEGRAM_API_URL,
+    TELEGRAM_BOT_API_TOKEN,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_GLOBAL_RATE,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+    WEBHOOK_WORKERS,
+)
+from database import db, write_transaction
+from gpt_cache import gpt_cache
 from loguru import logger
-from media_content import get_gif_url
+from media_content import get_gif_url, gif_pool
 from messages import messages
-from models import Chat, Task, User
-from peewee import IntegrityError, SqliteDatabase
+from metrics import MetricsServer, instrument, registry
+from models import Chat, RecurringTask, Task, User, create_tables
+from peewee import IntegrityError
+from recurring import RecurringSpawner, parse_repeat
+from reminders import reminders
+from rendering import (
+    OFFER_KEYBOARD,
+    OK_BUTTONS,
+    OK_MARKUP,
+    TASK_KEYBOARD,
+    freeze,
+    render,
+)
+from repository import (
+    ActiveTask,
+    TaskPage,
+    active_tasks_page,
+    add_chat_user,
+    add_task,
+    add_tasks,
+    delete_recurring_task,
+    delete_task,
+    finish_task,
+    get_chat_task,
+    get_chat_users,
+    get_open_tasks,
+    get_recurring_tasks,
+    get_task,
+    get_task_by_message,
+    set_task_executor,
+    set_task_message,
+)
+from send_queue import Priority, SendQueue
+from telebot import apihelper, asyncio_helper
 from telebot.types import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -13,156 +94,348 @@ from utils import (
     build_name,
     build_task_message,
     choose_executor,
+    choose_executors,
+    create_recurring_list,
+    create_reminder,
     create_stat_list,
     create_task_list,
+    split_message,
+)
+from view_cache import RenderedView, view_cache
+
+if TELEGRAM_API_URL:
+    apihelper.API_URL = TELEGRAM_API_URL
+    asyncio_helper.API_URL = TELEGRAM_API_URL
+
+# Only polling runs the handlers in threads of telebot. The other runtimes
+# pass each update to process_new_updates from their own workers, which
+# keep the updates of a chat in order, so the call must return once the
+# handlers are done.
+bot = telebot.TeleBot(
+    TELEGRAM_BOT_API_TOKEN, threaded=BOT_RUNTIME == 'polling'
 )
 
-db = SqliteDatabase(DATABASE_PATH, pragmas={'foreign_keys': 1})
+outbox = SendQueue(
+    SEND_QUEUE_WORKERS,
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+)
+
+started_at = time.perf_counter()
+create_tables()
+gpt_cache.create_table()
+update_log = dedup.DedupLog(DEDUP_PATH, DEDUP_CAPACITY)
+dedup.guard(bot, update_log)
+# The dispatcher of the sharded runtime keeps no state
+if BOT_RUNTIME != 'sharded':
+    snapshot.restore(db, SNAPSHOT_PATH)
+    update_log.load()
+snapshotter = snapshot.Snapshotter(SNAPSHOT_PATH, SNAPSHOT_INTERVAL)
+router = CallbackRouter()
+
+
+def delete_later(chat_id: int, message_id: int) -> None:
+    # Cosmetic cleanup, it waits until the meaningful calls are sent
+    outbox.post(
+        chat_id,
+        bot.delete_message,
+        chat_id,
+        message_id,
+        priority=Priority.LOW,
+    )
+
 
-bot = telebot.TeleBot(TELEGRAM_BOT_API_TOKEN)
+def answer_later(
+    call: telebot.types.CallbackQuery, text: str | None = None
+) -> Callable[[object], None]:
+    # Answers a button press from the send thread once the call it caused
+    # is done, handlers do not wait for rate limited chats
+    def answer(_: object) -> None:
+        bot.answer_callback_query(call.id, text)
+
+    return answer
 
 
 @bot.message_handler(commands=['start'])   # type: ignore
+@instrument('handler')
 def start_message(message: telebot.types.Message) -> None:
-    bot.delete_message(message.chat.id, message.message_id)
-    bot.send_message(
+    delete_later(message.chat.id, message.message_id)
+    outbox.post(
+        message.chat.id,
+        bot.send_message,
         message.chat.id,
         messages['start'],
     )
-    with db:
-        try:
-            db.create_tables(
-                [User, Task, Chat, Chat.users.get_through_model()]
-            )
+    try:
+        with write_transaction(db):
             Chat.create(chat_id=message.chat.id)
-        except Exception:
-            logger.exception(messages['unknown_error'])
+    except Exception:
+        logger.exception(messages['unknown_error'])
 
 
 @bot.message_handler(commands=['tasks'])   # type: ignore
+@instrument('handler')
 def list_tasks(message: telebot.types.Message) -> None:
-    response_message = create_task_list(db, message.chat.id)
-    response_message += '\n\nУдалить это сообщение или оставить?'
-    bot.send_message(
+    view = task_view(message.chat.id, 'list')
+    outbox.post(
         message.chat.id,
-        response_message,
-        reply_markup=ok_markup(),
+        bot.send_message,
+        message.chat.id,
+        view.text,
+        reply_markup=view.markup,
         parse_mode='MarkdownV2',
     )
-    bot.delete_message(message.chat.id, message.message_id)
+    delete_later(message.chat.id, message.message_id)
 
 
 @bot.message_handler(commands=['stats'])   # type: ignore
+@instrument('handler')
 def list_stats(message: telebot.types.Message) -> None:
     response_message = create_stat_list(db, message.chat.id)
-    response_message += '\n\nУдалить это сообщение или оставить?'
-    bot.send_message(
+    response_message += messages['keep_or_delete']
+    outbox.post(
+        message.chat.id,
+        bot.send_message,
         message.chat.id,
         response_message,
         reply_markup=ok_markup(),
         parse_mode='MarkdownV2',
     )
-    bot.delete_message(message.chat.id, message.message_id)
+    delete_later(message.chat.id, message.message_id)
+
+
+TASK_VIEW_TITLES = {
+    'remove': 'Выберите таск для удаления',
+    'complete': 'Выберите таск для выполнения',
+}
+
+
+def page_buttons(
+    chat_id: int, view: str, page: TaskPage
+) -> list[InlineKeyboardButton]:
+    buttons = []
+    if page.has_previous and page.tasks:
+        buttons.append(
+            InlineKeyboardButton(
+                '◀️',
+                callback_data=encode(
+                    f'page_{view}_prev', chat_id, page.tasks[0].id
+                ),
+            )
+        )
+    if page.has_next and page.tasks:
+        buttons.append(
+            InlineKeyboardButton(
+                '▶️',
+                callback_data=encode(
+                    f'page_{view}_next', chat_id, page.tasks[-1].id
+                ),
+            )
+        )
+    return buttons
 
 
-def task_remove_markup(chat_id: int) -> InlineKeyboardMarkup:
+def render_task_view(
+    chat_id: int, view: str, after_id: int, before_id: int | None
+) -> RenderedView:
+    with db.atomic():
+        page = active_tasks_page(chat_id, TASKS_PAGE_SIZE, after_id, before_id)
     markup = InlineKeyboardMarkup()
-    with db:
-        tasks = Chat.get(chat_id=chat_id).tasks.where(
-            Task.is_finished == False  # noqa: E712
-        )
-        for task in tasks:
+    if view == 'list':
+        text = create_task_list(page.tasks) + messages['keep_or_delete']
+    else:
+        text = TASK_VIEW_TITLES[view]
+        for task in page.tasks:
             markup.add(
                 InlineKeyboardButton(
                     text=task.text,
-                    callback_data=f'remove_task_{task.id}',
+                    callback_data=encode(f'{view}_task', chat_id, task.id),
                 )
             )
-    return markup
+    navigation = page_buttons(chat_id, view, page)
+    if navigation:
+        markup.row(*navigation)
+    if view == 'list':
+        markup.row(*OK_BUTTONS)
+    # Cached views are sent many times, their keyboard is serialized once
+    return RenderedView(text, freeze(markup))
+
+
+def task_view(
+    chat_id: int, view: str, after_id: int = 0, before_id: int | None = None
+) -> RenderedView:
+    # Only the requested page of active tasks is fetched and rendered
+    return view_cache.get(
+        chat_id,
+        (view, after_id, before_id),
+        lambda: render_task_view(chat_id, view, after_id, before_id),
+    )
+
+
+@bot.callback_query_handler(func=lambda _: True)   # type: ignore
+def dispatch_callback(call: telebot.types.CallbackQuery) -> None:
+    if not router.dispatch(call):
+        bot.answer_callback_query(call.id, messages['task_not_found'])
+
+
+def find_task(
+    chat_id: int, callback: Callback, message_id: int
+) -> Task | None:
+    # Task buttons sent before callbacks carried task ids are resolved by
+    # the task message. Old buttons with a task id carry no nonce, so the
+    # task is looked up in the chat only.
+    if callback.target is None:
+        return get_task_by_message(chat_id, message_id)
+    return get_chat_task(chat_id, callback.target)
+
+
+@router.route(
+    'page_list_prev',
+    'page_list_next',
+    'page_remove_prev',
+    'page_remove_next',
+    'page_complete_prev',
+    'page_complete_next',
+)
+@instrument('handler')
+def turn_page(call: telebot.types.CallbackQuery, callback: Callback) -> None:
+    _, view, direction = callback.action.split('_')
+    if direction == 'next':
+        page = task_view(call.message.chat.id, view, after_id=callback.target)
+    else:
+        page = task_view(call.message.chat.id, view, before_id=callback.target)
+    try:
+        if view == 'list':
+            outbox.post(
+                call.message.chat.id,
+                bot.edit_message_text,
+                page.text,
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=page.markup,
+                parse_mode='MarkdownV2',
+                on_sent=answer_later(call),
+                on_failure=answer_later(call, messages['unknown_error']),
+            )
+        else:
+            outbox.post(
+                call.message.chat.id,
+                bot.edit_message_reply_markup,
+                call.message.chat.id,
+                call.message.message_id,
+                reply_markup=page.markup,
+                on_sent=answer_later(call),
+                on_failure=answer_later(call, messages['unknown_error']),
+            )
+    except Exception:
+        logger.exception(messages['unknown_error'])
+        bot.answer_callback_query(
+            call.id,
+            messages['unknown_error'],
+        )
 
 
 @bot.message_handler(commands=['remove_task'])   # type: ignore
+@instrument('handler')
 def remove_task(message: telebot.types.Message) -> None:
-    response_message = 'Выберите таск для удаления'
-    bot.send_message(
+    view = task_view(message.chat.id, 'remove')
+    outbox.post(
         message.chat.id,
-        response_message,
-        reply_markup=task_remove_markup(message.chat.id),
+        bot.send_message,
+        message.chat.id,
+        view.text,
+        reply_markup=view.markup,
     )
-    bot.delete_message(message.chat.id, message.message_id)
-
-
-@bot.callback_query_handler(
-    func=lambda c: ('remove_task' in c.data)
-)   # type: ignore
-def remove_task_callback(call: telebot.types.CallbackQuery) -> None:
-    task_id = int(call.data.split('_')[-1])
-    with db.atomic():
-        task = Task.get(id=task_id)
-        task.delete_instance()
+    delete_later(message.chat.id, message.message_id)
+
+
+@router.route('remove_task')
+@instrument('handler')
+def remove_task_callback(
+    call: telebot.types.CallbackQuery, callback: Callback
+) -> None:
+    with write_transaction(db):
+        task = get_chat_task(call.message.chat.id, callback.target)
+        if task is None:
+            bot.answer_callback_query(call.id, messages['task_not_found'])
+            return
+        delete_task(task, call.message.chat.id)
     bot.answer_callback_query(call.id, 'Удалено')
-    bot.delete_message(call.message.chat.id, task.message_id)
-    bot.delete_message(call.message.chat.id, call.message.message_id)
-
-
-def task_complete_markup(chat_id: int) -> InlineKeyboardMarkup:
-    markup = InlineKeyboardMarkup()
-    with db:
-        tasks = Chat.get(chat_id=chat_id).tasks.where(
-            Task.is_finished == False  # noqa: E712
+    if task.message_id is not None:
+        outbox.post(
+            call.message.chat.id,
+            bot.delete_message,
+            call.message.chat.id,
+            task.message_id,
         )
-        for task in tasks:
-            markup.add(
-                InlineKeyboardButton(
-                    text=task.text,
-                    callback_data=f'complete_task_{task.id}',
-                )
-            )
-    return markup
+    delete_later(call.message.chat.id, call.message.message_id)
 
 
 @bot.message_handler(commands=['complete_task'])   # type: ignore
+@instrument('handler')
 def complete_task(message: telebot.types.Message) -> None:
-    response_message = 'Выберите таск для выполнения'
-    bot.send_message(
+    view = task_view(message.chat.id, 'complete')
+    outbox.post(
         message.chat.id,
-        response_message,
-        reply_markup=task_complete_markup(message.chat.id),
+        bot.send_message,
+        message.chat.id,
+        view.text,
+        reply_markup=view.markup,
     )
-    bot.delete_message(message.chat.id, message.message_id)
-
-
-@bot.callback_query_handler(
-    func=lambda c: ('complete_task' in c.data)
-)   # type: ignore
-def complete_task_callback(call: telebot.types.CallbackQuery) -> None:
-    task_id = int(call.data.split('_')[-1])
-    with db.atomic():
-        task = Task.get(id=task_id)
-        task.is_finished = True
-        task.save()
+    delete_later(message.chat.id, message.message_id)
+
+
+@router.route('complete_task')
+@instrument('handler')
+def complete_task_callback(
+    call: telebot.types.CallbackQuery, callback: Callback
+) -> None:
+    with write_transaction(db):
+        task = get_chat_task(call.message.chat.id, callback.target)
+        if task is None:
+            bot.answer_callback_query(call.id, messages['task_not_found'])
+            return
+        if task.is_finished:
+            bot.answer_callback_query(
+                call.id, messages['task_already_finished']
+            )
+            return
+        finish_task(task, call.message.chat.id, None)
 
     text = build_task_message(task)
-    text = (
-        text.replace('#', '')
-        + f'\n\n✅ @{call.from_user.username} сделал задачу\!'  # noqa: W605
+    text = text.replace('#', '') + render(
+        'task_completed_note_markdown', call.from_user.username
     )
     try:
-        bot.edit_message_text(
-            text,
+        if task.message_id is not None:
+            outbox.post(
+                call.message.chat.id,
+                bot.edit_message_text,
+                text,
+                call.message.chat.id,
+                task.message_id,
+                parse_mode='MarkdownV2',
+                on_sent=answer_later(call, 'Выполнено'),
+                on_failure=answer_later(call, messages['unknown_error']),
+            )
+        else:
+            bot.answer_callback_query(call.id, 'Выполнено')
+        outbox.post(
             call.message.chat.id,
-            task.message_id,
-            parse_mode='MarkdownV2',
-        )
-        bot.send_message(
+            bot.send_message,
             call.message.chat.id,
-            f'✅ @{call.from_user.username} сделал задачу "{task.text}"!',
+            render('task_completed', call.from_user.username, task.text),
         )
         gif_url = get_gif_url()
         if gif_url:
-            bot.send_animation(call.message.chat.id, gif_url)
-        bot.answer_callback_query(call.id, 'Выполнено')
-        bot.delete_message(call.message.chat.id, call.message.message_id)
+            outbox.post(
+                call.message.chat.id,
+                bot.send_animation,
+                call.message.chat.id,
+                gif_url,
+            )
+        delete_later(call.message.chat.id, call.message.message_id)
     except Exception:
         logger.exception(messages['unknown_error'])
         bot.answer_callback_query(
@@ -171,55 +444,189 @@ def complete_task_callback(call: telebot.types.CallbackQuery) -> None:
         )
 
 
+@bot.message_handler(commands=['bulk'])   # type: ignore
+@instrument('handler')
+def bulk_create_tasks(message: telebot.types.Message) -> None:
+    command_parts = message.text.split(maxsplit=1)
+    lines = command_parts[1].splitlines() if len(command_parts) > 1 else []
+    texts = [line.strip() for line in lines if line.strip()]
+    if not texts:
+        outbox.post(
+            message.chat.id, bot.reply_to, message, messages['bulk_usage']
+        )
+        return
+
+    try:
+        with write_transaction(db):
+            chat = Chat.get(Chat.chat_id == message.chat.id)
+            creator = User.get(User.username == message.from_user.username)
+            executors = choose_executors(
+                get_chat_users(message.chat.id), message.chat.id, len(texts)
+            )
+            add_tasks(chat, creator, texts, executors)
+    except Exception:
+        logger.exception('Failed to create tasks:')
+        outbox.post(
+            message.chat.id,
+            bot.send_message,
+            message.chat.id,
+            messages['unknown_error'] + messages['keep_or_delete'],
+            reply_markup=ok_markup(),
+        )
+        return
+
+    task_lines = [
+        f'{text} — @{executor.username}' if executor else text
+        for text, executor in zip_longest(texts, executors)
+    ]
+    # A long summary is sent in parts, each one can be removed
+    for summary in split_message(
+        messages['bulk_created'].format(len(texts), ''),
+        task_lines,
+        messages['keep_or_delete'],
+    ):
+        outbox.post(
+            message.chat.id,
+            bot.send_message,
+            message.chat.id,
+            summary,
+            reply_markup=ok_markup(),
+        )
+    delete_later(message.chat.id, message.message_id)
+
+
+@bot.message_handler(commands=['repeat'])   # type: ignore
+@instrument('handler')
+def repeat_task(message: telebot.types.Message) -> None:
+    parsed = parse_repeat(message.text)
+    if parsed is None:
+        outbox.post(
+            message.chat.id, bot.reply_to, message, messages['repeat_usage']
+        )
+        return
+    interval_days, text = parsed
+
+    try:
+        with write_transaction(db):
+            RecurringTask.create(
+                creator=User.get(User.username == message.from_user.username),
+                chat=Chat.get(Chat.chat_id == message.chat.id),
+                text=text,
+                interval_days=interval_days,
+            )
+        response_message = messages['repeat_created'].format(
+            text, interval_days
+        )
+    except Exception:
+        logger.exception('Failed to create recurring task:')
+        response_message = messages['unknown_error']
+    # The first occurrence is created by the next spawner tick
+    outbox.post(
+        message.chat.id,
+        bot.send_message,
+        message.chat.id,
+        response_message + messages['keep_or_delete'],
+        reply_markup=ok_markup(),
+    )
+    delete_later(message.chat.id, message.message_id)
+
+
+@bot.message_handler(commands=['stop_repeat'])   # type: ignore
+@instrument('handler')
+def stop_repeat(message: telebot.types.Message) -> None:
+    with db.atomic():
+        rules = get_recurring_tasks(message.chat.id)
+    if not rules:
+        outbox.post(
+            message.chat.id,
+            bot.send_message,
+            message.chat.id,
+            messages['no_recurring_tasks'] + messages['keep_or_delete'],
+            reply_markup=ok_markup(),
+        )
+    else:
+        markup = InlineKeyboardMarkup()
+        for rule in rules:
+            markup.add(
+                InlineKeyboardButton(
+                    text=f'{rule.text} (раз в {rule.interval_days} дн.)',
+                    callback_data=encode(
+                        'stop_repeat', message.chat.id, rule.id
+                    ),
+                )
+            )
+        outbox.post(
+            message.chat.id,
+            bot.send_message,
+            message.chat.id,
+            'Выберите регулярный таск для отмены',
+            reply_markup=markup,
+        )
+    delete_later(message.chat.id, message.message_id)
+
+
+@router.route('stop_repeat')
+@instrument('handler')
+def stop_repeat_callback(
+    call: telebot.types.CallbackQuery, callback: Callback
+) -> None:
+    with write_transaction(db):
+        deleted = delete_recurring_task(callback.target, call.message.chat.id)
+    if not deleted:
+        bot.answer_callback_query(call.id, messages['task_not_found'])
+        return
+    bot.answer_callback_query(call.id, 'Больше не повторяется')
+    delete_later(call.message.chat.id, call.message.message_id)
+
+
 @bot.message_handler(commands=['add_me'])   # type: ignore
+@instrument('handler')
 def add_user(message: telebot.types.Message) -> None:
 
     name = build_name(message.from_user)
 
-    with db:
-        try:
+    # The transaction is rolled back as a whole on errors
+    try:
+        with write_transaction(db):
             user = User.create(username=message.from_user.username)
-            Chat.get(chat_id=message.chat.id).users.add(user)
-            response_message = messages['created_user'].format(name)
-        except IntegrityError:
-            response_message = messages['user_already_exists'].format(name)
-            logger.exception(messages['unknown_error'])
-        except Exception:
-            response_message = messages['unknown_error']
-            logger.exception(messages['unknown_error'])
-
-    response_message += '\n\nУдалить это сообщение или оставить?'
+            add_chat_user(message.chat.id, user)
+        response_message = messages['created_user'].format(name)
+    except IntegrityError:
+        response_message = messages['user_already_exists'].format(name)
+        logger.exception(messages['unknown_error'])
+    except Exception:
+        response_message = messages['unknown_error']
+        logger.exception(messages['unknown_error'])
+
+    response_message += messages['keep_or_delete']
     try:
-        bot.send_message(
+        outbox.post(
+            message.chat.id,
+            bot.send_message,
             message.chat.id,
             response_message,
             reply_markup=ok_markup(),
         )
-        bot.delete_message(message.chat.id, message.message_id)
+        delete_later(message.chat.id, message.message_id)
     except Exception:
         logger.exception(messages['unknown_error'])
-        bot.send_message(
+        outbox.post(
+            message.chat.id,
+            bot.send_message,
             message.chat.id,
             messages['unknown_error'],
         )
 
 
 def ok_markup() -> InlineKeyboardMarkup:
-    markup = InlineKeyboardMarkup()
-    markup.row_width = 2
-    markup.add(
-        InlineKeyboardButton('Удали', callback_data='ok_remove'),
-        InlineKeyboardButton('Оставь', callback_data='ok_stay'),
-    )
-    return markup
+    return OK_MARKUP
 
 
-@bot.callback_query_handler(
-    func=lambda c: (c.data == 'ok_remove')
-)   # type: ignore
-def ok_remove(call: telebot.types.CallbackQuery) -> None:
+@router.route('ok_remove')
+@instrument('handler')
+def ok_remove(call: telebot.types.CallbackQuery, _: Callback) -> None:
     try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
+        delete_later(call.message.chat.id, call.message.message_id)
     except Exception:
         logger.exception(messages['unknown_error'])
         bot.answer_callback_query(
@@ -228,17 +635,19 @@ def ok_remove(call: telebot.types.CallbackQuery) -> None:
         )
 
 
-@bot.callback_query_handler(
-    func=lambda c: (c.data == 'ok_stay')
-)   # type: ignore
-def ok_stay(call: telebot.types.CallbackQuery) -> None:
+@router.route('ok_stay')
+@instrument('handler')
+def ok_stay(call: telebot.types.CallbackQuery, _: Callback) -> None:
     text = call.message.text
-    text = text[: text.rfind('\n\nУдалить это сообщение или оставить?')]
+    text = text[: text.rfind(messages['keep_or_delete'])]
     try:
-        bot.edit_message_text(
+        outbox.post(
+            call.message.chat.id,
+            bot.edit_message_text,
             text,
             call.message.chat.id,
             call.message.message_id,
+            on_failure=answer_later(call, messages['unknown_error']),
         )
     except Exception:
         logger.exception(messages['unknown_error'])
@@ -253,37 +662,48 @@ def extract_task_text(text: str) -> str:
     return message_parts[1]
 
 
-@bot.callback_query_handler(func=lambda c: (c.data == 'done'))   # type: ignore
-def done(call: telebot.types.CallbackQuery) -> None:
-    with db.atomic():
-        task = list(
-            filter(
-                lambda task: task.message_id == call.message.id,
-                Chat.get(Chat.chat_id == call.message.chat.id).tasks,
+@router.route('done')
+@instrument('handler')
+def done(call: telebot.types.CallbackQuery, callback: Callback) -> None:
+    with write_transaction(db):
+        task = find_task(call.message.chat.id, callback, call.message.id)
+        if task is None:
+            bot.answer_callback_query(call.id, messages['task_not_found'])
+            return
+        # A second tap does not repeat the messages and the GIF
+        if task.is_finished:
+            bot.answer_callback_query(
+                call.id, messages['task_already_finished']
             )
-        )[0]
-
-        task.is_finished = True
-        task.executor = User.get(User.username == call.from_user.username)
-        task.save()
+            return
+        finish_task(task, call.message.chat.id, call.from_user.username)
 
-    text = (
-        call.message.text.replace('#', '')
-        + f'\n\n✅ @{call.from_user.username} сделал задачу!'
+    text = call.message.text.replace('#', '') + render(
+        'task_completed_note', call.from_user.username
     )
     try:
-        bot.edit_message_text(
+        outbox.post(
+            call.message.chat.id,
+            bot.edit_message_text,
             text,
             call.message.chat.id,
             call.message.message_id,
+            on_failure=answer_later(call, messages['unknown_error']),
         )
-        bot.send_message(
+        outbox.post(
+            call.message.chat.id,
+            bot.send_message,
             call.message.chat.id,
-            f'✅ @{call.from_user.username} сделал задачу "{task.text}"!',
+            render('task_completed', call.from_user.username, task.text),
         )
         gif_url = get_gif_url()
         if gif_url:
-            bot.send_animation(call.message.chat.id, gif_url)
+            outbox.post(
+                call.message.chat.id,
+                bot.send_animation,
+                call.message.chat.id,
+                gif_url,
+            )
     except Exception:
         logger.exception(messages['unknown_error'])
         bot.answer_callback_query(
@@ -292,19 +712,19 @@ def done(call: telebot.types.CallbackQuery) -> None:
         )
 
 
-@bot.callback_query_handler(
-    func=lambda c: (c.data == 'cancel')
-)   # type: ignore
-def cancel(call: telebot.types.CallbackQuery) -> None:
-    task = list(
-        filter(
-            lambda task: task.message_id == call.message.id,
-            Chat.get(Chat.chat_id == call.message.chat.id).tasks,
-        )
-    )[0]
-    task.delete_instance()
+@router.route('cancel')
+@instrument('handler')
+def cancel(call: telebot.types.CallbackQuery, callback: Callback) -> None:
+    with write_transaction(db):
+        task = find_task(call.message.chat.id, callback, call.message.id)
+        if task is None:
+            bot.answer_callback_query(call.id, messages['task_not_found'])
+            return
+        delete_task(task, call.message.chat.id)
     try:
-        bot.delete_message(
+        outbox.post(
+            call.message.chat.id,
+            bot.delete_message,
             call.message.chat.id,
             call.message.message_id,
         )
@@ -317,51 +737,48 @@ def cancel(call: telebot.types.CallbackQuery) -> None:
         )
 
 
-def offer_markup() -> InlineKeyboardMarkup:
-    markup = InlineKeyboardMarkup()
-    markup.row_width = 2
-    markup.add(
-        InlineKeyboardButton('Ок', callback_data='offer_yes'),
-        InlineKeyboardButton('Не могу', callback_data='offer_no'),
-    )
-    return markup
-
+def offer_markup(chat_id: int, task_id: int) -> InlineKeyboardMarkup:
+    return OFFER_KEYBOARD.render(chat_id, task_id)
 
-def db_set_task_executor(chat_id: int, message_id: int, username: str) -> None:
-    with db:
-        task = list(
-            filter(
-                lambda task: task.message_id == message_id,
-                Chat.get(Chat.chat_id == chat_id).tasks,
-            )
-        )[0]
 
-        task.executor = User.get(User.username == username)
-        task.save()
+def db_set_task_executor(chat_id: int, task_id: int, username: str) -> bool:
+    with write_transaction(db):
+        task = get_task(task_id)
+        if task is None:
+            return False
+        set_task_executor(task, chat_id, username)
+    return True
 
 
-@bot.callback_query_handler(
-    func=lambda c: (c.data == 'offer_yes')
-)   # type: ignore
-def offer_yes(call: telebot.types.CallbackQuery) -> None:
-    db_set_task_executor(
-        call.message.chat.id,
-        call.message.reply_to_message.message_id,
-        call.from_user.username,
-    )
+@router.route('offer_yes')
+@instrument('handler')
+def offer_yes(call: telebot.types.CallbackQuery, callback: Callback) -> None:
+    with write_transaction(db):
+        task = find_task(
+            call.message.chat.id,
+            callback,
+            call.message.reply_to_message.message_id,
+        )
+        if task is None:
+            bot.answer_callback_query(call.id, messages['task_not_found'])
+            return
+        set_task_executor(task, call.message.chat.id, call.from_user.username)
 
     text = (
         call.message.reply_to_message.text
         + f'\n\n⭐ @{call.from_user.username} вызвался сделать задачу!'
     )
     try:
-        bot.edit_message_text(
+        outbox.post(
+            call.message.chat.id,
+            bot.edit_message_text,
             text,
             call.message.chat.id,
             call.message.reply_to_message.message_id,
-            reply_markup=task_markup(),
+            reply_markup=task_markup(call.message.chat.id, task.id),
+            on_failure=answer_later(call, messages['unknown_error']),
         )
-        bot.delete_message(call.message.chat.id, call.message.message_id)
+        delete_later(call.message.chat.id, call.message.message_id)
 
     except Exception:
         logger.exception(messages['unknown_error'])
@@ -371,12 +788,19 @@ def offer_yes(call: telebot.types.CallbackQuery) -> None:
         )
 
 
-@bot.callback_query_handler(
-    func=lambda c: (c.data == 'offer_no')
-)   # type: ignore
-def offer_no(call: telebot.types.CallbackQuery) -> None:
-    with db:
-        candidates = Chat.get(chat_id=call.message.chat.id).users
+@router.route('offer_no')
+@instrument('handler')
+def offer_no(call: telebot.types.CallbackQuery, callback: Callback) -> None:
+    with db.atomic():
+        task = find_task(
+            call.message.chat.id,
+            callback,
+            call.message.reply_to_message.message_id,
+        )
+        if task is None:
+            bot.answer_callback_query(call.id, messages['task_not_found'])
+            return
+        candidates = get_chat_users(call.message.chat.id)
         candidates = list(
             filter(
                 lambda user: user.username != call.from_user.username,
@@ -390,18 +814,28 @@ def offer_no(call: telebot.types.CallbackQuery) -> None:
             )
             candidate = call.from_user
         else:
-            candidate = choose_executor(db, candidates, call.message.chat.id)
+            candidate = choose_executor(candidates, call.message.chat.id)
         text = (
             call.message.reply_to_message.text
             + f'\n\n⭐ Задачу делает @{candidate.username}!'
         )
+    if not db_set_task_executor(
+        call.message.chat.id, task.id, candidate.username
+    ):
+        bot.answer_callback_query(call.id, messages['task_not_found'])
+        return
+
     try:
-        bot.edit_message_text(
+        outbox.post(
+            call.message.chat.id,
+            bot.edit_message_text,
             text,
             call.message.chat.id,
             call.message.reply_to_message.message_id,
-            reply_markup=task_markup(),
+            reply_markup=task_markup(call.message.chat.id, task.id),
+            on_failure=answer_later(call, messages['unknown_error']),
         )
+        delete_later(call.message.chat.id, call.message.message_id)
 
     except Exception:
         logger.exception(messages['unknown_error'])
@@ -409,98 +843,235 @@ def offer_no(call: telebot.types.CallbackQuery) -> None:
             call.id,
             messages['unknown_error'],
         )
+
+
+def task_markup(chat_id: int, task_id: int) -> InlineKeyboardMarkup:
+    return TASK_KEYBOARD.render(chat_id, task_id)
+
+
+def show_task_note(task: Task) -> None:
+    # The note may take long, the task is read again to know whether users
+    # have reacted to it meanwhile, then its message is not ours anymore
+    with db.atomic():
+        task = get_task(task.id)
+    if task is None or task.is_finished or task.executor_id is not None:
         return
+    try:
+        outbox.post(
+            task.chat.chat_id,
+            bot.edit_message_text,
+            build_task_message(task),
+            task.chat.chat_id,
+            task.message_id,
+            reply_markup=task_markup(task.chat.chat_id, task.id),
+            parse_mode='MarkdownV2',
+        )
+    except Exception:
+        logger.exception('Failed to show task note:')
+
+
+def send_reminders(chat_id: int, task_ids: list[int]) -> None:
     with db.atomic():
-        task = list(
-            filter(
-                lambda task: task.message_id
-                == call.message.reply_to_message.message_id,
-                Chat.get(Chat.chat_id == call.message.chat.id).tasks,
-            )
-        )[0]
+        tasks = get_open_tasks(task_ids)
+    if not tasks:
+        return
+    outbox.post(
+        chat_id,
+        bot.send_message,
+        chat_id,
+        create_reminder(tasks),
+        parse_mode='MarkdownV2',
+    )
 
-        task.executor = User.get(User.username == candidate.username)
-        task.save()
 
-    try:
-        bot.delete_message(call.message.chat.id, call.message.message_id)
+def announce_recurring_tasks(chat_id: int, tasks: list[ActiveTask]) -> None:
+    outbox.post(
+        chat_id,
+        bot.send_message,
+        chat_id,
+        create_recurring_list(tasks),
+        parse_mode='MarkdownV2',
+    )
+
+
+spawner = RecurringSpawner(
+    db,
+    RECURRING_CHECK_INTERVAL,
+    RECURRING_LEAD_DAYS,
+    announce_recurring_tasks,
+)
+
+
+archiver = TaskArchiver(db, ARCHIVE_INTERVAL, ARCHIVE_RETENTION_DAYS)
+
+
+annotator = AnnotationPipeline(
+    ANNOTATION_WORKERS, ANNOTATION_QUEUE_SIZE, show_task_note
+)
+
 
+def report_task_failure(chat_id: int) -> None:
+    try:
+        outbox.post(
+            chat_id,
+            bot.send_message,
+            chat_id,
+            messages['unknown_error'] + messages['keep_or_delete'],
+            reply_markup=ok_markup(),
+        )
     except Exception:
-        logger.exception(messages['unknown_error'])
-        bot.answer_callback_query(
-            call.id,
-            messages['unknown_error'],
+        logger.exception('Failed to send error message:')
+
+
+def offer_task(
+    message: telebot.types.Message,
+    task: Task,
+    task_message: telebot.types.Message,
+) -> None:
+    # Runs in the send thread once the task message is posted
+    try:
+        with write_transaction(db):
+            set_task_message(task, task_message.message_id)
+        annotator.submit(task.id)
+
+        delete_later(message.chat.id, message.message_id)
+
+        # Select all users with at least one task in this chat
+        candidates = get_chat_users(message.chat.id)
+        candidate = choose_executor(candidates, message.chat.id)
+        if not candidate:
+            outbox.post(
+                message.chat.id,
+                bot.send_message,
+                message.chat.id,
+                messages['no_candidates'],
+                reply_markup=ok_markup(),
+            )
+            return
+
+        outbox.post(
+            message.chat.id,
+            bot.reply_to,
+            task_message,
+            messages['offer_being_executor'].format(candidate.username),
+            reply_markup=offer_markup(message.chat.id, task.id),
+            parse_mode=None,
         )
+    except Exception:
+        logger.exception('Failed to create task:')
+        report_task_failure(message.chat.id)
 
 
-def task_markup() -> InlineKeyboardMarkup:
-    markup = InlineKeyboardMarkup()
-    markup.row_width = 2
-    markup.add(
-        InlineKeyboardButton('Выполнить', callback_data='done'),
-        InlineKeyboardButton('Отменить', callback_data='cancel'),
-    )
-    return markup
+def drop_task(message: telebot.types.Message, task: Task, _: object) -> None:
+    # The task message could not be posted
+    try:
+        with write_transaction(db):
+            delete_task(task, message.chat.id)
+    except Exception:
+        logger.exception('Failed to create task:')
+    report_task_failure(message.chat.id)
 
 
 @bot.message_handler()   # type: ignore
+@instrument('handler')
 def create_task(message: telebot.types.Message) -> None:
     task_text = message.text
-    response_message = ''
-    with db:
-        try:
-            task_message = bot.send_message(
-                message.chat.id,
-                messages['creating_task'],
-            )
-            task = Task.create(
+    try:
+        # The task is saved first, its buttons carry the task id
+        with write_transaction(db):
+            task = Task(
                 creator=User.get(User.username == message.from_user.username),
                 text=task_text,
                 chat=Chat.get(message.chat.id == Chat.chat_id),
-                message_id=task_message.message_id,
-            )
-            response_message = build_task_message(task)
-            bot.edit_message_text(
-                response_message,
-                message.chat.id,
-                task_message.message_id,
-                reply_markup=task_markup(),
-                parse_mode='MarkdownV2',
             )
-
-            bot.delete_message(message.chat.id, message.message_id)
-
-            # Select all users with at least one task in this chat
-            candidates = Chat.get(chat_id=message.chat.id).users
-            candidates = list(candidates)
-            candidate = choose_executor(db, candidates, message.chat.id)
-            if not candidate:
-                bot.send_message(
-                    message.chat.id,
-                    messages['no_candidates'],
-                    reply_markup=ok_markup(),
-                )
-                return
-
-            bot.reply_to(
-                task_message,
-                messages['offer_being_executor'].format(candidate.username),
-                reply_markup=offer_markup(),
-                parse_mode=None,
+            add_task(task, message.chat.id)
+        # The task is posted right away, its note is added in background.
+        # The handler does not wait for the message, the executor is
+        # offered once it is posted.
+        outbox.post(
+            message.chat.id,
+            bot.send_message,
+            message.chat.id,
+            build_task_message(task),
+            reply_markup=task_markup(message.chat.id, task.id),
+            parse_mode='MarkdownV2',
+            on_sent=functools.partial(offer_task, message, task),
+            on_failure=functools.partial(drop_task, message, task),
+        )
+    except Exception:
+        logger.exception('Failed to create task:')
+        report_task_failure(message.chat.id)
+
+
+def runtime_gauges() -> list[tuple[str, float]]:
+    gauges = [
+        (f'gif_pool_{name}', value)
+        for name, value in gif_pool.metrics().items()
+    ]
+    gauges.append(('view_cache_hit_rate', view_cache.hit_rate()))
+    gauges.append(('reminders_scheduled', len(reminders)))
+    gauges.append(('gpt_cache_hit_rate', gpt_cache.hit_rate()))
+    gauges.append(('send_queue_pending', outbox.pending()))
+    return gauges
+
+
+def serve() -> None:
+    # A shard learns its chats before the background jobs start
+    shard = None
+    if BOT_RUNTIME == 'shard':
+        shard = sharding.connect(SHARD_INDEX, SHARD_ADDRESS, SHARD_AUTHKEY)
+    metrics_server = None
+    if METRICS_PORT:
+        registry.collect(runtime_gauges)
+        # The bot works without its metrics, a busy port does not stop it
+        try:
+            metrics_server = MetricsServer((METRICS_HOST, METRICS_PORT))
+        except OSError:
+            logger.exception(
+                'Failed to serve metrics on {}:{}', METRICS_HOST, METRICS_PORT
             )
-        except Exception:
-            logger.exception('Failed to create task:')
-
-            try:
-                bot.send_message(
-                    message.chat.id,
-                    messages['unknown_error']
-                    + '\n\nУдалить это сообщение или оставить?',
-                    reply_markup=ok_markup(),
-                )
-            except Exception:
-                logger.exception('Failed to send error message:')
-                return
-
-
-bot.polling(none_stop=True)
+        else:
+            metrics_server.start()
+    outbox.start()
+    gif_pool.start()
+    reminders.start(send_reminders)
+    spawner.start()
+    # The archive is shared, one shard keeps it
+    if BOT_RUNTIME != 'shard' or SHARD_INDEX == 0:
+        archiver.start()
+    snapshotter.start()
+    logger.info('Ready to serve in {:.3f}s', time.perf_counter() - started_at)
+    if shard:
+        shard.serve(bot, SHARD_THREADS, SHARD_QUEUE_SIZE)
+    elif BOT_RUNTIME == 'asyncio':
+        async_runtime.run(bot, ASYNC_WORKERS)
+    elif BOT_RUNTIME == 'webhook':
+        webhook.run(
+            bot,
+            WEBHOOK_URL,
+            (WEBHOOK_HOST, WEBHOOK_PORT),
+            WEBHOOK_SECRET,
+            WEBHOOK_WORKERS,
+            WEBHOOK_QUEUE_SIZE,
+        )
+    else:
+        bot.polling(none_stop=True)
+    annotator.shutdown()
+    gpt_cache.shutdown()
+    spawner.stop()
+    archiver.stop()
+    snapshotter.stop()
+    reminders.stop()
+    gif_pool.stop()
+    outbox.stop()
+    update_log.close()
+    if metrics_server:
+        metrics_server.stop()
+
+
+if __name__ == '__main__':
+    if BOT_RUNTIME == 'sharded':
+        # The dispatcher only routes updates to the shard processes
+        sharding.run(TELEGRAM_BOT_API_TOKEN, SHARD_WORKERS)
+    else:
+        serve()
@@ -0,0 +1,111 @@
+# Description: Callback data of inline buttons. A button carries its
+# action, the id of its target (a task, a recurring task) and a nonce
+# bound to the chat, e.g. "1:d:42:9f86d081", well within the 64 bytes
+# allowed by Telegram. Callbacks are decoded once and routed by action
+# through a dict. Buttons sent before the format existed ("done",
+# "remove_task_42") are decoded without a nonce, the old task buttons
+# also without a task id. Handlers look their targets up in the chat of
+# the button.
+import hashlib
+from collections.abc import Callable
+from typing import NamedTuple
+
+from config import TELEGRAM_BOT_API_TOKEN
+from loguru import logger
+from telebot.types import CallbackQuery
+
+VERSION = '1'
+ACTIONS = {
+    'done': 'd',
+    'cancel': 'c',
+    'offer_yes': 'y',
+    'offer_no': 'n',
+    'remove_task': 'r',
+    'complete_task': 'x',
+    'stop_repeat': 's',
+    'ok_remove': 'o',
+    'ok_stay': 'k',
+    'page_list_prev': 'lp',
+    'page_list_next': 'ln',
+    'page_remove_prev': 'rp',
+    'page_remove_next': 'rn',
+    'page_complete_prev': 'cp',
+    'page_complete_next': 'cn',
+}
+CODES = {code: action for action, code in ACTIONS.items()}
+# Nonces can not be forged without the bot token
+NONCE_KEY = hashlib.sha256((TELEGRAM_BOT_API_TOKEN or '').encode()).digest()
+
+
+class Callback(NamedTuple):
+    action: str
+    # None for buttons without a target and old task buttons
+    target: int | None
+
+
+Handler = Callable[[CallbackQuery, Callback], None]
+
+
+def _nonce(code: str, chat_id: int, target: int) -> str:
+    return hashlib.blake2b(
+        f'{code}:{chat_id}:{target}'.encode(), key=NONCE_KEY, digest_size=4
+    ).hexdigest()
+
+
+def encode(action: str, chat_id: int | None = None, target: int = 0) -> str:
+    # Buttons without a target address nothing and are not bound to a chat
+    code = ACTIONS[action]
+    if chat_id is None:
+        return f'{VERSION}:{code}'
+    return f'{VERSION}:{code}:{target}:{_nonce(code, chat_id, target)}'
+
+
+def decode(data: str, chat_id: int) -> Callback | None:
+    parts = data.split(':')
+    if len(parts) == 1:
+        return _decode_legacy(data)
+    if parts[0] != VERSION or parts[1] not in CODES:
+        return None
+    action = CODES[parts[1]]
+    if len(parts) == 2:  # noqa: PLR2004
+        return Callback(action, None)
+    try:
+        _, code, target, nonce = parts
+        target_id = int(target)
+    except ValueError:
+        return None
+    if nonce != _nonce(code, chat_id, target_id):
+        return None
+    return Callback(action, target_id)
+
+
+def _decode_legacy(data: str) -> Callback | None:
+    action, _, target = data.rpartition('_')
+    if target.isdigit() and action in ACTIONS:
+        return Callback(action, int(target))
+    if data in ACTIONS:
+        return Callback(data, None)
+    return None
+
+
+class CallbackRouter:
+    def __init__(self) -> None:
+        self._handlers: dict[str, Handler] = {}
+
+    def route(self, *actions: str) -> Callable[[Handler], Handler]:
+        def decorator(handler: Handler) -> Handler:
+            for action in actions:
+                self._handlers[action] = handler
+            return handler
+
+        return decorator
+
+    def dispatch(self, call: CallbackQuery) -> bool:
+        # False when the data is unknown or made for another chat
+        callback = decode(call.data, call.message.chat.id)
+        handler = self._handlers.get(callback.action) if callback else None
+        if callback is None or handler is None:
+            logger.warning('Unknown callback data: {}', call.data)
+            return False
+        handler(call, callback)
+        return True
@@ -5,5 +5,77 @@ import dotenv
 dotenv.load_dotenv('.env', verbose=True)
 DATABASE_PATH = './db_files/main.db'
 STATE_DATABASE_PATH = './db_files/state.db'
+# Shared by the shards when several bot processes run, see database.py
+DATABASE_URL = os.environ.get('DATABASE_URL')
+# Connections of a pooled DATABASE_URL, 0 sizes the pool to the threads
+DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', '0'))
 TELEGRAM_BOT_API_TOKEN = os.environ.get('TELEGRAM_BOT_API_TOKEN')
 GIPHY_API_KEY = os.environ.get('GIPHY_API_KEY')
+# Overridden to point the bot at fake services in benchmarks
+GIPHY_API_URL = os.environ.get('GIPHY_API_URL', 'https://api.giphy.com/v1')
+GPT_URL = os.environ.get('GPT_URL', 'https://pelevin.gpt.dobro.ai/generate/')
+# GPT notes cache: number of notes, their age in seconds and the notes
+# kept for each task text
+GPT_CACHE_MAX_SIZE = int(os.environ.get('GPT_CACHE_MAX_SIZE', '10000'))
+GPT_CACHE_MAX_AGE = int(os.environ.get('GPT_CACHE_MAX_AGE', '2592000'))
+GPT_CACHE_VARIANTS = int(os.environ.get('GPT_CACHE_VARIANTS', '3'))
+EXECUTOR_POLICY = os.environ.get('EXECUTOR_POLICY', 'softmax')
+# Lower values give tasks to the least loaded users more strictly
+SOFTMAX_TEMPERATURE = float(os.environ.get('SOFTMAX_TEMPERATURE', '1.0'))
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL')
+BOT_RUNTIME = os.environ.get('BOT_RUNTIME', 'polling')
+# Sharded runtime: the dispatcher (BOT_RUNTIME=sharded) starts
+# SHARD_WORKERS bot processes (BOT_RUNTIME=shard) and passes them their
+# index, the dispatcher address and the key to connect with
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', '4'))
+SHARD_THREADS = int(os.environ.get('SHARD_THREADS', '8'))
+SHARD_QUEUE_SIZE = int(os.environ.get('SHARD_QUEUE_SIZE', '1000'))
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', '0'))
+SHARD_ADDRESS = os.environ.get('SHARD_ADDRESS', '')
+SHARD_AUTHKEY = os.environ.get('SHARD_AUTHKEY', '')
+# Files of the in-memory state are separate for each shard
+STATE_SUFFIX = f'.{SHARD_INDEX}' if BOT_RUNTIME == 'shard' else ''
+ASYNC_WORKERS = int(os.environ.get('ASYNC_WORKERS', '16'))
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', '8'))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '1000'))
+ANNOTATION_WORKERS = int(os.environ.get('ANNOTATION_WORKERS', '4'))
+ANNOTATION_QUEUE_SIZE = int(os.environ.get('ANNOTATION_QUEUE_SIZE', '100'))
+GIF_POOL_PATH = f'./db_files/gifs{STATE_SUFFIX}.json'
+SNAPSHOT_PATH = f'./db_files/state{STATE_SUFFIX}.snapshot'
+SNAPSHOT_INTERVAL = int(os.environ.get('SNAPSHOT_INTERVAL', '300'))
+# Ids of the last processed updates, duplicates of them are dropped
+DEDUP_PATH = f'./db_files/updates{STATE_SUFFIX}.log'
+DEDUP_CAPACITY = int(os.environ.get('DEDUP_CAPACITY', '100000'))
+GIF_POOL_TTL = int(os.environ.get('GIF_POOL_TTL', '3600'))
+GIF_POOL_SIZE = int(os.environ.get('GIF_POOL_SIZE', '100'))
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '10'))
+HTTP_HOST_CONCURRENCY = int(os.environ.get('HTTP_HOST_CONCURRENCY', '4'))
+SEND_QUEUE_WORKERS = int(os.environ.get('SEND_QUEUE_WORKERS', '8'))
+# Telegram flood limits: about 30 messages per second overall and
+# 20 messages per minute in a group
+TELEGRAM_GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '30'))
+TELEGRAM_CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', '0.33'))
+TELEGRAM_CHAT_BURST = int(os.environ.get('TELEGRAM_CHAT_BURST', '5'))
+# Total length of cached task lists and keyboards, in characters
+VIEW_CACHE_MAX_SIZE = int(os.environ.get('VIEW_CACHE_MAX_SIZE', '10000000'))
+TASKS_PAGE_SIZE = int(os.environ.get('TASKS_PAGE_SIZE', '10'))
+# Metrics are served on http://METRICS_HOST:METRICS_PORT/metrics, 0, the
+# default, disables them. Shards serve theirs on the following ports.
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+if BOT_RUNTIME == 'shard' and METRICS_PORT:
+    METRICS_PORT += SHARD_INDEX + 1
+# Hour of the day when deadline reminders are sent
+REMINDER_HOUR = int(os.environ.get('REMINDER_HOUR', '10'))
+# Recurring tasks are created this many days before they are due
+RECURRING_LEAD_DAYS = int(os.environ.get('RECURRING_LEAD_DAYS', '1'))
+RECURRING_CHECK_INTERVAL = int(
+    os.environ.get('RECURRING_CHECK_INTERVAL', '600')
+)
+# Finished tasks are moved to the archive after this many days
+ARCHIVE_RETENTION_DAYS = int(os.environ.get('ARCHIVE_RETENTION_DAYS', '30'))
+ARCHIVE_INTERVAL = int(os.environ.get('ARCHIVE_INTERVAL', '3600'))
@@ -0,0 +1,169 @@
+# Description: Log of processed updates. Update ids and callback query ids
+# are recorded before the handlers run, so an update delivered again after
+# a crash or a retry is dropped. The last keys are kept in a ring with a
+# set for exact lookups, a Bloom filter in front of it answers most
+# lookups of new keys. Keys are appended to a file, which is compacted to
+# the ring when it grows, and read back on start.
+import functools
+import hashlib
+import os
+import struct
+import threading
+from array import array
+from collections.abc import Iterable
+from typing import BinaryIO
+
+import telebot
+from loguru import logger
+from metrics import registry
+from telebot.types import Update
+
+KEY = struct.Struct('<Q')
+BITS_PER_KEY = 10
+HASHES = 7
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little'
+    )
+
+
+class BloomFilter:
+    def __init__(self, size: int) -> None:
+        self._size = size
+        self._bits = bytearray((size + 7) // 8)
+
+    def _positions(self, key_hash: int) -> Iterable[int]:
+        # Double hashing from the two halves of the 64-bit key hash
+        low, high = key_hash & 0xFFFFFFFF, key_hash >> 32
+        return ((low + number * high) % self._size for number in range(HASHES))
+
+    def add(self, key_hash: int) -> None:
+        for position in self._positions(key_hash):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key_hash: int) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key_hash)
+        )
+
+
+class DedupLog:
+    def __init__(self, path: str, capacity: int) -> None:
+        self._path = path
+        self._capacity = capacity
+        self._lock = threading.Lock()
+        self._ring = array('Q', bytes(KEY.size * capacity))
+        self._position = 0
+        self._count = 0
+        self._keys: set[int] = set()
+        # Keys of the ring are in one of two filters, the older filter is
+        # dropped when the newer one has seen a full ring of keys
+        self._filters = [
+            BloomFilter(capacity * BITS_PER_KEY),
+            BloomFilter(capacity * BITS_PER_KEY),
+        ]
+        self._filtered = 0
+        self._file: BinaryIO | None = None
+        self._written = 0
+
+    def load(self) -> None:
+        if os.path.exists(self._path):
+            with open(self._path, 'rb') as file:
+                data = file.read()
+            data = data[: len(data) - len(data) % KEY.size]
+            keys = [key for (key,) in KEY.iter_unpack(data)]
+            with self._lock:
+                for key_hash in keys[-self._capacity :]:
+                    self._add(key_hash)
+            self._written = len(keys)
+            logger.info('Loaded {} processed updates', len(self._keys))
+        self._file = open(self._path, 'ab')  # noqa: SIM115
+
+    def seen(self, key: str) -> bool:
+        # Records the key, True when it was recorded before
+        key_hash = _hash(key)
+        with self._lock:
+            if (
+                key_hash in self._filters[0] or key_hash in self._filters[1]
+            ) and key_hash in self._keys:
+                return True
+            self._add(key_hash)
+            self._write(key_hash)
+        return False
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def _add(self, key_hash: int) -> None:
+        if self._count == self._capacity:
+            self._keys.discard(self._ring[self._position])
+        else:
+            self._count += 1
+        self._ring[self._position] = key_hash
+        self._position = (self._position + 1) % self._capacity
+        self._keys.add(key_hash)
+        if self._filtered == self._capacity:
+            self._filters = [
+                BloomFilter(self._capacity * BITS_PER_KEY),
+                self._filters[0],
+            ]
+            self._filtered = 0
+        self._filters[0].add(key_hash)
+        self._filtered += 1
+
+    def _write(self, key_hash: int) -> None:
+        if not self._file:
+            return
+        self._file.write(KEY.pack(key_hash))
+        self._file.flush()
+        self._written += 1
+        if self._written >= 2 * self._capacity:
+            self._compact()
+
+    def _compact(self) -> None:
+        # Rewrites the file with the keys of the ring, oldest first
+        if self._file:
+            self._file.close()
+        if self._count == self._capacity:
+            keys = self._ring[self._position :] + self._ring[: self._position]
+        else:
+            keys = self._ring[: self._count]
+        with open(f'{self._path}.tmp', 'wb') as file:
+            file.write(keys.tobytes())
+        os.replace(f'{self._path}.tmp', self._path)
+        self._file = open(self._path, 'ab')  # noqa: SIM115
+        self._written = self._count
+
+
+def is_duplicate(log: DedupLog, update: Update) -> bool:
+    duplicate = log.seen(f'u{update.update_id}')
+    if update.callback_query:
+        duplicate = log.seen(f'c{update.callback_query.id}') or duplicate
+    return duplicate
+
+
+def guard(bot: telebot.TeleBot, log: DedupLog) -> None:
+    # Duplicates are dropped in every runtime, they all hand updates to
+    # process_new_updates
+    process_new_updates = bot.process_new_updates
+    duplicates = registry.counter('duplicate_updates_total')
+
+    @functools.wraps(process_new_updates)
+    def deduplicated(updates: list[Update]) -> None:
+        fresh = []
+        for update in updates:
+            if is_duplicate(log, update):
+                duplicates.inc()
+                logger.info('Dropped duplicate update {}', update.update_id)
+            else:
+                fresh.append(update)
+        if fresh:
+            process_new_updates(fresh)
+
+    bot.process_new_updates = deduplicated
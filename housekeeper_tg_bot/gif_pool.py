@@ -0,0 +1,116 @@
+# Description: Local pool of GIF urls refreshed in background, so picking
+# a GIF for a completed task never waits for Giphy.
+import json
+import os
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from random import choice
+
+from loguru import logger
+
+RETRY_INTERVAL = 60
+
+
+class GifPool:
+    def __init__(
+        self,
+        fetch: Callable[[], list[str] | None],
+        ttl: float,
+        size: int,
+        path: str | None = None,
+    ) -> None:
+        self._fetch = fetch
+        self._ttl = ttl
+        self._path = path
+        self._lock = threading.Lock()
+        self._urls: deque[str] = deque(maxlen=size)
+        self._refreshed_at = 0.0
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+        self._load()
+
+    def pick(self) -> str | None:
+        with self._lock:
+            if not self._urls:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return choice(self._urls)  # noqa: S311
+
+    def is_stale(self) -> bool:
+        return time.time() - self._refreshed_at >= self._ttl
+
+    def refresh(self) -> bool:
+        urls = self._fetch()
+        if not urls:
+            # Keep serving the old urls until Giphy is back
+            self.refresh_failures += 1
+            logger.warning('Failed to refresh GIF pool, serving stale pool')
+            return False
+        with self._lock:
+            self._urls.extend(urls)
+            self._refreshed_at = time.time()
+            self.refreshes += 1
+        self._save()
+        return True
+
+    def metrics(self) -> dict[str, int]:
+        return {
+            'size': len(self._urls),
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures,
+        }
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name='gif-pool', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            delay: float
+            if self.is_stale() and not self.refresh():
+                delay = RETRY_INTERVAL
+            else:
+                delay = max(self._refreshed_at + self._ttl - time.time(), 0)
+            self._stopped.wait(delay)
+
+    def _load(self) -> None:
+        if not self._path or not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path) as file:
+                state = json.load(file)
+            self._urls.extend(state['urls'])
+            self._refreshed_at = float(state['refreshed_at'])
+        except Exception:
+            logger.exception('Failed to load GIF pool from {}', self._path)
+
+    def _save(self) -> None:
+        if not self._path:
+            return
+        with self._lock:
+            state = {
+                'urls': list(self._urls),
+                'refreshed_at': self._refreshed_at,
+            }
+        try:
+            with open(f'{self._path}.tmp', 'w') as file:
+                json.dump(state, file)
+            os.replace(f'{self._path}.tmp', self._path)
+        except Exception:
+            logger.exception('Failed to save GIF pool to {}', self._path)
@@ -0,0 +1,138 @@
+# Description: Persistent cache of GPT notes. Household tasks repeat all
+# the time, so notes are stored in the state database by the normalized
+# task text and the preprompt. A key is served from the cache once it has
+# a note, while more variants are fetched in the background until it has
+# enough. Notes older than the age limit and the oldest notes above the
+# size limit are evicted.
+import datetime
+import random
+import re
+import threading
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+from config import GPT_CACHE_MAX_AGE, GPT_CACHE_MAX_SIZE, GPT_CACHE_VARIANTS
+from database import state_db, write_transaction
+from loguru import logger
+from metrics import registry
+from peewee import CharField, DateTimeField, Model, TextField
+
+PUNCTUATION = re.compile(r'[^\w\s]+')
+SPACES = re.compile(r'\s+')
+
+
+class CachedNote(Model):  # type: ignore
+    key = CharField(index=True)
+    text = TextField()
+    created_at = DateTimeField(default=datetime.datetime.now, index=True)
+
+    class Meta:
+        database = state_db
+
+
+def normalize(text: str) -> str:
+    text = PUNCTUATION.sub(' ', text.lower().replace('ё', 'е'))
+    return SPACES.sub(' ', text).strip()
+
+
+def cache_key(text: str, preprompt: str) -> str:
+    return f'{preprompt}\n{normalize(text)}'
+
+
+class GptCache:
+    def __init__(self, max_size: int, max_age: int, variants: int) -> None:
+        self._max_size = max_size
+        self._max_age = datetime.timedelta(seconds=max_age)
+        self._variants = variants
+        self._lock = threading.Lock()
+        self._fetching: set[str] = set()
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='gpt-cache')
+        self._hits = registry.counter('gpt_cache_hits_total')
+        self._misses = registry.counter('gpt_cache_misses_total')
+
+    def create_table(self) -> None:
+        with write_transaction(state_db):
+            state_db.create_tables([CachedNote], safe=True)
+
+    def get(self, key: str, fetch: Callable[[], str]) -> str:
+        # A miss waits for fetch, a key short of variants is served right
+        # away and fetches one more note in the background
+        notes = [
+            note.text
+            for note in CachedNote.select(CachedNote.text)
+            .where(
+                CachedNote.key == key,
+                CachedNote.created_at >= self._cutoff(),
+            )
+            .order_by(CachedNote.id.desc())
+            .limit(self._variants)
+        ]
+        if not notes:
+            self._misses.inc()
+            return self._fetch(key, fetch)
+        self._hits.inc()
+        if len(notes) < self._variants:
+            self._fetch_later(key, fetch)
+        return random.choice(notes)  # noqa: S311
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def put(self, key: str, text: str) -> None:
+        with self._lock, write_transaction(state_db):
+            CachedNote.create(key=key, text=text)
+            # Notes of a key above the variants, e.g. from concurrent misses
+            newest = (
+                CachedNote.select(CachedNote.id)
+                .where(CachedNote.key == key)
+                .order_by(CachedNote.id.desc())
+                .limit(self._variants)
+            )
+            CachedNote.delete().where(
+                CachedNote.key == key, CachedNote.id.not_in(newest)
+            ).execute()
+            CachedNote.delete().where(
+                CachedNote.created_at < self._cutoff()
+            ).execute()
+            excess = CachedNote.select().count() - self._max_size
+            if excess > 0:
+                oldest = (
+                    CachedNote.select(CachedNote.id)
+                    .order_by(CachedNote.id)
+                    .limit(excess)
+                )
+                CachedNote.delete().where(CachedNote.id.in_(oldest)).execute()
+
+    def hit_rate(self) -> float:
+        total = self._hits.value + self._misses.value
+        return self._hits.value / total if total else 0.0
+
+    def _fetch(self, key: str, fetch: Callable[[], str]) -> str:
+        text = fetch()
+        if text:
+            self.put(key, text)
+        return text
+
+    def _fetch_later(self, key: str, fetch: Callable[[], str]) -> None:
+        # One fetch of a key at a time, notes of the requests meanwhile
+        # come from the cache
+        with self._lock:
+            if key in self._fetching:
+                return
+            self._fetching.add(key)
+        self._executor.submit(self._fetch_variant, key, fetch)
+
+    def _fetch_variant(self, key: str, fetch: Callable[[], str]) -> None:
+        try:
+            self._fetch(key, fetch)
+        except Exception:
+            logger.exception('Failed to fetch a note variant')
+        finally:
+            with self._lock:
+                self._fetching.discard(key)
+
+    def _cutoff(self) -> datetime.datetime:
+        return datetime.datetime.now() - self._max_age
+
+
+gpt_cache = GptCache(GPT_CACHE_MAX_SIZE, GPT_CACHE_MAX_AGE, GPT_CACHE_VARIANTS)
@@ -0,0 +1,144 @@
+# Description: Shared client for outbound HTTP calls (Giphy, GPT).
+# Connections are kept alive in a pool, concurrency is limited per host,
+# failed calls are retried with jitter and failing hosts are cut off by a
+# circuit breaker for a while.
+import threading
+import time
+from contextlib import AbstractContextManager
+from random import uniform
+from typing import Any
+from urllib.parse import urlsplit
+
+import requests
+from loguru import logger
+from metrics import Counter, Histogram, registry
+from requests.adapters import HTTPAdapter
+
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_timeout: float) -> None:
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: float | None = None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            # After the timeout one more attempt is let through, the
+            # breaker opens again right away if it fails
+            if time.monotonic() - self._opened_at >= self._reset_timeout:
+                self._opened_at = None
+                self._failures = self._failure_threshold - 1
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self._failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class HttpClient:
+    def __init__(
+        self,
+        pool_size: int = 10,
+        host_concurrency: int = 4,
+        retries: int = 2,
+        backoff: float = 0.5,
+    ) -> None:
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size
+        )
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._host_concurrency = host_concurrency
+        self._retries = retries
+        self._backoff = backoff
+        self._lock = threading.Lock()
+        self._host_limits: dict[str, threading.BoundedSemaphore] = {}
+        self._breakers: dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        endpoint: str | None = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        parts = urlsplit(url)
+        host = parts.netloc
+        endpoint = endpoint or f'{host}{parts.path}'
+        breaker = self._breaker(host)
+        if not breaker.allow():
+            registry.counter('http_rejected_total', endpoint=endpoint).inc()
+            raise CircuitOpenError(host)
+
+        for attempt in range(self._retries + 1):
+            if attempt:
+                delay = self._backoff * 2 ** (attempt - 1)
+                time.sleep(delay * uniform(0.5, 1.5))  # noqa: S311
+            started = time.perf_counter()
+            try:
+                with self._host_limit(host):
+                    response = self._session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._histogram(endpoint).observe(
+                    time.perf_counter() - started
+                )
+                breaker.record_failure()
+                self._error(endpoint).inc()
+                if attempt == self._retries:
+                    raise
+                logger.warning('Retrying {} {}', method, endpoint)
+                continue
+            self._histogram(endpoint).observe(time.perf_counter() - started)
+            if response.status_code < 500:  # noqa: PLR2004
+                breaker.record_success()
+                return response
+            breaker.record_failure()
+            self._error(endpoint).inc()
+        return response
+
+    def _host_limit(self, host: str) -> AbstractContextManager[bool]:
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(
+                    self._host_concurrency
+                )
+            return self._host_limits[host]
+
+    def _breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            if host not in self._breakers:
+                self._breakers[host] = CircuitBreaker(
+                    FAILURE_THRESHOLD, RESET_TIMEOUT
+                )
+            return self._breakers[host]
+
+    def _histogram(self, endpoint: str) -> Histogram:
+        return registry.histogram('http_request_seconds', endpoint=endpoint)
+
+    def _error(self, endpoint: str) -> Counter:
+        return registry.counter('http_errors_total', endpoint=endpoint)
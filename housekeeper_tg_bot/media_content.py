@@ -1,30 +1,47 @@
-from random import choice
-
-import requests
-from config import GIPHY_API_KEY
+from config import (
+    GIF_POOL_PATH,
+    GIF_POOL_SIZE,
+    GIF_POOL_TTL,
+    GIPHY_API_KEY,
+    GIPHY_API_URL,
+    GPT_URL,
+    HTTP_HOST_CONCURRENCY,
+    HTTP_POOL_SIZE,
+)
+from gif_pool import GifPool
+from http_client import CircuitOpenError, HttpClient
 from loguru import logger
+from metrics import instrument
 from requests.exceptions import ReadTimeout
 from urllib3.exceptions import ReadTimeoutError
 
 SUCCESS_CODE = 200
-GIPHY_URL = f'https://api.giphy.com/v1/gifs/trending?api_key={GIPHY_API_KEY}&limit=25&rating=g'   # noqa: E501
-GPT_URL = 'https://pelevin.gpt.dobro.ai/generate/'
+GIPHY_URL = f'{GIPHY_API_URL}/gifs/trending?api_key={GIPHY_API_KEY}&limit=25&rating=g'   # noqa: E501
 logger.info(GIPHY_URL)
 
+http = HttpClient(
+    pool_size=HTTP_POOL_SIZE, host_concurrency=HTTP_HOST_CONCURRENCY
+)
+
 
+@instrument('function')
 def get_gpt_response(prompt: str) -> str:
     # Gets a response from GPT-3 at https://pelevin.gpt.dobro.ai/generate/
 
     request_body = {'prompt': prompt, 'length': 39}
     try:
-        response = requests.post(
+        response = http.post(
             GPT_URL,
+            endpoint='gpt',
             json=request_body,
             timeout=5,
         )
     except (ReadTimeout, ReadTimeoutError, TimeoutError) as e:
         logger.error('GPT-3 request timeout: {}', e)
         return ''
+    except CircuitOpenError:
+        logger.warning('GPT-3 is unavailable, request skipped')
+        return ''
     except Exception:
         logger.exception('GPT-3 request failed')
         return ''
@@ -35,14 +52,18 @@ def get_gpt_response(prompt: str) -> str:
     return str(response.json()['replies'][0])
 
 
-def get_gif_url() -> str | None:
-    # Gets a random GIF from Giphy at https://developers.giphy.com/docs/api/endpoint#trending
+@instrument('function')
+def fetch_trending_gif_urls() -> list[str] | None:
+    # Gets trending GIFs from Giphy at https://developers.giphy.com/docs/api/endpoint#trending
 
     try:
-        response = requests.get(GIPHY_URL, timeout=5)
+        response = http.get(GIPHY_URL, endpoint='giphy_trending', timeout=5)
     except (ReadTimeout, ReadTimeoutError, TimeoutError) as e:
         logger.error('Giphy request timeout: {}', e)
         return None
+    except CircuitOpenError:
+        logger.warning('Giphy is unavailable, request skipped')
+        return None
     except Exception:
         logger.exception('Giphy request failed')
         return None
@@ -51,4 +72,15 @@ def get_gif_url() -> str | None:
         logger.error('Giphy request failed: {}', response.text)
         return None
     gifs = response.json()['data']
-    return str(choice(gifs)['images']['original']['url'])
+    return [str(gif['images']['original']['url']) for gif in gifs]
+
+
+gif_pool = GifPool(
+    fetch_trending_gif_urls, GIF_POOL_TTL, GIF_POOL_SIZE, GIF_POOL_PATH
+)
+
+
+@instrument('function')
+def get_gif_url() -> str | None:
+    # Gets a random GIF from the prefetched pool, without network requests
+    return gif_pool.pick()
@@ -0,0 +1,96 @@
+# Description: Users of each chat, kept in memory so choosing an executor
+# does not query the many-to-many table. Chats missing here are loaded
+# from the database on first use.
+import threading
+
+from database import write_transaction
+from models import Chat, User
+from peewee import Database, ModelSelect
+
+
+class MembershipCache:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # Telegram chat id -> (user id, username) of its users
+        self._members: dict[int, list[tuple[int, str]]] = {}
+        # Users set or added during a rebuild: (chat id, users, whether
+        # they replace the users of the chat)
+        self._journal: (
+            list[tuple[int, list[tuple[int, str]], bool]] | None
+        ) = None
+
+    def rebuild(self, db: Database) -> None:
+        members: dict[int, list[tuple[int, str]]] = {}
+        # Users are added in write transactions, none is half done while
+        # the users are read in one, see WorkloadCounter.rebuild
+        with write_transaction(db):
+            with self._lock:
+                self._journal = []
+            for chat_id, user_id, username in query_members().tuples():
+                members.setdefault(chat_id, []).append((user_id, username))
+        with self._lock:
+            for chat_id, users, replace in self._journal:
+                if replace:
+                    members[chat_id] = list(users)
+                elif chat_id in members:
+                    _add_members(members[chat_id], users)
+            self._journal = None
+            self._members = members
+
+    def users(self, chat_id: int) -> list[User] | None:
+        with self._lock:
+            members = self._members.get(chat_id)
+        if members is None:
+            return None
+        return [User(id=user_id, username=name) for user_id, name in members]
+
+    def set(self, chat_id: int, users: list[User]) -> None:
+        members = [(user.id, user.username) for user in users]
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((chat_id, members, True))
+            self._members[chat_id] = list(members)
+
+    def add(self, chat_id: int, user: User) -> None:
+        members = [(user.id, user.username)]
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((chat_id, members, False))
+            if chat_id in self._members:
+                _add_members(self._members[chat_id], members)
+
+    def items(self) -> list[tuple[int, list[tuple[int, str]]]]:
+        with self._lock:
+            return [
+                (chat_id, list(members))
+                for chat_id, members in self._members.items()
+            ]
+
+    def load(self, members: dict[int, list[tuple[int, str]]]) -> None:
+        with self._lock:
+            self._members = members
+
+
+def _add_members(
+    members: list[tuple[int, str]], added: list[tuple[int, str]]
+) -> None:
+    # A user added again, e.g. by a replayed change, is kept once
+    known = {user_id for user_id, _ in members}
+    members.extend(member for member in added if member[0] not in known)
+
+
+def query_members(chat_id: int | None = None) -> ModelSelect:
+    through = Chat.users.get_through_model()
+    query = (
+        through.select(Chat.chat_id, User.id, User.username)
+        .join(Chat)
+        .switch(through)
+        .join(User)
+        .order_by(User.id)
+    )
+    if chat_id is not None:
+        query = query.where(Chat.chat_id == chat_id)
+    return query
+
+
+membership = MembershipCache()
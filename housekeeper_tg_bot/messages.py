@@ -4,16 +4,59 @@ messages: dict[str, str] = {
 
 Доступные команды:
 /add_me - добавит вас в группу людей, по которым распределяются таски 
-/tasks - выведет список ваших тасков""",
+/tasks - выведет список ваших тасков
+/bulk - добавит несколько тасков сразу, по одному на строку
+/repeat - добавит регулярный таск
+/stop_repeat - отменит регулярный таск""",
     'created_user': """@{} добавлен(а) в список на распределение задач!""",
     'user_already_exists': """{} уже есть в списке на распределение задач!""",
     'unknown_error': """Произошла неизвестная ошибка!""",
     'no_tasks': """У вас нет незавершенных тасков!""",
     'offer_being_executor': """Предлагаю @{} стать исполнителем этого таска!
 Как ты на это смотришь?""",
-    'creating_task': """Записываю таск...""",
+    'task_not_found': """Задача не найдена!""",
+    'task_already_finished': """Задача уже выполнена!""",
+    'bulk_usage': """Напишите таски после команды, по одному на строку:
+/bulk
+Вынести мусор
+Помыть посуду""",
+    'bulk_created': """Добавлено тасков: {}
+
+{}""",
+    'repeat_usage': """Напишите, раз в сколько дней повторять таск (от 1 до 3650), и сам таск:
+/repeat 7 Вынести мусор""",
+    'repeat_created': """Таск «{}» будет повторяться раз в {} дн.""",
+    'no_recurring_tasks': """Регулярных тасков нет!""",
+    'recurring_spawned': """🔁 Новые регулярные таски:
+
+""",
+    'deadline_reminder': """⏰ Пора сделать эти задачи, срок уже подошёл:
+
+""",
     'no_candidates': """К сожалению, некому поручить эту задачу :(
 попробуйте добавиться в мой распределительный список с помощью команды /add_me
 
 Удалить это сообщение или оставить?""",
+    'keep_or_delete': """
+
+Удалить это сообщение или оставить?""",
+    'task_message': """\\#task от @{}
+
+{}
+
+{}""",
+    'task_line': """{}
+Исполнитель: @{}
+
+""",
+    'task_line_unassigned': """{}
+
+""",
+    'task_completed': """✅ @{} сделал задачу "{}"!""",
+    'task_completed_note': """
+
+✅ @{} сделал задачу!""",
+    'task_completed_note_markdown': """
+
+✅ @{} сделал задачу\\!""",
 }
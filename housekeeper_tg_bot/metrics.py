@@ -0,0 +1,215 @@
+# Description: Runtime metrics. Counters and latency histograms are kept
+# in memory and served in the Prometheus text format on a local HTTP
+# endpoint. Handlers and outbound calls are measured with the instrument
+# decorator, database queries are counted per thread.
+import bisect
+import functools
+import threading
+import time
+from collections.abc import Callable, Iterable
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, TypeVar
+
+from loguru import logger
+from peewee import Database
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+
+Labels = tuple[tuple[str, str], ...]
+Function = TypeVar('Function', bound=Callable[..., Any])
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # The last bucket counts everything above the buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.total += value
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, Labels], Counter] = {}
+        self._histograms: dict[tuple[str, Labels], Histogram] = {}
+        self._collectors: list[Callable[[], Iterable[tuple[str, float]]]] = []
+
+    def counter(self, name: str, **labels: str) -> Counter:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._counters:
+                self._counters[key] = Counter()
+            return self._counters[key]
+
+    def histogram(
+        self,
+        name: str,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        **labels: str,
+    ) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            return self._histograms[key]
+
+    def collect(
+        self, collector: Callable[[], Iterable[tuple[str, float]]]
+    ) -> None:
+        # Gauges read from other components when the metrics are served
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = list(self._histograms.items())
+            collectors = list(self._collectors)
+        lines = []
+        typed = set()
+        for (name, labels), counter in sorted(
+            counters, key=lambda item: item[0]
+        ):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{_labels(labels)} {counter.value}')
+        for (name, labels), histogram in sorted(
+            histograms, key=lambda item: item[0]
+        ):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bucket, count in zip(
+                (*histogram.buckets, '+Inf'), histogram.counts, strict=True
+            ):
+                cumulative += count
+                bucket_labels = (*labels, ('le', str(bucket)))
+                lines.append(
+                    f'{name}_bucket{_labels(bucket_labels)} {cumulative}'
+                )
+            lines.append(f'{name}_sum{_labels(labels)} {histogram.total}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+        for collector in collectors:
+            try:
+                lines.extend(f'{name} {value}' for name, value in collector())
+            except Exception:
+                logger.exception('Failed to collect metrics')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{value}"' for key, value in labels)
+    return f'{{{pairs}}}'
+
+
+registry = Registry()
+_queries = threading.local()
+
+
+def query_count() -> int:
+    # Database queries made by the current thread so far
+    return getattr(_queries, 'count', 0)
+
+
+def count_queries(db: Database) -> None:
+    execute_sql = db.execute_sql
+    total = registry.counter('db_queries_total')
+
+    @functools.wraps(execute_sql)
+    def counted(*args: Any, **kwargs: Any) -> Any:
+        _queries.count = query_count() + 1
+        total.inc()
+        return execute_sql(*args, **kwargs)
+
+    db.execute_sql = counted
+
+
+def instrument(kind: str) -> Callable[[Function], Function]:
+    # Records latency, errors and database queries of every call, labeled
+    # with the function name. kind prefixes the metric names.
+    def decorator(function: Function) -> Function:
+        name = function.__name__
+        latency = registry.histogram(f'{kind}_seconds', **{kind: name})
+        queries = registry.histogram(
+            f'{kind}_db_queries', QUERY_BUCKETS, **{kind: name}
+        )
+        errors = registry.counter(f'{kind}_errors_total', **{kind: name})
+
+        @functools.wraps(function)
+        def instrumented(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            queries_before = query_count()
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                errors.inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started)
+                queries.observe(query_count() - queries_before)
+
+        return instrumented  # type: ignore
+
+    return decorator
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path != '/metrics':
+            self.send_response(HTTPStatus.NOT_FOUND)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = registry.render().encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        logger.debug('Metrics request: {}', format % args)
+
+
+class MetricsServer:
+    def __init__(self, address: tuple[str, int]) -> None:
+        self._server = ThreadingHTTPServer(address, MetricsRequestHandler)
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='metrics', daemon=True
+        )
+        self._thread.start()
+        logger.info(
+            'Serving metrics on http://{}:{}/metrics',
+            *self._server.server_address[:2],
+        )
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
@@ -1,19 +1,22 @@
 import datetime
 
-from config import DATABASE_PATH
+from database import db, write_transaction
 from peewee import (
     BooleanField,
     CharField,
     DateField,
+    DateTimeField,
     ForeignKeyField,
     IntegerField,
     ManyToManyField,
     Model,
-    SqliteDatabase,
     TextField,
 )
+from playhouse.migrate import SchemaMigrator, migrate
 
-db = SqliteDatabase(DATABASE_PATH, pragmas={'foreign_keys': 1})
+
+def default_deadline() -> datetime.date:
+    return datetime.date.today() + datetime.timedelta(days=1)
 
 
 class BaseModel(Model):  # type: ignore
@@ -37,11 +40,98 @@ class Task(BaseModel):
     executor = ForeignKeyField(model=User, backref='finished_tasks', null=True)
     chat = ForeignKeyField(model=Chat, backref='tasks', on_delete='CASCADE')
     text = TextField()
-    deadline = DateField(
-        default=datetime.date.today() + datetime.timedelta(days=1)
-    )
+    deadline = DateField(default=default_deadline)
     is_finished = BooleanField(default=False)
-    message_id = IntegerField()
+    # Tasks created in bulk have no message of their own
+    message_id = IntegerField(null=True)
+    # Generated "important note" shown under the task text
+    note = TextField(default='')
+    finished_time = DateTimeField(null=True)
 
     class Meta:
         database = db
+        indexes = (
+            (('chat', 'executor', 'is_finished'), False),
+            (('chat', 'message_id'), True),
+            # Active tasks of a chat in id order, for paginated lists
+            (('chat', 'is_finished'), False),
+            # Open tasks by deadline, for deadline reminders
+            (('is_finished', 'deadline'), False),
+            # Finished tasks by age, for archiving
+            (('is_finished', 'finished_time'), False),
+        )
+
+
+class RecurringTask(BaseModel):
+    # A task repeated every interval_days, its next occurrence becomes
+    # a Task shortly before it is due
+    creator = ForeignKeyField(
+        model=User, backref='recurring_tasks', on_delete='CASCADE'
+    )
+    chat = ForeignKeyField(
+        model=Chat, backref='recurring_tasks', on_delete='CASCADE'
+    )
+    text = TextField()
+    interval_days = IntegerField()
+    next_occurrence = DateField(default=default_deadline, index=True)
+
+
+class ArchivedTask(BaseModel):
+    # A finished task moved out of the Task table, see archive.py
+    creator = ForeignKeyField(
+        model=User, backref='archived_tasks', on_delete='CASCADE'
+    )
+    executor = ForeignKeyField(model=User, null=True)
+    chat = ForeignKeyField(
+        model=Chat, backref='archived_tasks', on_delete='CASCADE'
+    )
+    text = TextField()
+    deadline = DateField()
+    finished_time = DateTimeField(null=True)
+
+
+class UserRollup(BaseModel):
+    # Counters of the archived tasks of a user in a chat
+    chat = ForeignKeyField(model=Chat, backref='rollups', on_delete='CASCADE')
+    user = ForeignKeyField(model=User, backref='rollups', on_delete='CASCADE')
+    executed_count = IntegerField(default=0)
+    created_count = IntegerField(default=0)
+
+    class Meta:
+        database = db
+        indexes = ((('chat', 'user'), True),)
+
+
+MODELS = [
+    User,
+    Task,
+    Chat,
+    Chat.users.get_through_model(),
+    RecurringTask,
+    ArchivedTask,
+    UserRollup,
+]
+
+
+def migrate_tasks() -> None:
+    # Task tables of earlier versions get the columns added since then,
+    # before the indexes on them are created
+    columns = {column.name: column for column in db.get_columns('task')}
+    migrator = SchemaMigrator.from_database(db)
+    operations = [
+        migrator.add_column('task', field.column_name, field)
+        for field in (Task.note, Task.finished_time)
+        if field.column_name not in columns
+    ]
+    # Tasks created in bulk have no message
+    if not columns['message_id'].null:
+        operations.append(migrator.drop_not_null('task', 'message_id'))
+    if operations:
+        migrate(*operations)
+
+
+def create_tables() -> None:
+    with write_transaction(db):
+        if db.table_exists(Task._meta.table_name):
+            migrate_tasks()
+        db.create_tables(MODELS, safe=True)
@@ -0,0 +1,234 @@
+# Description: Recurring tasks. Every tick the rules which are due soon
+# are turned into ordinary tasks and moved to their next occurrence. Rules
+# are read by id in batches of plain rows, each batch is a transaction of
+# its own and its tasks are announced once it is committed, so a tick
+# holds the write lock and the rules of only one batch at a time.
+import datetime
+import threading
+from collections import defaultdict
+from collections.abc import Callable
+from typing import NamedTuple
+
+from database import write_transaction
+from loguru import logger
+from models import Chat, RecurringTask, User
+from peewee import Database
+from repository import ActiveTask, insert_tasks
+from sharding import ownership
+from utils import choose_executors
+
+BATCH_SIZE = 300
+# Longer intervals are refused, far dates overflow datetime.date
+MAX_INTERVAL_DAYS = 3650
+
+
+class DueRule(NamedTuple):
+    id: int
+    chat: int
+    chat_id: int
+    creator: int
+    text: str
+    interval_days: int
+    next_occurrence: datetime.date
+
+
+def due_rules(
+    until: datetime.date, after_id: int, batch_size: int
+) -> list[DueRule]:
+    # A batch of rules with an occurrence until the date
+    query = (
+        RecurringTask.select(
+            RecurringTask.id,
+            RecurringTask.chat,
+            Chat.chat_id,
+            RecurringTask.creator,
+            RecurringTask.text,
+            RecurringTask.interval_days,
+            RecurringTask.next_occurrence,
+        )
+        .join(Chat)
+        .where(
+            RecurringTask.next_occurrence <= until,
+            RecurringTask.id > after_id,
+        )
+        .order_by(RecurringTask.id)
+        .limit(batch_size)
+    )
+    return [DueRule(*row) for row in query.tuples()]
+
+
+def parse_repeat(text: str) -> tuple[int, str] | None:
+    # "/repeat 7 Вынести мусор" as the interval in days and the task text
+    command_parts = text.split(maxsplit=2)
+    if (
+        len(command_parts) < 3  # noqa: PLR2004
+        or not command_parts[1].isdecimal()
+    ):
+        return None
+    interval_days = int(command_parts[1])
+    if not 1 <= interval_days <= MAX_INTERVAL_DAYS:
+        return None
+    return interval_days, command_parts[2].strip()
+
+
+def next_occurrence(rule: DueRule, today: datetime.date) -> datetime.date:
+    # Occurrences missed while the bot was down are skipped
+    interval = datetime.timedelta(days=rule.interval_days)
+    occurrence = rule.next_occurrence + interval
+    if occurrence < today:
+        missed = (today - occurrence) // interval
+        occurrence += interval * (missed + 1)
+    return occurrence
+
+
+def load_members(chats: set[int]) -> dict[int, list[User]]:
+    # Users of the chats, by Chat primary key
+    members: dict[int, list[User]] = {chat: [] for chat in chats}
+    if not chats:
+        return members
+    through = Chat.users.get_through_model()
+    query = (
+        through.select(through.chat, User)
+        .join(User)
+        .where(through.chat.in_(list(chats)))
+        .order_by(User.id)
+    )
+    for membership in query:
+        members[membership.chat_id].append(membership.user)
+    return members
+
+
+def move_rules(batch: list[DueRule], today: datetime.date) -> list[DueRule]:
+    # Moves the rules to their next occurrence and returns the moved ones.
+    # A rule which can not be moved is skipped, so it does not fail the
+    # rules of other chats in its batch.
+    moves = defaultdict(list)
+    moved = []
+    for rule in batch:
+        try:
+            occurrence = next_occurrence(rule, today)
+        except Exception:
+            logger.exception('Failed to move recurring task {}', rule.id)
+            continue
+        moves[occurrence].append(rule.id)
+        moved.append(rule)
+    # Rules moving to the same date are updated with one query
+    for occurrence, rule_ids in moves.items():
+        RecurringTask.update(next_occurrence=occurrence).where(
+            RecurringTask.id.in_(rule_ids)
+        ).execute()
+    return moved
+
+
+def spawn_batch(
+    batch: list[DueRule], today: datetime.date
+) -> dict[int, list[ActiveTask]]:
+    batch = move_rules(batch, today)
+    members = load_members({rule.chat for rule in batch})
+    by_chat = defaultdict(list)
+    for rule in batch:
+        by_chat[rule.chat_id].append(rule)
+
+    rows = []
+    chat_ids = {}
+    spawned = defaultdict(list)
+    for chat_id, rules in by_chat.items():
+        users = members[rules[0].chat]
+        # Occurrences are spread like new tasks, by the current workload
+        executors = choose_executors(users, chat_id, len(rules))
+        chat_ids[rules[0].chat] = chat_id
+        for number, rule in enumerate(rules):
+            executor = executors[number] if executors else None
+            rows.append(
+                {
+                    'chat': rule.chat,
+                    'creator': rule.creator,
+                    'text': rule.text,
+                    'executor': executor,
+                    'deadline': rule.next_occurrence,
+                }
+            )
+            # The ids are not known before the insert and not needed to
+            # announce the tasks
+            spawned[chat_id].append(
+                ActiveTask(0, rule.text, executor and executor.username)
+            )
+    insert_tasks(rows, chat_ids)
+    return spawned
+
+
+def spawn_due(
+    db: Database,
+    today: datetime.date,
+    lead_days: int,
+    on_spawned: Callable[[int, list[ActiveTask]], None],
+) -> int:
+    # Tasks of each batch are passed to on_spawned by Telegram chat, a chat
+    # whose rules fall into several batches gets each part separately
+    until = today + datetime.timedelta(days=lead_days)
+    count = 0
+    last_id = 0
+    while True:
+        with write_transaction(db):
+            batch = due_rules(until, last_id, BATCH_SIZE)
+            if not batch:
+                return count
+            # Rules of chats served by other shards are left to them
+            owned = [rule for rule in batch if ownership.owns(rule.chat_id)]
+            spawned = spawn_batch(owned, today)
+        last_id = batch[-1].id
+        for chat_id, tasks in spawned.items():
+            count += len(tasks)
+            on_spawned(chat_id, tasks)
+
+
+class RecurringSpawner:
+    def __init__(
+        self,
+        db: Database,
+        interval: float,
+        lead_days: int,
+        on_spawned: Callable[[int, list[ActiveTask]], None],
+    ) -> None:
+        self._db = db
+        self._interval = interval
+        self._lead_days = lead_days
+        self._on_spawned = on_spawned
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def tick(self, today: datetime.date | None = None) -> int:
+        count = spawn_due(
+            self._db,
+            today or datetime.date.today(),
+            self._lead_days,
+            self._announce,
+        )
+        if count:
+            logger.info('Spawned {} recurring tasks', count)
+        return count
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name='recurring', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception('Failed to spawn recurring tasks')
+            self._stopped.wait(self._interval)
+
+    def _announce(self, chat_id: int, tasks: list[ActiveTask]) -> None:
+        try:
+            self._on_spawned(chat_id, tasks)
+        except Exception:
+            logger.exception('Failed to announce tasks in {}', chat_id)
@@ -0,0 +1,207 @@
+# Description: Deadline reminders. Upcoming reminders are kept in a heap
+# ordered by time, so a tick only looks at the tasks which are due. Tasks
+# are reminded about once a day at REMINDER_HOUR, starting from their
+# deadline day, until they are finished or deleted.
+import datetime
+import heapq
+import threading
+from collections import defaultdict
+from collections.abc import Callable
+
+from config import REMINDER_HOUR
+from database import write_transaction
+from loguru import logger
+from models import Chat, Task
+from peewee import Database
+from sharding import ownership
+
+# Upper bound of a sleep, so wall clock jumps are noticed
+MAX_WAIT = 60
+# Cancelled entries are left in the heap and dropped when popped, the heap
+# is rebuilt once they take more than this share of it
+MAX_STALE_SHARE = 0.5
+
+# Reminder time and chat id of a task
+Entry = tuple[datetime.datetime, int]
+
+
+class ReminderScheduler:
+    def __init__(
+        self,
+        hour: int,
+        clock: Callable[[], datetime.datetime] = datetime.datetime.now,
+        notify: Callable[[int, list[int]], None] | None = None,
+    ) -> None:
+        self._time = datetime.time(hour)
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._heap: list[tuple[datetime.datetime, int]] = []
+        # The entry of each task, other heap entries of the task are stale
+        self._scheduled: dict[int, Entry] = {}
+        self._notify = notify
+        self._stopped = False
+        self._thread: threading.Thread | None = None
+        # Tasks scheduled or cancelled during a rebuild, None for a cancel
+        self._journal: list[tuple[int, Entry | None]] | None = None
+
+    def rebuild(self, db: Database) -> None:
+        now = self._clock()
+        scheduled = {}
+        # Tasks are scheduled in write transactions, reading in one means
+        # each is either in the tasks read or in the journal, see
+        # WorkloadCounter.rebuild
+        with write_transaction(db):
+            with self._condition:
+                self._journal = []
+            query = (
+                Task.select(Task.id, Chat.chat_id, Task.deadline)
+                .join(Chat)
+                .where(Task.is_finished == False)  # noqa: E712
+                .tuples()
+            )
+            for task_id, chat_id, deadline in query.iterator():
+                scheduled[task_id] = (self._remind_at(deadline, now), chat_id)
+        with self._condition:
+            self._replace(scheduled)
+        logger.info('Scheduled {} deadline reminders', len(scheduled))
+
+    def items(self) -> list[tuple[int, int, float]]:
+        # (task id, chat id, reminder timestamp) of every scheduled task
+        with self._condition:
+            return [
+                (task_id, chat_id, remind_at.timestamp())
+                for task_id, (remind_at, chat_id) in self._scheduled.items()
+            ]
+
+    def load(self, items: list[tuple[int, int, float]]) -> None:
+        next_slot = self._next_slot(self._clock())
+        scheduled = {
+            task_id: (
+                max(datetime.datetime.fromtimestamp(timestamp), next_slot),
+                chat_id,
+            )
+            for task_id, chat_id, timestamp in items
+        }
+        with self._condition:
+            self._replace(scheduled)
+
+    def schedule(
+        self, task_id: int, chat_id: int, deadline: datetime.date
+    ) -> None:
+        remind_at = self._remind_at(deadline, self._clock())
+        with self._condition:
+            if self._journal is not None:
+                self._journal.append((task_id, (remind_at, chat_id)))
+            self._push(task_id, chat_id, remind_at)
+            if self._heap[0] == (remind_at, task_id):
+                self._condition.notify()
+
+    def cancel(self, task_id: int) -> None:
+        with self._condition:
+            if self._journal is not None:
+                self._journal.append((task_id, None))
+            self._scheduled.pop(task_id, None)
+            self._compact()
+
+    def tick(self) -> int:
+        # Notifies about every due task, one call per chat. Returns the
+        # number of reminded tasks.
+        now = self._clock()
+        due: defaultdict[int, list[int]] = defaultdict(list)
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                remind_at, task_id = heapq.heappop(self._heap)
+                entry = self._scheduled.get(task_id)
+                if entry is None or entry[0] != remind_at:
+                    continue
+                chat_id = entry[1]
+                # Every shard schedules all tasks, but reminds only in its
+                # own chats
+                if ownership.owns(chat_id):
+                    due[chat_id].append(task_id)
+                self._push(task_id, chat_id, self._next_slot(now))
+        for chat_id, task_ids in due.items():
+            try:
+                if self._notify:
+                    self._notify(chat_id, task_ids)
+            except Exception:
+                logger.exception('Failed to remind chat {}', chat_id)
+        return sum(len(task_ids) for task_ids in due.values())
+
+    def start(self, notify: Callable[[int, list[int]], None]) -> None:
+        self._notify = notify
+        self._thread = threading.Thread(
+            target=self._run, name='reminders', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+    def _run(self) -> None:
+        while True:
+            self.tick()
+            with self._condition:
+                if self._stopped:
+                    return
+                wait = float(MAX_WAIT)
+                if self._heap:
+                    until_next = self._heap[0][0] - self._clock()
+                    wait = min(wait, max(until_next.total_seconds(), 0))
+                self._condition.wait(wait)
+                if self._stopped:
+                    return
+
+    def _replace(self, scheduled: dict[int, Entry]) -> None:
+        for task_id, entry in self._journal or []:
+            if entry is None:
+                scheduled.pop(task_id, None)
+            else:
+                scheduled[task_id] = entry
+        self._journal = None
+        self._scheduled = scheduled
+        self._heap = [(at, task_id) for task_id, (at, _) in scheduled.items()]
+        heapq.heapify(self._heap)
+        self._condition.notify()
+
+    def _push(
+        self, task_id: int, chat_id: int, remind_at: datetime.datetime
+    ) -> None:
+        # The previous entry of the task, if any, becomes stale
+        self._scheduled[task_id] = (remind_at, chat_id)
+        heapq.heappush(self._heap, (remind_at, task_id))
+        self._compact()
+
+    def _compact(self) -> None:
+        stale = len(self._heap) - len(self._scheduled)
+        if stale > len(self._heap) * MAX_STALE_SHARE:
+            self._heap = [
+                (at, task_id) for task_id, (at, _) in self._scheduled.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def _remind_at(
+        self, deadline: datetime.date, now: datetime.datetime
+    ) -> datetime.datetime:
+        # Overdue tasks are not reminded about right away, but at the next
+        # daily slot, so a restart does not repeat the reminders
+        return max(
+            datetime.datetime.combine(deadline, self._time),
+            self._next_slot(now),
+        )
+
+    def _next_slot(self, now: datetime.datetime) -> datetime.datetime:
+        slot = datetime.datetime.combine(now.date(), self._time)
+        if slot <= now:
+            slot += datetime.timedelta(days=1)
+        return slot
+
+
+reminders = ReminderScheduler(REMINDER_HOUR)
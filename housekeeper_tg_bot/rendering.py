@@ -0,0 +1,98 @@
+# Description: Rendering of outgoing messages. Keyboards are serialized to
+# JSON once: the static ones at import, the task keyboards from a JSON
+# template with slots for their callback data and the cached task views
+# when they are rendered. Message templates are compiled once and Markdown
+# escaping of repeated usernames and task texts is memoized.
+import functools
+import json
+from collections.abc import Callable
+
+from callbacks import encode
+from messages import messages
+from telebot.formatting import escape_markdown
+from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+ESCAPE_CACHE_SIZE = 4096
+SLOT = '\0'
+
+# Bound format methods of the messages, so that a message is rendered
+# without looking up its text and format
+_templates: dict[str, Callable[..., str]] = {
+    name: text.format for name, text in messages.items()
+}
+
+
+def render(name: str, *args: object) -> str:
+    return _templates[name](*args)
+
+
+@functools.lru_cache(maxsize=ESCAPE_CACHE_SIZE)
+def escape(text: str) -> str:
+    return escape_markdown(text)
+
+
+def bold(text: str) -> str:
+    return f'*{escape(text)}*'
+
+
+class FrozenMarkup(InlineKeyboardMarkup):
+    # telebot sends reply_markup.to_json(), here the JSON is made once.
+    # The markup must not be changed after it is frozen.
+    def __init__(
+        self, keyboard: list[list[InlineKeyboardButton]], data: str
+    ) -> None:
+        super().__init__(keyboard)
+        self._json = data
+
+    def to_json(self) -> str:
+        return self._json
+
+
+def freeze(markup: InlineKeyboardMarkup) -> FrozenMarkup:
+    return FrozenMarkup(markup.keyboard, markup.to_json())
+
+
+class KeyboardTemplate:
+    # A keyboard whose buttons differ only by the chat and target of their
+    # callback data. Its JSON is split once around the callback data, a
+    # keyboard is rendered by joining the parts with the encoded data.
+    def __init__(self, rows: list[list[tuple[str, str]]]) -> None:
+        self._actions = [action for row in rows for _, action in row]
+        layout = {
+            'inline_keyboard': [
+                [{'text': text, 'callback_data': SLOT} for text, _ in row]
+                for row in rows
+            ]
+        }
+        self._parts = json.dumps(layout).split(json.dumps(SLOT))
+
+    def render(self, chat_id: int, target: int) -> FrozenMarkup:
+        parts = [self._parts[0]]
+        for action, part in zip(self._actions, self._parts[1:], strict=True):
+            # Encoded callback data has no characters escaped by JSON
+            parts.append(f'"{encode(action, chat_id, target)}"')
+            parts.append(part)
+        # Only the JSON is kept, these keyboards are never read back
+        return FrozenMarkup([], ''.join(parts))
+
+
+def _static_markup(*buttons: tuple[str, str]) -> FrozenMarkup:
+    markup = InlineKeyboardMarkup()
+    markup.row_width = 2
+    markup.add(
+        *(
+            InlineKeyboardButton(text, callback_data=encode(action))
+            for text, action in buttons
+        )
+    )
+    return freeze(markup)
+
+
+OK_MARKUP = _static_markup(('Удали', 'ok_remove'), ('Оставь', 'ok_stay'))
+OK_BUTTONS = OK_MARKUP.keyboard[0]
+TASK_KEYBOARD = KeyboardTemplate(
+    [[('Выполнить', 'done'), ('Отменить', 'cancel')]]
+)
+OFFER_KEYBOARD = KeyboardTemplate(
+    [[('Ок', 'offer_yes'), ('Не могу', 'offer_no')]]
+)
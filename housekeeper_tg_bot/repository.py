@@ -0,0 +1,222 @@
+# Description: Task lookups and mutations shared by the bot handlers.
+# Every change of a task executor goes through here, so in-memory state
+# derived from tasks (the workload counter, cached views) stays consistent.
+import datetime
+import functools
+from collections.abc import Iterator
+from dataclasses import dataclass
+from itertools import zip_longest
+from typing import Any
+
+from database import after_transaction
+from membership import membership, query_members
+from models import Chat, RecurringTask, Task, User
+from peewee import JOIN
+from reminders import reminders
+from view_cache import view_cache
+from workload import workload
+
+
+@dataclass(frozen=True)
+class ActiveTask:
+    id: int
+    text: str
+    executor: str | None
+
+
+@dataclass(frozen=True)
+class TaskPage:
+    tasks: list[ActiveTask]
+    has_previous: bool
+    has_next: bool
+
+
+def drop_views(chat_id: int) -> None:
+    # Once the change is committed, a view rendered before that would be
+    # cached under the new generation otherwise
+    after_transaction(functools.partial(view_cache.invalidate, chat_id))
+
+
+def get_task(task_id: int) -> Task | None:
+    return Task.get_or_none(Task.id == task_id)
+
+
+def get_task_by_message(chat_id: int, message_id: int) -> Task | None:
+    # Backed by the unique (chat, message_id) index
+    return (
+        Task.select()
+        .join(Chat)
+        .where(Chat.chat_id == chat_id, Task.message_id == message_id)
+        .get_or_none()
+    )
+
+
+def get_chat_task(chat_id: int, task_id: int | None) -> Task | None:
+    # A task addressed by a button, only if it belongs to the chat the
+    # button was pressed in
+    return (
+        Task.select()
+        .join(Chat)
+        .where(Chat.chat_id == chat_id, Task.id == task_id)
+        .get_or_none()
+    )
+
+
+def get_chat_users(chat_id: int) -> list[User]:
+    users = membership.users(chat_id)
+    if users is None:
+        users = [
+            User(id=user_id, username=username)
+            for _, user_id, username in query_members(chat_id).tuples()
+        ]
+        membership.set(chat_id, users)
+    return users
+
+
+def add_chat_user(chat_id: int, user: User) -> None:
+    Chat.get(Chat.chat_id == chat_id).users.add(user)
+    membership.add(chat_id, user)
+
+
+def iter_active_tasks(
+    chat_id: int, limit: int, after_id: int = 0, before_id: int | None = None
+) -> Iterator[ActiveTask]:
+    # Walks the (chat, id) order from the cursor, forward from after_id or
+    # backward from before_id. Executors are joined in, instead of being
+    # loaded task by task.
+    query = (
+        Task.select(Task.id, Task.text, User.username)
+        .join(Chat)
+        .switch(Task)
+        .join(User, JOIN.LEFT_OUTER, on=(Task.executor == User.id))
+        .where(
+            Chat.chat_id == chat_id,
+            Task.is_finished == False,  # noqa: E712
+        )
+    )
+    if before_id is None:
+        query = query.where(Task.id > after_id).order_by(Task.id)
+    else:
+        query = query.where(Task.id < before_id).order_by(Task.id.desc())
+    for row in query.limit(limit).tuples().iterator():
+        yield ActiveTask(*row)
+
+
+def get_open_tasks(task_ids: list[int]) -> list[ActiveTask]:
+    query = (
+        Task.select(Task.id, Task.text, User.username)
+        .join(User, JOIN.LEFT_OUTER, on=(Task.executor == User.id))
+        .where(
+            Task.id.in_(task_ids),
+            Task.is_finished == False,  # noqa: E712
+        )
+        .order_by(Task.deadline, Task.id)
+    )
+    return [ActiveTask(*row) for row in query.tuples()]
+
+
+def active_tasks_page(
+    chat_id: int, size: int, after_id: int = 0, before_id: int | None = None
+) -> TaskPage:
+    # One extra task is fetched to know whether there is one more page
+    tasks = list(iter_active_tasks(chat_id, size + 1, after_id, before_id))
+    has_more = len(tasks) > size
+    tasks = tasks[:size]
+    if before_id is None:
+        return TaskPage(tasks, has_previous=after_id > 0, has_next=has_more)
+    if not tasks:
+        return active_tasks_page(chat_id, size)
+    tasks.reverse()
+    return TaskPage(tasks, has_previous=has_more, has_next=True)
+
+
+def add_task(task: Task, chat_id: int) -> None:
+    task.save()
+    reminders.schedule(task.id, chat_id, task.deadline)
+    drop_views(chat_id)
+
+
+def add_tasks(
+    chat: Chat, creator: User, texts: list[str], executors: list[User]
+) -> None:
+    # Executors may be empty
+    insert_tasks(
+        [
+            {
+                'chat': chat,
+                'creator': creator,
+                'text': text,
+                'executor': executor,
+            }
+            for text, executor in zip_longest(texts, executors)
+        ],
+        {chat.id: chat.chat_id},
+    )
+
+
+def insert_tasks(rows: list[dict[str, Any]], chat_ids: dict[int, int]) -> None:
+    # One INSERT for the whole batch. chat_ids maps Chat primary keys of
+    # the rows to Telegram chat ids.
+    if not rows:
+        return
+    inserted = Task.insert_many(rows).returning(
+        Task.id, Task.chat, Task.executor, Task.deadline
+    )
+    for task_id, chat, executor_id, deadline in inserted.tuples().execute():
+        reminders.schedule(task_id, chat_ids[chat], deadline)
+        if executor_id is not None:
+            workload.assign(chat_ids[chat], None, executor_id)
+    for chat_id in set(chat_ids.values()):
+        drop_views(chat_id)
+
+
+def set_task_message(task: Task, message_id: int) -> None:
+    task.message_id = message_id
+    task.save(only=[Task.message_id])
+
+
+def set_task_executor(task: Task, chat_id: int, username: str) -> None:
+    previous_executor_id = task.executor_id
+    task.executor = User.get(User.username == username)
+    task.save()
+    workload.assign(chat_id, previous_executor_id, task.executor_id)
+    drop_views(chat_id)
+
+
+def finish_task(task: Task, chat_id: int, username: str | None) -> None:
+    previous_executor_id = task.executor_id
+    task.is_finished = True
+    task.finished_time = datetime.datetime.now()
+    if username is not None:
+        task.executor = User.get(User.username == username)
+    task.save()
+    workload.assign(chat_id, previous_executor_id, task.executor_id)
+    reminders.cancel(task.id)
+    drop_views(chat_id)
+
+
+def delete_task(task: Task, chat_id: int) -> None:
+    task.delete_instance()
+    workload.remove(chat_id, task.executor_id)
+    reminders.cancel(task.id)
+    drop_views(chat_id)
+
+
+def get_recurring_tasks(chat_id: int) -> list[RecurringTask]:
+    return list(
+        RecurringTask.select()
+        .join(Chat)
+        .where(Chat.chat_id == chat_id)
+        .order_by(RecurringTask.id)
+    )
+
+
+def delete_recurring_task(rule_id: int, chat_id: int) -> bool:
+    # Tasks already created from the rule are kept
+    chat = Chat.select(Chat.id).where(Chat.chat_id == chat_id)
+    deleted = (
+        RecurringTask.delete()
+        .where(RecurringTask.id == rule_id, RecurringTask.chat.in_(chat))
+        .execute()
+    )
+    return bool(deleted)
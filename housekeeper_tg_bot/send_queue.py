@@ -0,0 +1,336 @@
+# Description: Outbound Telegram API calls scheduler. Calls are rate limited
+# per chat and globally with token buckets, 429 responses are retried after
+# the time Telegram asks for, and cosmetic calls go with lower priority.
+# Calls of one chat are executed one at a time, in submission order. Each
+# chat has a queue of its calls, chats which wait for their rate limit are
+# kept in a heap by the time they are ready and ready chats in a heap by
+# their first call, so picking the next call does not scan all of them.
+import functools
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any
+
+from loguru import logger
+from metrics import registry
+from telebot.apihelper import ApiTelegramException
+
+TOO_MANY_REQUESTS = 429
+MAX_IDLE_CHAT_BUCKETS = 10000
+
+
+class Priority(IntEnum):
+    NORMAL = 0
+    LOW = 1
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+        refill_delay = max(1 - self.tokens, 0) / self.rate
+        return max(self.blocked_until - now, refill_delay)
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def block(self, until: float) -> None:
+        self.blocked_until = max(self.blocked_until, until)
+
+    def is_idle(self, now: float) -> bool:
+        return self.delay(now) == 0 and self.tokens >= self.capacity
+
+
+@dataclass(order=True)
+class _Call:
+    priority: int
+    sequence: int
+    chat_id: int = field(compare=False)
+    name: str = field(compare=False)
+    function: Callable[[], Any] = field(compare=False)
+    future: Future[Any] = field(compare=False)
+
+
+class SendQueue:
+    def __init__(
+        self,
+        workers: int,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: int,
+    ) -> None:
+        self._workers = workers
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._condition = threading.Condition()
+        # Calls of each chat with pending ones, a queue for each priority
+        self._queues: dict[int, tuple[deque[_Call], ...]] = {}
+        self._busy_chats: set[int] = set()
+        # (ready time, chat id) of chats waiting for their rate limit and
+        # (priority, sequence, chat id) of the first calls of ready chats.
+        # Entries of chats which have changed since are skipped when popped.
+        self._waiting: list[tuple[float, int]] = []
+        self._ready: list[tuple[int, int, int]] = []
+        self._sequence = itertools.count()
+        self._threads: list[threading.Thread] = []
+        self._stopped = False
+
+    def submit(
+        self,
+        chat_id: int,
+        function: Callable[..., Any],
+        *args: Any,
+        priority: Priority = Priority.NORMAL,
+        **kwargs: Any,
+    ) -> Future[Any]:
+        future: Future[Any] = Future()
+        call = _Call(
+            priority,
+            next(self._sequence),
+            chat_id,
+            getattr(function, '__name__', 'call'),
+            lambda: function(*args, **kwargs),
+            future,
+        )
+        with self._condition:
+            queues = self._queues.get(chat_id)
+            if queues is None:
+                queues = self._queues[chat_id] = tuple(
+                    deque() for _ in Priority
+                )
+            queues[priority].append(call)
+            if self._first_call(chat_id) is call:
+                self._schedule(chat_id, time.monotonic())
+                self._condition.notify()
+        return future
+
+    def call(
+        self,
+        chat_id: int,
+        function: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        # Waits for the result, API errors are raised to the caller. Not
+        # for handlers, a rate limited chat would hold their thread.
+        return self.submit(chat_id, function, *args, **kwargs).result()
+
+    def post(
+        self,
+        chat_id: int,
+        function: Callable[..., Any],
+        *args: Any,
+        on_sent: Callable[[Any], None] | None = None,
+        on_failure: Callable[[Exception], None] | None = None,
+        **kwargs: Any,
+    ) -> None:
+        # Does not wait for the result, API errors are logged. The callbacks
+        # get the result or the error in the send thread.
+        future = self.submit(chat_id, function, *args, **kwargs)
+        future.add_done_callback(
+            functools.partial(_handle_result, on_sent, on_failure)
+        )
+
+    def pending(self) -> int:
+        # Calls queued or being made, a call waiting for its retry included
+        with self._condition:
+            return len(self._busy_chats) + sum(
+                len(queue)
+                for queues in self._queues.values()
+                for queue in queues
+            )
+
+    def start(self) -> None:
+        for number in range(self._workers):
+            thread = threading.Thread(
+                target=self._run, name=f'send-queue-{number}', daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        for queues in self._queues.values():
+            for queue in queues:
+                for call in queue:
+                    call.future.cancel()
+
+    def _run(self) -> None:
+        while True:
+            call = self._next_call()
+            if call is None:
+                return
+            started = time.perf_counter()
+            result: Any = None
+            error: Exception | None = None
+            retried = False
+            try:
+                result = call.function()
+            except ApiTelegramException as e:
+                if e.error_code != TOO_MANY_REQUESTS:
+                    error = e
+                else:
+                    self._retry_later(call, e)
+                    retried = True
+            except Exception as e:
+                error = e
+            registry.histogram(
+                'telegram_call_seconds', method=call.name
+            ).observe(time.perf_counter() - started)
+            with self._condition:
+                self._busy_chats.discard(call.chat_id)
+                self._schedule(call.chat_id, time.monotonic())
+                self._condition.notify_all()
+            # Callbacks of the future run after the chat is released, so
+            # they may submit further calls to it
+            if retried:
+                continue
+            if error is None:
+                call.future.set_result(result)
+            else:
+                registry.counter(
+                    'telegram_errors_total', method=call.name
+                ).inc()
+                call.future.set_exception(error)
+
+    def _retry_later(self, call: _Call, error: ApiTelegramException) -> None:
+        registry.counter('telegram_flood_waits_total').inc()
+        retry_after = error.result_json.get('parameters', {}).get(
+            'retry_after', 1
+        )
+        logger.warning(
+            'Flood limit in chat {}, retrying in {}s',
+            call.chat_id,
+            retry_after,
+        )
+        with self._condition:
+            self._chat_bucket(call.chat_id).block(
+                time.monotonic() + retry_after
+            )
+            # The call goes back to the head of its chat queue
+            self._queues[call.chat_id][call.priority].appendleft(call)
+
+    def _next_call(self) -> _Call | None:
+        with self._condition:
+            while not self._stopped:
+                now = time.monotonic()
+                while self._waiting and self._waiting[0][0] <= now:
+                    _, chat_id = heapq.heappop(self._waiting)
+                    self._schedule(chat_id, now)
+                wait: float | None = None
+                global_delay = self._global_bucket.delay(now)
+                if global_delay > 0:
+                    wait = global_delay
+                else:
+                    call = self._pop_ready(now)
+                    if call is not None:
+                        return call
+                if self._waiting:
+                    until_ready = self._waiting[0][0] - now
+                    wait = (
+                        until_ready if wait is None else min(wait, until_ready)
+                    )
+                self._condition.wait(wait)
+            return None
+
+    def _pop_ready(self, now: float) -> _Call | None:
+        while self._ready:
+            priority, sequence, chat_id = heapq.heappop(self._ready)
+            call = self._first_call(chat_id)
+            if (
+                call is None
+                or chat_id in self._busy_chats
+                or (call.priority, call.sequence) != (priority, sequence)
+            ):
+                continue
+            # A retried call may have blocked the chat meanwhile
+            if self._chat_bucket(chat_id).delay(now) > 0:
+                self._schedule(chat_id, now)
+                continue
+            self._chat_bucket(chat_id).take()
+            self._global_bucket.take()
+            self._queues[chat_id][call.priority].popleft()
+            self._busy_chats.add(chat_id)
+            return call
+        return None
+
+    def _first_call(self, chat_id: int) -> _Call | None:
+        for queue in self._queues.get(chat_id, ()):
+            if queue:
+                return queue[0]
+        return None
+
+    def _schedule(self, chat_id: int, now: float) -> None:
+        # Puts a chat which is not busy into the heap it belongs to, drops
+        # the queues of a chat without calls
+        if chat_id in self._busy_chats:
+            return
+        call = self._first_call(chat_id)
+        if call is None:
+            self._queues.pop(chat_id, None)
+            return
+        delay = self._chat_bucket(chat_id).delay(now)
+        if delay > 0:
+            heapq.heappush(self._waiting, (now + delay, chat_id))
+        else:
+            heapq.heappush(
+                self._ready, (call.priority, call.sequence, chat_id)
+            )
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        if chat_id not in self._chat_buckets:
+            if len(self._chat_buckets) >= MAX_IDLE_CHAT_BUCKETS:
+                self._drop_idle_buckets()
+            self._chat_buckets[chat_id] = TokenBucket(
+                self._chat_rate, self._chat_burst
+            )
+        return self._chat_buckets[chat_id]
+
+    def _drop_idle_buckets(self) -> None:
+        now = time.monotonic()
+        self._chat_buckets = {
+            chat_id: bucket
+            for chat_id, bucket in self._chat_buckets.items()
+            if not bucket.is_idle(now)
+        }
+
+
+def _handle_result(
+    on_sent: Callable[[Any], None] | None,
+    on_failure: Callable[[Exception], None] | None,
+    future: Future[Any],
+) -> None:
+    if future.cancelled():
+        return
+    error = future.exception()
+    try:
+        if error is None:
+            if on_sent:
+                on_sent(future.result())
+            return
+        logger.opt(exception=error).error('Telegram API call failed:')
+        if on_failure and isinstance(error, Exception):
+            on_failure(error)
+    except Exception:
+        logger.exception('Failed to handle a Telegram API call result:')
@@ -0,0 +1,242 @@
+# Description: Sharded runtime. A dispatcher process polls Telegram and
+# routes every update by its chat id to one of several bot processes, the
+# shards. Chats are mapped to shards with a consistent hash ring, so each
+# shard alone changes the cached state (members, workload, reminders) of
+# its chats and handles their updates in order. A shard added at runtime
+# (SIGUSR1 to the dispatcher) takes over only a part of the chats; their
+# old shards finish the updates they have queued before it starts.
+import bisect
+import hashlib
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections.abc import Callable
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from typing import Any
+
+import telebot
+from loguru import logger
+from telebot import apihelper
+from telebot.types import Update
+from workers import ChatWorkerPool
+
+REPLICAS = 64
+POLLING_TIMEOUT = 20
+RETRY_DELAY = 3
+BOT_SCRIPT = Path(__file__).resolve().parent / 'bot.py'
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big'
+    )
+
+
+class HashRing:
+    # Every shard owns REPLICAS points of the ring and a chat belongs to
+    # the shard of the first point after the chat hash
+    def __init__(self, shards: list[int]) -> None:
+        self.shards = sorted(shards)
+        ring = sorted(
+            (_point(f'{shard}:{replica}'), shard)
+            for shard in self.shards
+            for replica in range(REPLICAS)
+        )
+        self._points = [point for point, _ in ring]
+        self._owners = [shard for _, shard in ring]
+
+    def owner(self, chat_id: int) -> int:
+        index = bisect.bisect(self._points, _point(str(chat_id)))
+        return self._owners[index % len(self._owners)]
+
+
+class Ownership:
+    # Chats of this process, all of them outside of the sharded runtime
+    def __init__(self) -> None:
+        self._state: tuple[int, HashRing] | None = None
+
+    def update(self, shard: int, ring: HashRing) -> None:
+        self._state = (shard, ring)
+
+    def owns(self, chat_id: int) -> bool:
+        state = self._state
+        return state is None or state[1].owner(chat_id) == state[0]
+
+
+ownership = Ownership()
+
+
+def raw_update_chat_id(data: dict[str, Any]) -> int:
+    message = (
+        data.get('message')
+        or data.get('edited_message')
+        or data.get('callback_query', {}).get('message')
+    )
+    return int(message['chat']['id']) if message else 0
+
+
+class ShardDispatcher:
+    def __init__(self, shards: int) -> None:
+        self._authkey = secrets.token_bytes(32)
+        self._listener = Listener(('127.0.0.1', 0), authkey=self._authkey)
+        self._shards = shards
+        self._processes: list[subprocess.Popen[bytes]] = []
+        self._connections: dict[int, Connection] = {}
+        self._ring = HashRing([])
+
+    def start(self) -> None:
+        for _ in range(self._shards):
+            self._spawn()
+        for _ in range(self._shards):
+            self._accept()
+        self._set_ring(HashRing(list(self._connections)))
+        for connection in self._connections.values():
+            self._expect(connection, 'ready')
+
+    def add_shard(self) -> None:
+        shard = len(self._processes)
+        # Chats moving to the new shard may have updates queued in their
+        # old shards. They are handled before the new shard starts and
+        # loads the state of its chats from the database; no updates are
+        # submitted meanwhile, the polling loop is here.
+        self.drain()
+        self._spawn()
+        self._accept()
+        self._set_ring(HashRing([*self._ring.shards, shard]))
+        self._expect(self._connections[shard], 'ready')
+        logger.info('Added shard {}, {} shards now', shard, shard + 1)
+
+    def submit(self, data: dict[str, Any]) -> None:
+        shard = self._ring.owner(raw_update_chat_id(data))
+        self._connections[shard].send(('update', data))
+
+    def drain(self) -> None:
+        # Returns when the shards have handled all updates sent to them
+        for shard in self._ring.shards:
+            self._connections[shard].send(('drain', None))
+        for shard in self._ring.shards:
+            self._expect(self._connections[shard], 'drained')
+
+    def stop(self) -> None:
+        for connection in self._connections.values():
+            try:
+                connection.send(('stop', None))
+            except OSError:
+                logger.exception('Shard connection is closed')
+        for process in self._processes:
+            process.wait()
+        self._listener.close()
+
+    def _spawn(self) -> None:
+        shard = len(self._processes)
+        address = self._listener.address
+        env = {
+            **os.environ,
+            'BOT_RUNTIME': 'shard',
+            'SHARD_INDEX': str(shard),
+            'SHARD_ADDRESS': f'{address[0]}:{address[1]}',
+            'SHARD_AUTHKEY': self._authkey.hex(),
+        }
+        process = subprocess.Popen(  # noqa: S603
+            [sys.executable, str(BOT_SCRIPT)], env=env
+        )
+        self._processes.append(process)
+
+    def _set_ring(self, ring: HashRing) -> None:
+        self._ring = ring
+        for connection in self._connections.values():
+            connection.send(('ring', ring.shards))
+
+    def _accept(self) -> None:
+        # Shards introduce themselves with their index
+        connection = self._listener.accept()
+        shard = connection.recv()
+        self._connections[shard] = connection
+
+    def _expect(self, connection: Connection, reply: str) -> None:
+        received = connection.recv()
+        if received != reply:
+            raise RuntimeError(f'Shard replied {received!r}, not {reply!r}')
+
+
+def run(token: str, shards: int) -> None:
+    dispatcher = ShardDispatcher(shards)
+    added = threading.Event()
+    signal.signal(signal.SIGUSR1, lambda *_: added.set())
+    dispatcher.start()
+    logger.info('Dispatching updates to {} shards', shards)
+    offset = None
+    try:
+        while True:
+            if added.is_set():
+                added.clear()
+                dispatcher.add_shard()
+            try:
+                updates = apihelper.get_updates(
+                    token, offset=offset, timeout=POLLING_TIMEOUT
+                )
+            except Exception:
+                logger.exception('Failed to get updates')
+                time.sleep(RETRY_DELAY)
+                continue
+            for data in updates:
+                offset = data['update_id'] + 1
+                dispatcher.submit(data)
+    finally:
+        dispatcher.stop()
+
+
+class Shard:
+    def __init__(self, shard: int, connection: Connection) -> None:
+        self._shard = shard
+        self._connection = connection
+
+    def serve(
+        self, bot: telebot.TeleBot, workers: int, queue_size: int
+    ) -> None:
+        # Updates from the dispatcher wait for room in a full queue instead
+        # of being dropped, no other shard handles them
+        pool = ChatWorkerPool(
+            lambda update: bot.process_new_updates([update]),
+            workers,
+            queue_size,
+        )
+        pool.start()
+        self._connection.send('ready')
+        handlers: dict[str, Callable[[Any], None]] = {
+            'update': lambda data: pool.submit(
+                Update.de_json(data), block=True
+            ),
+            'ring': lambda shards: ownership.update(
+                self._shard, HashRing(shards)
+            ),
+            'drain': lambda _: self._drained(pool),
+        }
+        try:
+            while (message := self._connection.recv())[0] != 'stop':
+                command, payload = message
+                handlers[command](payload)
+        except EOFError:
+            logger.error('Dispatcher has closed the connection')
+        finally:
+            pool.stop()
+            self._connection.close()
+
+    def _drained(self, pool: ChatWorkerPool) -> None:
+        pool.join()
+        self._connection.send('drained')
+
+
+def connect(shard: int, address: str, authkey: str) -> Shard:
+    # Chats of the shard are known before its background jobs start
+    host, port = address.rsplit(':', 1)
+    connection = Client((host, int(port)), authkey=bytes.fromhex(authkey))
+    connection.send(shard)
+    _, shards = connection.recv()
+    ownership.update(shard, HashRing(shards))
+    return Shard(shard, connection)
@@ -0,0 +1,140 @@
+# Description: Binary snapshot of the in-memory state (chat members,
+# workload counters, scheduled reminders). It is written on a timer and
+# at shutdown and read with mmap on boot, so the bot can answer right
+# away while the state is reconciled with the database in background.
+import mmap
+import os
+import struct
+import threading
+import time
+
+from loguru import logger
+from membership import membership
+from peewee import Database
+from reminders import reminders
+from workload import workload
+
+MAGIC = b'HKSS'
+VERSION = 1
+# Magic, version, creation time, number of members, loads and reminders
+HEADER = struct.Struct('<4sIdIII')
+# Telegram chat id, user id, username length, followed by the username
+MEMBER = struct.Struct('<qqH')
+# Telegram chat id, user id, load
+LOAD = struct.Struct('<qqi')
+# Task id, Telegram chat id, reminder timestamp
+REMINDER = struct.Struct('<qqd')
+
+
+def save(path: str) -> None:
+    members = membership.items()
+    loads = workload.items()
+    scheduled = reminders.items()
+    chunks = [
+        HEADER.pack(
+            MAGIC,
+            VERSION,
+            time.time(),
+            sum(len(users) for _, users in members),
+            len(loads),
+            len(scheduled),
+        )
+    ]
+    for chat_id, users in members:
+        for user_id, username in users:
+            name = username.encode()
+            chunks.append(MEMBER.pack(chat_id, user_id, len(name)) + name)
+    chunks.extend(LOAD.pack(*load) for load in loads)
+    chunks.extend(REMINDER.pack(*reminder) for reminder in scheduled)
+    with open(f'{path}.tmp', 'wb') as file:
+        file.write(b''.join(chunks))
+    os.replace(f'{path}.tmp', path)
+
+
+def load(path: str) -> bool:
+    # Returns False when there is no usable snapshot
+    if not os.path.exists(path):
+        return False
+    try:
+        with (
+            open(path, 'rb') as file,
+            mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data,
+        ):
+            magic, version, created_at, *counts = HEADER.unpack_from(data)
+            if magic != MAGIC or version != VERSION:
+                logger.warning('Unknown snapshot format in {}', path)
+                return False
+            member_count, load_count, reminder_count = counts
+            offset = HEADER.size
+            members: dict[int, list[tuple[int, str]]] = {}
+            for _ in range(member_count):
+                chat_id, user_id, size = MEMBER.unpack_from(data, offset)
+                offset += MEMBER.size
+                username = data[offset : offset + size].decode()
+                offset += size
+                members.setdefault(chat_id, []).append((user_id, username))
+            end = offset + load_count * LOAD.size
+            loads = list(LOAD.iter_unpack(data[offset:end]))
+            offset = end
+            end = offset + reminder_count * REMINDER.size
+            scheduled = list(REMINDER.iter_unpack(data[offset:end]))
+    except Exception:
+        logger.exception('Failed to load snapshot from {}', path)
+        return False
+    membership.load(members)
+    workload.load(loads)
+    reminders.load(scheduled)
+    logger.info('Loaded snapshot made {:.0f}s ago', time.time() - created_at)
+    return True
+
+
+def reconcile(db: Database) -> None:
+    started = time.perf_counter()
+    membership.rebuild(db)
+    workload.rebuild(db)
+    reminders.rebuild(db)
+    logger.info(
+        'State reconciled with the database in {:.3f}s',
+        time.perf_counter() - started,
+    )
+
+
+def restore(db: Database, path: str) -> None:
+    # Serves from the snapshot while the database is read in background,
+    # without a snapshot the state is read before the bot starts
+    if load(path):
+        threading.Thread(
+            target=reconcile, args=(db,), name='reconcile', daemon=True
+        ).start()
+    else:
+        reconcile(db)
+
+
+class Snapshotter:
+    def __init__(self, path: str, interval: float) -> None:
+        self._path = path
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name='snapshot', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self._save()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            self._save()
+
+    def _save(self) -> None:
+        try:
+            save(self._path)
+        except Exception:
+            logger.exception('Failed to save snapshot to {}', self._path)
@@ -0,0 +1,74 @@
+import datetime
+from dataclasses import dataclass
+
+from models import Chat, Task, User, UserRollup
+from peewee import JOIN, Case, Database, Expression, Function, fn
+
+
+@dataclass(frozen=True)
+class UserStats:
+    username: str
+    task_count: int
+    completed_task_count: int
+    created_task_count: int
+    overdue_task_count: int
+
+
+def _count_if(condition: Expression) -> Function:
+    return fn.COALESCE(fn.SUM(Case(None, [(condition, 1)], 0)), 0)
+
+
+def collect_stats(db: Database, chat_id: int) -> list[UserStats]:
+    # All counters for every chat member are computed in one grouped query,
+    # archived tasks are counted by the rollups
+    chat_users = Chat.users.get_through_model()
+    is_executor = Task.executor == User.id
+    is_open = Task.is_finished == False  # noqa: E712
+    today = datetime.date.today()
+    # One rollup row per user and chat, repeated on every task row
+    archived_executed = fn.COALESCE(fn.MAX(UserRollup.executed_count), 0)
+    archived_created = fn.COALESCE(fn.MAX(UserRollup.created_count), 0)
+
+    with db.atomic():
+        query = (
+            User.select(
+                User.username,
+                (_count_if(is_executor) + archived_executed).alias(
+                    'task_count'
+                ),
+                (
+                    _count_if(
+                        is_executor & (Task.is_finished == True)  # noqa: E712
+                    )
+                    + archived_executed
+                ).alias('completed_task_count'),
+                (_count_if(Task.creator == User.id) + archived_created).alias(
+                    'created_task_count'
+                ),
+                _count_if(
+                    is_executor & is_open & (Task.deadline < today)
+                ).alias('overdue_task_count'),
+            )
+            .join(chat_users, on=(chat_users.user == User.id))
+            .join(Chat, on=(chat_users.chat == Chat.id))
+            .join(
+                Task,
+                JOIN.LEFT_OUTER,
+                on=(
+                    (Task.chat == Chat.id)
+                    & ((Task.executor == User.id) | (Task.creator == User.id))
+                ),
+            )
+            .join(
+                UserRollup,
+                JOIN.LEFT_OUTER,
+                on=(
+                    (UserRollup.chat == Chat.id) & (UserRollup.user == User.id)
+                ),
+            )
+            .where(Chat.chat_id == chat_id)
+            .group_by(User.id)
+            .order_by(User.id)
+            .dicts()
+        )
+        return [UserStats(**row) for row in query]
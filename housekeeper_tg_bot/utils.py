@@ -1,55 +1,97 @@
+from collections.abc import Iterable, Iterator
 from random import choice
-from typing import cast
 
-import numpy as np
 import telebot
+from config import EXECUTOR_POLICY
+from gpt_cache import cache_key, gpt_cache
 from loguru import logger
 from media_content import get_gpt_response
 from messages import messages
-from models import Chat, Task, User
-from numpy.typing import NDArray
-from peewee import SqliteDatabase
-from telebot.formatting import escape_markdown, mbold
+from metrics import instrument
+from models import Task, User
+from peewee import Database
+from rendering import bold, escape, render
+from repository import ActiveTask
+from stats import collect_stats
+from workload import POLICIES, SelectionPolicy, workload
 
+# Characters Telegram accepts in a message
+MESSAGE_LENGTH_LIMIT = 4096
 
-def create_task_list(db: SqliteDatabase, chat_id: str) -> str:
-    with db:
-        tasks = Chat.get(Chat.chat_id == chat_id).tasks.where(
-            Task.is_finished == False  # noqa: E712
+executor_policy: SelectionPolicy = POLICIES[EXECUTOR_POLICY]()
+
+
+def _task_list_lines(tasks: Iterable[ActiveTask]) -> Iterator[str]:
+    for task in tasks:
+        text = bold(escape(task.text))
+        if task.executor:
+            yield render('task_line', text, escape(task.executor))
+        else:
+            yield render('task_line_unassigned', text)
+
+
+@instrument('function')
+def create_task_list(tasks: list[ActiveTask]) -> str:
+    if not tasks:
+        return str(messages['no_tasks'])
+    return 'Активные задачи:\n\n' + ''.join(_task_list_lines(tasks))
+
+
+@instrument('function')
+def create_reminder(tasks: list[ActiveTask]) -> str:
+    return messages['deadline_reminder'] + ''.join(_task_list_lines(tasks))
+
+
+@instrument('function')
+def create_recurring_list(tasks: list[ActiveTask]) -> str:
+    return messages['recurring_spawned'] + ''.join(_task_list_lines(tasks))
+
+
+@instrument('function')
+def create_stat_list(db: Database, chat_id: str) -> str:
+    try:
+        stats = collect_stats(db, int(chat_id))
+    except Exception:
+        logger.exception('Error while creating stat list')
+        return 'Статистики нет'
+    if not stats:
+        return 'Статистики нет'
+
+    stat_list = 'Статистика:\n\n'
+    for user_stats in stats:
+        stat_list += f'{bold(escape(user_stats.username))}\n'
+        stat_list += f'Количество задач: {user_stats.task_count}\n'
+        stat_list += (
+            'Количество выполненных задач: '
+            f'{user_stats.completed_task_count}\n'
         )
-        if not tasks:
-            return str(messages['no_tasks'])
-        task_list = 'Активные задачи:\n\n'
-        for task in tasks:
-            task_list += f'{mbold(escape_markdown(task.text))}\n'
-            if task.executor:
-                task_list += f'Исполнитель: @{task.executor.username}\n\n'
-            else:
-                task_list += '\n'
-        return task_list
-
-
-def create_stat_list(db: SqliteDatabase, chat_id: str) -> str:
-    with db:
-        try:
-            chat = Chat.get(Chat.chat_id == chat_id)
-
-            stat_list = 'Статистика:\n\n'
-            for user in chat.users:
-                task_count = chat.tasks.where(Task.executor == user.id).count()
-                completed_task_count = chat.tasks.where(
-                    Task.executor == user.id,
-                    Task.is_finished == True,  # noqa: E712
-                ).count()
-                stat_list += f'{mbold(escape_markdown(user.username))}\n'
-                stat_list += f'Количество задач: {task_count}\n'
-                stat_list += (
-                    f'Количество выполненных задач: {completed_task_count}\n\n'
-                )
-            return stat_list
-        except Exception:
-            logger.exception('Error while creating stat list')
-            return 'Статистики нет'
+        stat_list += f'Создано задач: {user_stats.created_task_count}\n'
+        stat_list += f'Просрочено задач: {user_stats.overdue_task_count}\n\n'
+    return stat_list
+
+
+def split_message(
+    header: str,
+    lines: list[str],
+    footer: str,
+    limit: int = MESSAGE_LENGTH_LIMIT,
+) -> list[str]:
+    # Messages of at most limit characters with the lines, the header in
+    # the first one and the footer in each. A line too long for a message
+    # is cut.
+    budget = limit - len(footer)
+    messages = []
+    current = header
+    separator = ''
+    for line in lines:
+        text = line[: budget - len(header)]
+        if len(current) + len(separator) + len(text) > budget:
+            messages.append(current + footer)
+            current, separator = '', ''
+        current += separator + text
+        separator = '\n'
+    messages.append(current + footer)
+    return messages
 
 
 def build_name(user: telebot.types.User) -> str:
@@ -63,50 +105,64 @@ def build_name(user: telebot.types.User) -> str:
     return name or user.username
 
 
-def build_task_message(task: Task) -> str:
+@instrument('function')
+def generate_task_note(task: Task) -> str:
     preprompts = [
         'Важное примечание к этой задаче:',
         'Важное замечание к этой задаче:',
         'Важно помнить об этой задаче:',
     ]
     preprompt = choice(preprompts)
+    key = cache_key(task.text, preprompt)
     prompt = f'Задание тебе - {task.text.lower()}. {preprompt}'
-    generated_text = get_gpt_response(prompt=prompt)
-    if generated_text:
-        generated_text = generated_text.replace('…', '').replace('»', '')
-        payload = f'{preprompt}{generated_text}'
-    else:
-        payload = ''
-    return (
-        f'\#task от @{task.creator.username}\n\n'  # noqa: W605
-        f'{mbold(task.text)}\n\n'
-        f'{escape_markdown(payload) or ""}'
+    generated_text = gpt_cache.get(
+        key, lambda: get_gpt_response(prompt=prompt)
+    )
+    if not generated_text:
+        return ''
+    generated_text = generated_text.replace('…', '').replace('»', '')
+    return f'{preprompt}{generated_text}'
+
+
+@instrument('function')
+def build_task_message(task: Task) -> str:
+    return render(
+        'task_message',
+        task.creator.username,
+        bold(task.text),
+        escape(task.note) if task.note else '',
     )
 
 
+@instrument('function')
 def choose_executor(
-    db: SqliteDatabase, users: list[User], chat_id: int
+    users: list[User],
+    chat_id: int,
+    policy: SelectionPolicy | None = None,
 ) -> User | None:
-    def softmax(x: NDArray[np.float32]) -> NDArray[np.float32]:
-        e_x = np.exp(x - np.max(x))
-        return cast(NDArray[np.float32], e_x / e_x.sum())
-
-    with db:
-        if not users:
-            return None
-        # chat task counts for each user in the chat
-        task_counts_list = [
-            Task.select()
-            .where(
-                Task.chat == Chat.get(Chat.chat_id == chat_id).id,
-                Task.executor == user.id,
-            )
-            .count()
-            for user in users
-        ]
-        task_counts = np.array(
-            task_counts_list,
-            dtype=float,
-        )
-        probabilities = softmax(-task_counts)
-        return cast(User, np.random.choice(users, p=probabilities))
+    if not users:
+        return None
+    # chat task counts for each user in the chat
+    task_counts = workload.loads(chat_id, users)
+    return (policy or executor_policy)(chat_id, users, task_counts)
+
+
+@instrument('function')
+def choose_executors(
+    users: list[User],
+    chat_id: int,
+    count: int,
+    policy: SelectionPolicy | None = None,
+) -> list[User]:
+    # Executors for a batch of tasks, every choice accounts for the tasks
+    # already given out in this batch
+    if not users:
+        return []
+    policy = policy or executor_policy
+    task_counts = workload.loads(chat_id, users)
+    executors = []
+    for _ in range(count):
+        executor = policy(chat_id, users, task_counts)
+        task_counts[users.index(executor)] += 1
+        executors.append(executor)
+    return executors
@@ -0,0 +1,84 @@
+# Description: Cache of rendered task views (task lists and inline
+# keyboards) per chat. Least recently used views are evicted when the total
+# size of cached views exceeds the limit, all views of a chat are dropped
+# whenever a change of one of its tasks is committed.
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+
+from config import VIEW_CACHE_MAX_SIZE
+from telebot.types import InlineKeyboardMarkup
+
+
+@dataclass(frozen=True)
+class RenderedView:
+    text: str
+    markup: InlineKeyboardMarkup
+
+    def size(self) -> int:
+        return len(self.text) + len(self.markup.to_json())
+
+
+class ViewCache:
+    def __init__(self, max_size: int) -> None:
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._views: OrderedDict[
+            tuple[int, Hashable], tuple[RenderedView, int]
+        ] = OrderedDict()
+        self._chat_keys: dict[int, set[tuple[int, Hashable]]] = {}
+        self._size = 0
+        # Changes on every invalidation, a view rendered meanwhile may be
+        # outdated and is not cached
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        chat_id: int,
+        kind: Hashable,
+        render: Callable[[], RenderedView],
+    ) -> RenderedView:
+        key = (chat_id, kind)
+        with self._lock:
+            if key in self._views:
+                self._views.move_to_end(key)
+                self.hits += 1
+                return self._views[key][0]
+            self.misses += 1
+            generation = self._generation
+        view = render()
+        with self._lock:
+            if generation == self._generation:
+                self._put(key, view)
+        return view
+
+    def invalidate(self, chat_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in self._chat_keys.pop(chat_id, set()):
+                self._size -= self._views.pop(key)[1]
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def _put(self, key: tuple[int, Hashable], view: RenderedView) -> None:
+        if key in self._views:
+            self._size -= self._views.pop(key)[1]
+        size = view.size()
+        self._views[key] = (view, size)
+        self._chat_keys.setdefault(key[0], set()).add(key)
+        self._size += size
+        while self._size > self._max_size and self._views:
+            old_key, (_, old_size) = self._views.popitem(last=False)
+            self._size -= old_size
+            chat_keys = self._chat_keys[old_key[0]]
+            chat_keys.discard(old_key)
+            if not chat_keys:
+                del self._chat_keys[old_key[0]]
+
+
+view_cache = ViewCache(VIEW_CACHE_MAX_SIZE)
@@ -0,0 +1,101 @@
+# Description: Webhook runtime. Telegram POSTs updates to a small HTTP
+# server, which checks the secret token, queues the update for the chat
+# worker pool and answers right away.
+import hmac
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telebot
+from loguru import logger
+from telebot.types import Update
+from workers import ChatWorkerPool
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'  # noqa: S105
+LATENCY_LOG_INTERVAL = 60
+# Telegram opens up to 40 connections at once (webhook max_connections)
+LISTEN_BACKLOG = 128
+
+
+class WebhookServer(ThreadingHTTPServer):
+    # Connections beyond the default backlog of 5 would wait for a SYN
+    # retransmission, a second or more
+    request_queue_size = LISTEN_BACKLOG
+
+    def __init__(
+        self, address: tuple[str, int], secret: str, pool: ChatWorkerPool
+    ) -> None:
+        super().__init__(address, WebhookRequestHandler)
+        self.secret = secret
+        self.pool = pool
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    server: WebhookServer
+
+    def do_POST(self) -> None:  # noqa: N802
+        secret = self.headers.get(SECRET_HEADER, '')
+        if not hmac.compare_digest(
+            secret.encode(), self.server.secret.encode()
+        ):
+            self._reply(HTTPStatus.FORBIDDEN)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            update = Update.de_json(self.rfile.read(length).decode())
+        except Exception:
+            logger.exception('Failed to parse update')
+            self._reply(HTTPStatus.BAD_REQUEST)
+            return
+        # Telegram delivers the update again later if it is not accepted
+        if not self.server.pool.submit(update):
+            logger.warning(
+                'Update queue is full, update {} is rejected', update.update_id
+            )
+            self._reply(HTTPStatus.TOO_MANY_REQUESTS)
+            return
+        self._reply(HTTPStatus.OK)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        logger.debug('Webhook request: {}', format % args)
+
+    def _reply(self, status: HTTPStatus) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def _log_latency(pool: ChatWorkerPool, stopped: threading.Event) -> None:
+    while not stopped.wait(LATENCY_LOG_INTERVAL):
+        p50, p99 = pool.latency_percentiles()
+        logger.info('Update latency p50={:.3f}s p99={:.3f}s', p50, p99)
+
+
+def run(  # noqa: PLR0913, PLR0917
+    bot: telebot.TeleBot,
+    url: str,
+    address: tuple[str, int],
+    secret: str,
+    workers: int,
+    queue_size: int,
+) -> None:
+    # Requests only queue the updates, they are answered before the
+    # handlers run
+    if not secret:
+        raise ValueError('WEBHOOK_SECRET is required for the webhook runtime')
+    pool = ChatWorkerPool(
+        lambda update: bot.process_new_updates([update]), workers, queue_size
+    )
+    server = WebhookServer(address, secret, pool)
+    stopped = threading.Event()
+    pool.start()
+    threading.Thread(
+        target=_log_latency, args=(pool, stopped), daemon=True
+    ).start()
+    bot.set_webhook(url=url, secret_token=secret)
+    try:
+        server.serve_forever()
+    finally:
+        stopped.set()
+        server.server_close()
+        pool.stop()
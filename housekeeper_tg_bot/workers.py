@@ -0,0 +1,84 @@
+# Description: Thread pool for incoming updates. Each chat is bound to one
+# worker, so updates of a chat are handled in the order they came, while
+# different chats are handled in parallel.
+import queue
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+
+from async_runtime import update_chat_id
+from loguru import logger
+from telebot.types import Update
+
+LATENCY_SAMPLES = 10000
+
+
+class ChatWorkerPool:
+    def __init__(
+        self, handle: Callable[[Update], None], workers: int, queue_size: int
+    ) -> None:
+        self._handle = handle
+        self._queues: list[queue.Queue[tuple[float, Update] | None]] = [
+            queue.Queue(maxsize=max(queue_size // workers, 1))
+            for _ in range(workers)
+        ]
+        self._threads: list[threading.Thread] = []
+        # Seconds from receiving an update to the end of its handling
+        self.latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+
+    def submit(self, update: Update, block: bool = False) -> bool:
+        # Without block the update is rejected when its queue is full
+        chat_id = update_chat_id(update) or 0
+        try:
+            self._queues[chat_id % len(self._queues)].put(
+                (time.monotonic(), update), block=block
+            )
+        except queue.Full:
+            return False
+        return True
+
+    def start(self) -> None:
+        for number, updates in enumerate(self._queues):
+            thread = threading.Thread(
+                target=self._run,
+                args=(updates,),
+                name=f'update-worker-{number}',
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        for updates in self._queues:
+            updates.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def join(self) -> None:
+        # Waits until the submitted updates are handled
+        for updates in self._queues:
+            updates.join()
+
+    def latency_percentiles(self) -> tuple[float, float]:
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return 0.0, 0.0
+        return (
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) * 99 // 100, len(latencies) - 1)],
+        )
+
+    def _run(
+        self, updates: 'queue.Queue[tuple[float, Update] | None]'
+    ) -> None:
+        while (item := updates.get()) is not None:
+            received_at, update = item
+            try:
+                self._handle(update)
+            except Exception:
+                logger.exception(
+                    'Failed to process update {}', update.update_id
+                )
+            self.latencies.append(time.monotonic() - received_at)
+            updates.task_done()
@@ -0,0 +1,173 @@
+import threading
+from collections import Counter, defaultdict
+from random import choice
+from typing import Protocol
+
+import numpy as np
+from config import SOFTMAX_TEMPERATURE
+from database import write_transaction
+from models import Chat, Task, User, UserRollup
+from peewee import Database, fn
+
+
+class SelectionPolicy(Protocol):
+    def __call__(
+        self, chat_id: int, users: list[User], loads: list[int]
+    ) -> User:
+        ...
+
+
+class SoftmaxPolicy:
+    # Less loaded users are more likely to be chosen, temperature
+    # controls how strongly the load difference matters
+    def __init__(self, temperature: float = SOFTMAX_TEMPERATURE) -> None:
+        self.temperature = temperature
+
+    def __call__(
+        self,
+        chat_id: int,  # noqa: ARG002
+        users: list[User],
+        loads: list[int],
+    ) -> User:
+        x = -np.array(loads, dtype=float) / self.temperature
+        e_x = np.exp(x - np.max(x))
+        probabilities = e_x / e_x.sum()
+        return users[int(np.random.choice(len(users), p=probabilities))]
+
+
+class RoundRobinPolicy:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._last_chosen: dict[int, int] = {}
+
+    def __call__(
+        self,
+        chat_id: int,
+        users: list[User],
+        loads: list[int],  # noqa: ARG002
+    ) -> User:
+        ordered = sorted(users, key=lambda user: user.id)
+        with self._lock:
+            last_chosen = self._last_chosen.get(chat_id, 0)
+            user = next(
+                (user for user in ordered if user.id > last_chosen),
+                ordered[0],
+            )
+            self._last_chosen[chat_id] = user.id
+        return user
+
+
+class LeastLoadedPolicy:
+    # Ties are broken randomly so equally loaded users share the work
+    def __call__(
+        self,
+        chat_id: int,  # noqa: ARG002
+        users: list[User],
+        loads: list[int],
+    ) -> User:
+        min_load = min(loads)
+        return choice(  # noqa: S311
+            [
+                user
+                for user, load in zip(users, loads, strict=True)
+                if load == min_load
+            ]
+        )
+
+
+POLICIES: dict[str, type[SelectionPolicy]] = {
+    'softmax': SoftmaxPolicy,
+    'round_robin': RoundRobinPolicy,
+    'least_loaded': LeastLoadedPolicy,
+}
+
+
+class WorkloadCounter:
+    # Number of tasks assigned to each user, per chat. Kept in memory and
+    # updated by every handler which changes a task executor.
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loads: defaultdict[int, Counter[int]] = defaultdict(Counter)
+        # Changes made while a rebuild reads the database, replayed on top
+        # of its result so that none is lost. The membership cache and the
+        # reminders are rebuilt the same way. Entries are (chat id, user
+        # id, load change).
+        self._journal: list[tuple[int, int, int]] | None = None
+
+    def rebuild(self, db: Database) -> None:
+        loads: defaultdict[int, Counter[int]] = defaultdict(Counter)
+        # Handlers change tasks and loads in write transactions. Counting
+        # in one means no change is half done on SQLite: the earlier ones
+        # are in the counts, the later ones in the journal.
+        with write_transaction(db):
+            with self._lock:
+                self._journal = []
+            query = (
+                Task.select(Chat.chat_id, Task.executor, fn.COUNT(Task.id))
+                .join(Chat)
+                .where(Task.executor.is_null(False))
+                .group_by(Task.chat, Task.executor)
+                .tuples()
+            )
+            for chat_id, user_id, load in query:
+                loads[chat_id][user_id] = load
+            # Archived tasks still count
+            rollups = (
+                UserRollup.select(
+                    Chat.chat_id, UserRollup.user, UserRollup.executed_count
+                )
+                .join(Chat)
+                .tuples()
+            )
+            for chat_id, user_id, load in rollups:
+                loads[chat_id][user_id] += load
+        with self._lock:
+            for chat_id, user_id, change in self._journal:
+                loads[chat_id][user_id] += change
+            self._journal = None
+            self._loads = loads
+
+    def loads(self, chat_id: int, users: list[User]) -> list[int]:
+        with self._lock:
+            chat_loads = self._loads[chat_id]
+            return [chat_loads[user.id] for user in users]
+
+    def assign(
+        self,
+        chat_id: int,
+        previous_executor_id: int | None,
+        executor_id: int | None,
+    ) -> None:
+        changes = [(previous_executor_id, -1), (executor_id, 1)]
+        with self._lock:
+            chat_loads = self._loads[chat_id]
+            for user_id, change in changes:
+                if user_id is None:
+                    continue
+                chat_loads[user_id] += change
+                if self._journal is not None:
+                    self._journal.append((chat_id, user_id, change))
+
+    def remove(self, chat_id: int, executor_id: int | None) -> None:
+        self.assign(chat_id, executor_id, None)
+
+    def items(self) -> list[tuple[int, int, int]]:
+        # (chat id, user id, load) of every non-zero load
+        with self._lock:
+            return [
+                (chat_id, user_id, load)
+                for chat_id, chat_loads in self._loads.items()
+                for user_id, load in chat_loads.items()
+                if load
+            ]
+
+    def load(self, items: list[tuple[int, int, int]]) -> None:
+        loads: defaultdict[int, Counter[int]] = defaultdict(Counter)
+        for chat_id, user_id, load in items:
+            loads[chat_id][user_id] = load
+        with self._lock:
+            self._loads = loads
+
+
+workload = WorkloadCounter()
@@ -0,0 +1,145 @@
+# Description: Simulates a year of usage to check the task archive. Every
+# day each chat gets new tasks, most of them are finished within a few
+# days, and the archiver runs at the end of the day. Every month the size
+# of the Task table and the latency of /stats and of the workload rebuild
+# are reported, and the statistics are compared with the expected counts.
+#
+# Usage: python scripts/archive_simulation.py --chats 50 --days 365
+#        python scripts/archive_simulation.py --no-archive
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+INSERT_BATCH_SIZE = 500
+
+
+def configure(workdir: Path) -> None:
+    os.chdir(workdir)
+    (workdir / 'db_files').mkdir()
+    os.environ['DATABASE_URL'] = f'sqlite:///{workdir}/main.db'
+    sys.path.insert(0, str(BOT_DIR))
+
+
+def timed(function: Any, *args: Any) -> float:
+    started = time.perf_counter()
+    function(*args)
+    return (time.perf_counter() - started) * 1000
+
+
+def simulate(args: argparse.Namespace, rng: random.Random) -> list[Any]:
+    from archive import TaskArchiver
+    from database import db
+    from models import Chat, Task, User, create_tables
+    from stats import collect_stats
+    from workload import WorkloadCounter
+
+    create_tables()
+    through = Chat.users.get_through_model()
+    chats = {}
+    with db.atomic():
+        for number in range(args.chats):
+            chat = Chat.create(chat_id=-(10**12) - number)
+            users = [
+                User.create(username=f'user_{number}_{user}')
+                for user in range(args.users_per_chat)
+            ]
+            through.insert_many(
+                [{'chat': chat, 'user': user} for user in users]
+            ).execute()
+            chats[chat] = users
+
+    archiver = TaskArchiver(db, 0, args.retention_days)
+    # Expected completed tasks per (Telegram chat id, username)
+    completed: Counter[tuple[int, str]] = Counter()
+    start = datetime.datetime(2024, 1, 1)
+    report = []
+    for day in range(args.days):
+        now = start + datetime.timedelta(days=day)
+        rows = []
+        for chat, users in chats.items():
+            for _ in range(args.tasks_per_day):
+                executor = rng.choice(users)
+                is_finished = rng.random() < args.finished_share
+                rows.append(
+                    {
+                        'creation_time': now.date(),
+                        'creator': rng.choice(users),
+                        'executor': executor,
+                        'chat': chat,
+                        'text': 'Вынести мусор',
+                        'deadline': now.date(),
+                        'is_finished': is_finished,
+                        'finished_time': (
+                            now + datetime.timedelta(hours=rng.randint(1, 72))
+                            if is_finished
+                            else None
+                        ),
+                    }
+                )
+                if is_finished:
+                    completed[chat.chat_id, executor.username] += 1
+        with db.atomic():
+            for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+                Task.insert_many(
+                    rows[offset : offset + INSERT_BATCH_SIZE]
+                ).execute()
+        if args.archive:
+            archiver.tick(now + datetime.timedelta(days=1))
+
+        if (day + 1) % 30 and day + 1 != args.days:
+            continue
+        sample = rng.sample(list(chats), min(10, len(chats)))
+        stats_ms = [timed(collect_stats, db, chat.chat_id) for chat in sample]
+        exact = all(
+            user_stats.completed_task_count
+            == completed[chat.chat_id, user_stats.username]
+            for chat in sample
+            for user_stats in collect_stats(db, chat.chat_id)
+        )
+        report.append(
+            {
+                'day': day + 1,
+                'hot_tasks': Task.select().count(),
+                'stats_ms': sum(stats_ms) / len(stats_ms),
+                'workload_rebuild_ms': timed(WorkloadCounter().rebuild, db),
+                'stats_exact': exact,
+            }
+        )
+        print(json.dumps(report[-1]))
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Simulated year of usage with the task archive'
+    )
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--users-per-chat', type=int, default=4)
+    parser.add_argument('--tasks-per-day', type=int, default=5)
+    parser.add_argument('--finished-share', type=float, default=0.95)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--retention-days', type=int, default=30)
+    parser.add_argument('--no-archive', dest='archive', action='store_false')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(Path(workdir))
+        from loguru import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+        simulate(args, random.Random(args.seed))  # noqa: S311
+
+
+if __name__ == '__main__':
+    main()
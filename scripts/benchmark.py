@@ -0,0 +1,816 @@
+# Description: Load test of the bot hot paths against fake Telegram Bot API,
+# Giphy and GPT servers. Generates chats, users and tasks, replays a mix
+# of updates through the bot handlers and writes a JSON report with
+# throughput, latency percentiles, SQL query counts and peak RSS. With
+# --shards the updates go through the dispatcher of the sharded runtime to
+# that many bot processes, only the throughput is reported then. With
+# --runtime polling, asyncio or webhook the updates arrive at --rate a
+# second and the latency from arrival to the end of handling is reported:
+# polling handles the arrived updates one after another in getUpdates
+# batches, asyncio polls them from getUpdates of the fake Bot API with
+# the async bot and its chat dispatcher, webhook POSTs them to the webhook
+# server and its chat worker pool.
+# With --flood-limits the fake Bot API answers 429 like Telegram when
+# its flood limits are exceeded and the bot keeps its own rate limits.
+# The run waits until the bot has made all its calls and fails unless
+# they all went through, none retried before its retry_after.
+#
+# Usage: python scripts/benchmark.py --chats 100 --updates 5000
+#        python scripts/benchmark.py --shards 4
+#        python scripts/benchmark.py --runtime webhook --rate 300
+#        python scripts/benchmark.py --runtime asyncio --rate 1000
+#        python scripts/benchmark.py --flood-limits --updates 500
+import argparse
+import asyncio
+import contextlib
+import copy
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import zlib
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.error import HTTPError
+from urllib.parse import parse_qsl, urlsplit
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+TOKEN = '1:benchmark'  # noqa: S105
+DEFAULT_MIX = 'create_task=4,done=2,offer_no=2,stats=1,tasks=3'
+INSERT_BATCH_SIZE = 500
+# Updates a getUpdates call returns at most
+POLLING_BATCH_SIZE = 100
+WEBHOOK_SECRET = 'benchmark'  # noqa: S105
+# Telegram delivers a rejected update again, a little later
+REJECTED_RETRY_DELAY = 0.1
+# Connections Telegram posts updates over, up to webhook max_connections
+WEBHOOK_CONNECTIONS = 16
+# Time for the sender process to start before the first update is due
+SENDER_START_DELAY = 1.0
+# getUpdates waits that long once all updates are delivered
+FEED_IDLE_WAIT = 0.1
+# Telegram flood limits as (calls, seconds): to a chat and overall
+CHAT_FLOOD_LIMIT = (20, 60.0)
+GLOBAL_FLOOD_LIMIT = (30, 1.0)
+# Time the bot gets to make its calls after the run
+DRAIN_TIMEOUT = 600
+# Outcomes of a run with --flood-limits which fail it
+FLOOD_FAILURES = ('early_retries', 'unanswered_429', 'dropped', 'failed')
+
+
+def flood_wait(
+    calls: deque[float], limit: tuple[int, float], now: float
+) -> float:
+    # Seconds until the window has room for one more call
+    count, window = limit
+    while calls and calls[0] <= now - window:
+        calls.popleft()
+    if len(calls) < count:
+        return 0.0
+    return calls[0] + window - now
+
+
+class FloodLimits:
+    # Sliding windows of the accepted calls. A rejected call is told to
+    # retry after the whole seconds until the windows have room, a chat
+    # calling again before that is rejected again.
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.chat_calls: dict[int, deque[float]] = defaultdict(deque)
+        self.global_calls: deque[float] = deque()
+        self.blocked_until: dict[int, float] = {}
+        self.accepted = 0
+        self.rejected = 0
+        self.early_retries = 0
+
+    def check(self, chat_id: int) -> int:
+        # 0 when the call is accepted, its retry_after otherwise
+        now = time.monotonic()
+        with self.lock:
+            blocked = self.blocked_until.get(chat_id, 0.0) - now
+            if blocked > 0:
+                self.early_retries += 1
+            wait = max(
+                blocked,
+                flood_wait(self.chat_calls[chat_id], CHAT_FLOOD_LIMIT, now),
+                flood_wait(self.global_calls, GLOBAL_FLOOD_LIMIT, now),
+            )
+            if wait > 0:
+                retry_after = math.ceil(wait)
+                self.blocked_until[chat_id] = now + retry_after
+                self.rejected += 1
+                return retry_after
+            self.blocked_until.pop(chat_id, None)
+            self.accepted += 1
+            self.chat_calls[chat_id].append(now)
+            self.global_calls.append(now)
+            return 0
+
+    def unanswered(self) -> int:
+        # Chats whose last call was rejected and never retried
+        with self.lock:
+            return len(self.blocked_until)
+
+
+class UpdateFeed:
+    # Updates getUpdates returns, update number i arrives at i / rate
+    # seconds from the start. Each update is returned once, as if every
+    # batch was confirmed by the offset of the next call.
+    def __init__(self, updates: list[dict[str, Any]], rate: float) -> None:
+        self.updates = updates
+        self.rate = rate
+        self.started = 0.0
+        self.position = 0
+        self.lock = threading.Lock()
+
+    def start(self) -> float:
+        self.started = time.perf_counter()
+        return self.started
+
+    def next_batch(self, timeout: float) -> list[dict[str, Any]]:
+        # Waits for the next update like a long poll
+        deadline = time.perf_counter() + timeout
+        while True:
+            now = time.perf_counter()
+            with self.lock:
+                arrived = min(
+                    int((now - self.started) * self.rate) + 1,
+                    len(self.updates),
+                )
+                if arrived > self.position:
+                    end = min(arrived, self.position + POLLING_BATCH_SIZE)
+                    batch = self.updates[self.position : end]
+                    self.position = end
+                    return batch
+                if self.position == len(self.updates):
+                    wait = FEED_IDLE_WAIT
+                else:
+                    wait = self.started + self.position / self.rate - now
+            if now + wait > deadline:
+                time.sleep(max(deadline - now, 0))
+                return []
+            time.sleep(wait)
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    # Answers like the Bot API, Giphy and GPT, without delays
+    message_ids = itertools.count(10**9)
+    # Calls by method and when the last one came, to wait for the bot
+    calls: Counter[str] = Counter()
+    last_call_at = 0.0
+    calls_lock = threading.Lock()
+    # Set to enforce the flood limits
+    flood: FloodLimits | None = None
+    # Set to serve updates from getUpdates
+    feed: UpdateFeed | None = None
+
+    def do_GET(self) -> None:  # noqa: N802
+        self._handle()
+
+    def do_POST(self) -> None:  # noqa: N802
+        self._handle()
+
+    def _handle(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        method = urlsplit(self.path).path.rsplit('/', 1)[-1]
+        with FakeApiHandler.calls_lock:
+            FakeApiHandler.calls[method] += 1
+            FakeApiHandler.last_call_at = time.perf_counter()
+        if self.path.startswith('/gpt'):
+            self._reply({'replies': [' не забыть перчатки.']})
+        elif self.path.startswith('/giphy'):
+            gifs = [
+                {'images': {'original': {'url': f'https://gif/{number}'}}}
+                for number in range(25)
+            ]
+            self._reply({'data': gifs})
+        else:
+            # Bot API parameters are sent in the query string, by the
+            # async bot as a form
+            url = urlsplit(self.path)
+            method = url.path.rsplit('/', 1)[-1]
+            params = dict(parse_qsl(url.query))
+            if self.headers.get('Content-Type', '').startswith(
+                'application/x-www-form-urlencoded'
+            ):
+                params.update(parse_qsl(body.decode()))
+            retry_after = 0
+            if FakeApiHandler.flood and 'chat_id' in params:
+                retry_after = FakeApiHandler.flood.check(
+                    int(params['chat_id'])
+                )
+            if retry_after:
+                self._reply(
+                    {
+                        'ok': False,
+                        'error_code': HTTPStatus.TOO_MANY_REQUESTS,
+                        'description': 'Too Many Requests: retry after '
+                        f'{retry_after}',
+                        'parameters': {'retry_after': retry_after},
+                    },
+                    HTTPStatus.TOO_MANY_REQUESTS,
+                )
+            else:
+                self._reply(
+                    {'ok': True, 'result': self._result(method, params)}
+                )
+
+    def _result(self, method: str, params: dict[str, str]) -> Any:
+        if method in {'deleteMessage', 'answerCallbackQuery'}:
+            return True
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bot'}
+        if method == 'getUpdates':
+            if self.feed is None:
+                return []
+            return self.feed.next_batch(float(params.get('timeout', 0)))
+        chat_id = int(params.get('chat_id', 0))
+        return {
+            'message_id': next(self.message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'group'},
+            'text': 'ok',
+        }
+
+    def _reply(self, payload: Any, status: HTTPStatus = HTTPStatus.OK) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: object) -> None:  # noqa: A002
+        pass
+
+
+def start_fake_api() -> str:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def configure(workdir: Path, api_url: str, flood_limits: bool = False) -> None:
+    # The bot reads its configuration at import time
+    os.chdir(workdir)
+    (workdir / 'db_files').mkdir()
+    os.environ.update(
+        {
+            'DATABASE_URL': f'sqlite:///{workdir}/main.db',
+            'TELEGRAM_BOT_API_TOKEN': TOKEN,
+            'TELEGRAM_API_URL': f'{api_url}/bot{{0}}/{{1}}',
+            'GIPHY_API_URL': f'{api_url}/giphy',
+            'GPT_URL': f'{api_url}/gpt',
+            'BOT_RUNTIME': 'benchmark',
+            'METRICS_PORT': '0',
+            'LOGURU_LEVEL': 'WARNING',
+        }
+    )
+    if not flood_limits:
+        # Flood limits of the real API would make the run measure the
+        # rate limiter
+        os.environ.update(
+            {
+                'TELEGRAM_GLOBAL_RATE': '1000000',
+                'TELEGRAM_CHAT_RATE': '1000000',
+                'TELEGRAM_CHAT_BURST': '1000000',
+            }
+        )
+    sys.path.insert(0, str(BOT_DIR))
+
+
+def generate(args: argparse.Namespace, rng: random.Random) -> dict[str, Any]:
+    # Chats with their users and tasks, task messages get ids from 1.
+    # Open tasks are kept as (message id, task id) for their buttons.
+    from database import db
+    from models import Chat, Task, User, create_tables
+
+    create_tables()
+    through = Chat.users.get_through_model()
+    chats: dict[int, list[str]] = {}
+    task_messages: dict[int, list[tuple[int, int]]] = defaultdict(list)
+    with db.atomic():
+        for chat_number in range(args.chats):
+            chat_id = -(10**12) - chat_number
+            chat = Chat.create(chat_id=chat_id)
+            users = [
+                User.create(username=f'user_{chat_number}_{number}')
+                for number in range(args.users_per_chat)
+            ]
+            through.insert_many(
+                [{'chat': chat, 'user': user} for user in users]
+            ).execute()
+            chats[chat_id] = [user.username for user in users]
+            rows = [
+                {
+                    'creator': rng.choice(users),
+                    'executor': rng.choice([None, *users]),
+                    'chat': chat,
+                    'text': f'Задача {message_id}',
+                    'is_finished': rng.random() < args.finished_share,
+                    'message_id': message_id,
+                }
+                for message_id in range(1, args.tasks_per_chat + 1)
+            ]
+            for start in range(0, len(rows), INSERT_BATCH_SIZE):
+                inserted = Task.insert_many(
+                    rows[start : start + INSERT_BATCH_SIZE]
+                ).returning(Task.message_id, Task.id, Task.is_finished)
+                task_messages[chat_id].extend(
+                    (message_id, task_id)
+                    for message_id, task_id, is_finished in (
+                        inserted.tuples().execute()
+                    )
+                    if not is_finished
+                )
+    return {'chats': chats, 'task_messages': task_messages}
+
+
+def message(
+    chat_id: int, username: str, text: str, message_id: int
+) -> dict[str, Any]:
+    return {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'group'},
+        'from': {
+            'id': zlib.crc32(username.encode()),
+            'is_bot': False,
+            'first_name': username,
+            'username': username,
+        },
+        'text': text,
+    }
+
+
+def build_updates(
+    args: argparse.Namespace, data: dict[str, Any], rng: random.Random
+) -> list[tuple[str, int, dict[str, Any]]]:
+    # (kind, chat id, update) in replay order
+    from callbacks import encode
+
+    mix = {
+        kind: int(weight)
+        for kind, weight in (
+            pair.split('=') for pair in args.mix.split(',') if pair
+        )
+    }
+    kinds, weights = list(mix), list(mix.values())
+    message_ids = itertools.count(10**6)
+    updates = []
+    for update_id in range(args.updates):
+        kind = rng.choices(kinds, weights)[0]
+        chat_id = rng.choice(list(data['chats']))
+        username = rng.choice(data['chats'][chat_id])
+        open_tasks = data['task_messages'][chat_id]
+        if kind in {'done', 'offer_no'} and not open_tasks:
+            kind = 'create_task'
+        update: dict[str, Any] = {'update_id': update_id}
+        if kind == 'create_task':
+            update['message'] = message(
+                chat_id, username, 'Вынести мусор', next(message_ids)
+            )
+        elif kind in {'stats', 'tasks'}:
+            update['message'] = message(
+                chat_id, username, f'/{kind}', next(message_ids)
+            )
+            update['message']['entities'] = [
+                {'type': 'bot_command', 'offset': 0, 'length': len(kind) + 1}
+            ]
+        else:
+            task_message_id, task_id = rng.choice(open_tasks)
+            task_message = message(
+                chat_id, username, '#task\n\nЗадача', task_message_id
+            )
+            if kind == 'done':
+                open_tasks.remove((task_message_id, task_id))
+                callback_message = task_message
+            else:
+                callback_message = message(
+                    chat_id, username, 'Предлагаю', next(message_ids)
+                )
+                callback_message['reply_to_message'] = task_message
+            update['callback_query'] = {
+                'id': str(update_id),
+                'from': callback_message['from'],
+                'chat_instance': str(chat_id),
+                'message': callback_message,
+                'data': encode(kind, chat_id, task_id),
+            }
+        updates.append((kind, chat_id, update))
+    # Updates delivered again a little later, as after a crash of polling
+    for _ in range(int(args.updates * args.duplicates)):
+        index = rng.randrange(len(updates))
+        _, chat_id, update = updates[index]
+        updates.insert(
+            min(index + rng.randint(1, 50), len(updates)),
+            ('duplicate', chat_id, copy.deepcopy(update)),
+        )
+    return updates
+
+
+def percentile(values: list[float], share: float) -> float:
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def failed_calls() -> int:
+    from metrics import registry
+
+    return sum(
+        int(float(line.rsplit(' ', 1)[1]))
+        for line in registry.render().splitlines()
+        if line.startswith('telegram_errors_total{')
+    )
+
+
+def stop_bot() -> dict[str, Any]:
+    # With --flood-limits the bot gets the time to make the calls it has
+    # queued, the calls left then are dropped by the stop
+    import bot
+
+    bot.annotator.shutdown()
+    report = {}
+    if FakeApiHandler.flood:
+        started = time.perf_counter()
+        while (
+            bot.outbox.pending()
+            and time.perf_counter() - started < DRAIN_TIMEOUT
+        ):
+            time.sleep(0.1)
+        report['flood'] = {
+            'drain_s': time.perf_counter() - started,
+            'accepted': FakeApiHandler.flood.accepted,
+            'rejected_429': FakeApiHandler.flood.rejected,
+            'early_retries': FakeApiHandler.flood.early_retries,
+            'unanswered_429': FakeApiHandler.flood.unanswered(),
+            'dropped': bot.outbox.pending(),
+            'failed': failed_calls(),
+        }
+    bot.outbox.stop()
+    return report
+
+
+def replay(
+    args: argparse.Namespace, updates: list[tuple[str, int, dict[str, Any]]]
+) -> dict[str, Any]:
+    import bot
+    from metrics import query_count, registry
+    from telebot.types import Update
+
+    bot.outbox.start()
+    latencies: dict[str, list[float]] = defaultdict(list)
+    queries: dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+
+    # Updates of one chat are handled in order by one worker, like in the
+    # webhook and asyncio runtimes
+    by_worker: dict[int, list[tuple[str, Update]]] = defaultdict(list)
+    for kind, chat_id, update in updates:
+        by_worker[chat_id % args.concurrency].append(
+            (kind, Update.de_json(update))
+        )
+
+    def work(items: list[tuple[str, Update]]) -> None:
+        for kind, update in items:
+            started = time.perf_counter()
+            queries_before = query_count()
+            bot.bot.process_new_updates([update])
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies[kind].append(elapsed)
+                queries[kind] += query_count() - queries_before
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(work, by_worker.values()))
+    duration = time.perf_counter() - started
+    sent = stop_bot()
+
+    results = {}
+    for kind, values in sorted(latencies.items()):
+        values.sort()
+        results[kind] = {
+            'count': len(values),
+            'mean_ms': sum(values) / len(values) * 1000,
+            'p50_ms': percentile(values, 0.5) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'queries_per_update': queries[kind] / len(values),
+        }
+    return {
+        'duration_s': duration,
+        'throughput_updates_per_s': len(updates) / duration,
+        'sql_queries': sum(queries.values()),
+        'duplicates_dropped': registry.counter(
+            'duplicate_updates_total'
+        ).value,
+        'handlers': results,
+        **sent,
+    }
+
+
+def replay_sharded(
+    args: argparse.Namespace, updates: list[tuple[str, int, dict[str, Any]]]
+) -> dict[str, Any]:
+    from sharding import ShardDispatcher
+
+    dispatcher = ShardDispatcher(args.shards)
+    dispatcher.start()
+    started = time.perf_counter()
+    for _, _, update in updates:
+        dispatcher.submit(update)
+    dispatcher.drain()
+    duration = time.perf_counter() - started
+    dispatcher.stop()
+    return {
+        'duration_s': duration,
+        'throughput_updates_per_s': len(updates) / duration,
+    }
+
+
+def latency_report(latencies: list[float]) -> dict[str, float]:
+    latencies.sort()
+    return {
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+    }
+
+
+def replay_polling(
+    args: argparse.Namespace, updates: list[tuple[str, int, dict[str, Any]]]
+) -> dict[str, Any]:
+    # Update number i arrives at i / rate seconds
+    import bot
+    from telebot.types import Update
+
+    bot.outbox.start()
+    parsed = [Update.de_json(update) for _, _, update in updates]
+    latencies = []
+    started = time.perf_counter()
+    handled = 0
+    while handled < len(parsed):
+        now = time.perf_counter() - started
+        arrived = min(int(now * args.rate) + 1, len(parsed))
+        if arrived <= handled:
+            time.sleep(handled / args.rate - now)
+            continue
+        batch = range(handled, min(arrived, handled + POLLING_BATCH_SIZE))
+        for index in batch:
+            bot.bot.process_new_updates([parsed[index]])
+            latencies.append(time.perf_counter() - started - index / args.rate)
+        handled = batch.stop
+    duration = time.perf_counter() - started
+    sent = stop_bot()
+    return {
+        'duration_s': duration,
+        'throughput_updates_per_s': len(updates) / duration,
+        'latency': latency_report(latencies),
+        **sent,
+    }
+
+
+def replay_asyncio(
+    args: argparse.Namespace, updates: list[tuple[str, int, dict[str, Any]]]
+) -> dict[str, Any]:
+    # Update number i is returned by getUpdates from i / rate seconds, the
+    # asyncio runtime polls it until every update is handled
+    import async_runtime
+    import bot
+
+    handled_at: dict[int, float] = {}
+    process_new_updates = bot.bot.process_new_updates
+
+    def handle(batch: list[Any]) -> None:
+        process_new_updates(batch)
+        for update in batch:
+            handled_at.setdefault(update.update_id, time.perf_counter())
+
+    bot.bot.process_new_updates = handle
+    update_ids = {update['update_id'] for _, _, update in updates}
+
+    async def serve() -> None:
+        runtime = asyncio.create_task(
+            async_runtime.serve(bot.bot, args.concurrency)
+        )
+        while len(handled_at) < len(update_ids):
+            await asyncio.sleep(0.01)
+        runtime.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await runtime
+
+    bot.outbox.start()
+    feed = FakeApiHandler.feed = UpdateFeed(
+        [update for _, _, update in updates], args.rate
+    )
+    started = feed.start()
+    asyncio.run(serve())
+    duration = time.perf_counter() - started
+    sent = stop_bot()
+    arrived_at: dict[int, float] = {}
+    for index, (_, _, update) in enumerate(updates):
+        arrived_at.setdefault(update['update_id'], started + index / args.rate)
+    return {
+        'duration_s': duration,
+        'throughput_updates_per_s': len(updates) / duration,
+        'latency': latency_report(
+            [
+                handled_at[update_id] - arrival
+                for update_id, arrival in arrived_at.items()
+            ]
+        ),
+        **sent,
+    }
+
+
+def post_update(url: str, header: str, update: dict[str, Any]) -> int:
+    request = urllib.request.Request(  # noqa: S310
+        url,
+        data=json.dumps(update).encode(),
+        headers={'Content-Type': 'application/json', header: WEBHOOK_SECRET},
+    )
+    try:
+        with urllib.request.urlopen(request) as response:  # noqa: S310
+            return response.status
+    except HTTPError as e:
+        return e.code
+
+
+def send_updates(
+    url: str,
+    header: str,
+    arrivals: list[tuple[float, int, dict[str, Any]]],
+) -> tuple[list[float], int]:
+    # Runs in its own process, as Telegram does not share the CPU with the
+    # bot. Updates of a chat go through one connection, in order.
+    by_connection: dict[int, list[tuple[float, dict[str, Any]]]] = defaultdict(
+        list
+    )
+    for arrival, chat_id, update in arrivals:
+        by_connection[chat_id % WEBHOOK_CONNECTIONS].append((arrival, update))
+    acks: list[float] = []
+    rejected = 0
+    lock = threading.Lock()
+
+    def send(items: list[tuple[float, dict[str, Any]]]) -> None:
+        nonlocal rejected
+        for arrival, update in items:
+            time.sleep(max(arrival - time.time(), 0))
+            while True:
+                sent = time.perf_counter()
+                status = post_update(url, header, update)
+                with lock:
+                    acks.append(time.perf_counter() - sent)
+                if status == HTTPStatus.OK:
+                    break
+                with lock:
+                    rejected += 1
+                time.sleep(REJECTED_RETRY_DELAY)
+
+    with ThreadPoolExecutor(max_workers=WEBHOOK_CONNECTIONS) as executor:
+        list(executor.map(send, by_connection.values()))
+    return acks, rejected
+
+
+def replay_webhook(
+    args: argparse.Namespace, updates: list[tuple[str, int, dict[str, Any]]]
+) -> dict[str, Any]:
+    # Update number i is posted at i / rate seconds by another process.
+    # The processes share wall clock time, not perf_counter.
+    import bot
+    from config import WEBHOOK_QUEUE_SIZE
+    from webhook import SECRET_HEADER, WebhookServer
+    from workers import ChatWorkerPool
+
+    handled_at: dict[int, float] = {}
+
+    def handle(update: Any) -> None:
+        bot.bot.process_new_updates([update])
+        handled_at.setdefault(update.update_id, time.time())
+
+    bot.outbox.start()
+    pool = ChatWorkerPool(handle, args.concurrency, WEBHOOK_QUEUE_SIZE)
+    server = WebhookServer(('127.0.0.1', 0), WEBHOOK_SECRET, pool)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    pool.start()
+    with multiprocessing.get_context('spawn').Pool(1) as sender:
+        started = time.time() + SENDER_START_DELAY
+        arrivals = [
+            (started + index / args.rate, chat_id, update)
+            for index, (_, chat_id, update) in enumerate(updates)
+        ]
+        acks, rejected = sender.apply(
+            send_updates, (url, SECRET_HEADER, arrivals)
+        )
+    pool.join()
+    duration = time.time() - started
+    server.shutdown()
+    server.server_close()
+    pool.stop()
+    sent = stop_bot()
+    arrived_at: dict[int, float] = {}
+    for arrival, _, update in arrivals:
+        arrived_at.setdefault(update['update_id'], arrival)
+    return {
+        'duration_s': duration,
+        'throughput_updates_per_s': len(updates) / duration,
+        'latency': latency_report(
+            [
+                handled_at[update_id] - arrival
+                for update_id, arrival in arrived_at.items()
+            ]
+        ),
+        'ack': latency_report(acks),
+        'rejected': rejected,
+        **sent,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Load test of the bot with fake external services'
+    )
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--users-per-chat', type=int, default=5)
+    parser.add_argument('--tasks-per-chat', type=int, default=100)
+    parser.add_argument('--finished-share', type=float, default=0.5)
+    parser.add_argument('--updates', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--shards', type=int, default=0)
+    parser.add_argument(
+        '--runtime',
+        choices=['workers', 'polling', 'asyncio', 'webhook'],
+        default='workers',
+    )
+    # Updates arriving a second, for the polling, asyncio and webhook
+    # runtimes
+    parser.add_argument('--rate', type=float, default=100)
+    # Share of updates delivered twice
+    parser.add_argument('--duplicates', type=float, default=0.0)
+    # Telegram flood limits enforced by the fake API, kept by the bot
+    parser.add_argument('--flood-limits', action='store_true')
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--report', default='reports/benchmark.json')
+    args = parser.parse_args()
+    if args.flood_limits and args.shards:
+        # The calls left in the shard processes can not be waited for
+        parser.error('--flood-limits does not work with --shards')
+    report_path = Path(args.report).resolve()
+    rng = random.Random(args.seed)  # noqa: S311
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.flood_limits:
+            FakeApiHandler.flood = FloodLimits()
+        configure(Path(workdir), start_fake_api(), args.flood_limits)
+        from loguru import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+
+        generate_started = time.perf_counter()
+        data = generate(args, rng)
+        generate_duration = time.perf_counter() - generate_started
+        updates = build_updates(args, data, rng)
+        if args.shards:
+            results = replay_sharded(args, updates)
+        elif args.runtime == 'polling':
+            results = replay_polling(args, updates)
+        elif args.runtime == 'asyncio':
+            results = replay_asyncio(args, updates)
+        elif args.runtime == 'webhook':
+            results = replay_webhook(args, updates)
+        else:
+            results = replay(args, updates)
+
+    report = {
+        'config': vars(args),
+        'generate_s': generate_duration,
+        **results,
+        # Kilobytes on Linux
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    flood = report.get('flood')
+    if flood and any(flood[outcome] for outcome in FLOOD_FAILURES):
+        sys.exit('The bot did not keep the flood limits')
+
+
+if __name__ == '__main__':
+    main()
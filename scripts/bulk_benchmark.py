@@ -0,0 +1,133 @@
+# Description: Benchmark of creating many tasks at once. The same tasks
+# are created in each chat once as plain messages, a task each, and once
+# with a single /bulk message, against the fake Telegram Bot API and GPT
+# servers of benchmark.py. Reports the handler time, the time until the
+# bot makes its last API call, API calls by method and SQL queries.
+#
+# Usage: python scripts/bulk_benchmark.py --chats 10 --tasks 50
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+from benchmark import (
+    FakeApiHandler,
+    configure,
+    generate,
+    message,
+    start_fake_api,
+)
+
+# The bot is done when it makes no API call for that long
+IDLE_TIME = 1.0
+
+
+def wait_idle() -> float:
+    while time.perf_counter() - FakeApiHandler.last_call_at < IDLE_TIME:
+        time.sleep(IDLE_TIME / 10)
+    return FakeApiHandler.last_call_at
+
+
+def run(updates: list[dict[str, Any]]) -> dict[str, Any]:
+    import bot
+    from metrics import query_count
+    from telebot.types import Update
+
+    parsed = [Update.de_json(update) for update in updates]
+    with FakeApiHandler.calls_lock:
+        calls_before = Counter(FakeApiHandler.calls)
+    queries_before = query_count()
+    started = time.perf_counter()
+    for update in parsed:
+        bot.bot.process_new_updates([update])
+    handled = time.perf_counter()
+    queries = query_count() - queries_before
+    done = wait_idle()
+    with FakeApiHandler.calls_lock:
+        calls = FakeApiHandler.calls - calls_before
+    return {
+        'handlers_s': handled - started,
+        'until_last_api_call_s': done - started,
+        'sql_queries': queries,
+        'api_calls': sum(calls.values()),
+        'api_calls_by_method': dict(sorted(calls.items())),
+    }
+
+
+def benchmark(args: argparse.Namespace, rng: random.Random) -> dict[str, Any]:
+    import bot
+
+    data = generate(
+        argparse.Namespace(
+            chats=args.chats,
+            users_per_chat=args.users_per_chat,
+            tasks_per_chat=0,
+            finished_share=0,
+        ),
+        rng,
+    )
+    bot.outbox.start()
+    wait_idle()
+    texts = [f'Задача {number}' for number in range(args.tasks)]
+    update_ids = iter(range(10**6))
+    message_ids = iter(range(10**6))
+
+    def update(chat_id: int, text: str) -> dict[str, Any]:
+        update = {
+            'update_id': next(update_ids),
+            'message': message(
+                chat_id,
+                rng.choice(data['chats'][chat_id]),
+                text,
+                next(message_ids),
+            ),
+        }
+        if text.startswith('/'):
+            update['message']['entities'] = [
+                {'type': 'bot_command', 'offset': 0, 'length': len('/bulk')}
+            ]
+        return update
+
+    report: dict[str, Any] = {'chats': args.chats, 'tasks': args.tasks}
+    report['one_by_one'] = run(
+        [update(chat_id, text) for chat_id in data['chats'] for text in texts],
+    )
+    report['bulk'] = run(
+        [
+            update(chat_id, '/bulk\n' + '\n'.join(texts))
+            for chat_id in data['chats']
+        ],
+    )
+    bot.annotator.shutdown()
+    bot.outbox.stop()
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark of creating many tasks at once'
+    )
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--users-per-chat', type=int, default=5)
+    # Tasks created in each chat
+    parser.add_argument('--tasks', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(Path(workdir), start_fake_api())
+        from loguru import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+        report = benchmark(args, random.Random(args.seed))  # noqa: S311
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
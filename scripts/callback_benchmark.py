@@ -0,0 +1,105 @@
+# Description: Microbenchmark of callback dispatch through TeleBot.
+# Compares the cost per callback of the chain of filtered handlers the
+# callbacks went through before, where each handler filter checked the
+# data in turn and the handler parsed it again, with one handler decoding
+# the data and routing it through the dict. Handlers do nothing.
+#
+# Usage: python scripts/callback_benchmark.py --callbacks 100000
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections.abc import Callable
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+TOKEN = '1:benchmark'  # noqa: S105
+CHAT_ID = -(10**12)
+TARGET_ACTIONS = {'remove_task', 'complete_task', 'stop_repeat'}
+
+# Filters of the callback handlers in the order they were registered
+LEGACY_FILTERS: list[Callable[[Any], bool]] = [
+    lambda c: c.data.startswith('page_'),
+    lambda c: 'remove_task' in c.data,
+    lambda c: 'complete_task' in c.data,
+    lambda c: c.data.startswith('stop_repeat_'),
+    lambda c: c.data == 'ok_remove',
+    lambda c: c.data == 'ok_stay',
+    lambda c: c.data == 'done',
+    lambda c: c.data == 'cancel',
+    lambda c: c.data == 'offer_yes',
+    lambda c: c.data == 'offer_no',
+]
+
+
+def legacy_data(action: str, target: int) -> str:
+    if action.startswith('page_') or action in TARGET_ACTIONS:
+        return f'{action}_{target}'
+    return action
+
+
+def legacy_handler(call: Any) -> None:
+    call.data.split('_')
+
+
+def callback(data: str) -> Any:
+    return SimpleNamespace(
+        data=data, message=SimpleNamespace(chat=SimpleNamespace(id=CHAT_ID))
+    )
+
+
+def measure(bot: Any, calls: list[Any]) -> float:
+    started = time.perf_counter()
+    for call in calls:
+        bot.process_new_callback_query([call])
+    return (time.perf_counter() - started) / len(calls) * 10**9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Microbenchmark of callback dispatch'
+    )
+    parser.add_argument('--callbacks', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ.setdefault('TELEGRAM_BOT_API_TOKEN', TOKEN)
+    sys.path.insert(0, str(BOT_DIR))
+    import telebot
+    from callbacks import ACTIONS, CallbackRouter, encode
+
+    rng = random.Random(args.seed)  # noqa: S311
+    legacy_calls = []
+    calls = []
+    for _ in range(args.callbacks):
+        action = rng.choice(list(ACTIONS))
+        target = rng.randrange(1, 10**7)
+        legacy_calls.append(callback(legacy_data(action, target)))
+        if action in {'ok_remove', 'ok_stay'}:
+            calls.append(callback(encode(action)))
+        else:
+            calls.append(callback(encode(action, CHAT_ID, target)))
+
+    legacy_bot = telebot.TeleBot(TOKEN, threaded=False)
+    for matches in LEGACY_FILTERS:
+        legacy_bot.register_callback_query_handler(legacy_handler, matches)
+
+    router = CallbackRouter()
+    router.route(*ACTIONS)(lambda *_: None)
+    bot = telebot.TeleBot(TOKEN, threaded=False)
+    bot.register_callback_query_handler(router.dispatch, lambda _: True)
+
+    report = {
+        'callbacks': args.callbacks,
+        'filter_chain_ns_per_callback': measure(legacy_bot, legacy_calls),
+        'router_ns_per_callback': measure(bot, calls),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+# Description: Benchmark of the SQLite setup under concurrent handlers.
+# Threads run handler-like transactions, reading a page of active tasks
+# or creating a task and finishing another, against two databases: as
+# they were set up before database.py, default pragmas and 'with db'
+# opening and closing the connection for every handler, and with the
+# pragmas of database.py, WAL journal and connections kept open.
+# Reports handled operations a second, latency percentiles and operations
+# failed with "database is locked".
+#
+# Usage: python scripts/database_benchmark.py --threads 8 --seconds 10
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from contextlib import AbstractContextManager
+from pathlib import Path
+from typing import Any
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+TOKEN = '1:benchmark'  # noqa: S105
+PAGE_SIZE = 10
+TASKS_PER_CHAT = 50
+INSERT_BATCH_SIZE = 500
+
+
+def configure(workdir: Path) -> None:
+    os.chdir(workdir)
+    (workdir / 'db_files').mkdir()
+    os.environ['DATABASE_URL'] = f'sqlite:///{workdir}/main.db'
+    os.environ.setdefault('TELEGRAM_BOT_API_TOKEN', TOKEN)
+    sys.path.insert(0, str(BOT_DIR))
+
+
+def populate(database: Any, chats: int) -> None:
+    from models import MODELS, Chat, Task, User
+
+    with database.bind_ctx(MODELS), database.atomic():
+        database.create_tables(MODELS)
+        user = User.create(username='anna')
+        rows = []
+        for number in range(chats):
+            chat = Chat.create(chat_id=-number)
+            rows.extend(
+                {'creator': user, 'executor': user, 'chat': chat, 'text': '.'}
+                for _ in range(TASKS_PER_CHAT)
+            )
+        for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+            Task.insert_many(
+                rows[offset : offset + INSERT_BATCH_SIZE]
+            ).execute()
+
+
+def read_page(chat: int) -> None:
+    from models import Task
+
+    list(
+        Task.select(Task.id, Task.text)
+        .where(Task.chat == chat, Task.is_finished == False)  # noqa: E712
+        .order_by(Task.id)
+        .limit(PAGE_SIZE)
+    )
+
+
+def create_and_finish(chat: int) -> None:
+    from models import Task
+
+    Task.create(creator=1, executor=1, chat=chat, text='.')
+    first = (
+        Task.select(Task.id)
+        .where(Task.chat == chat, Task.is_finished == False)  # noqa: E712
+        .order_by(Task.id)
+        .first()
+    )
+    Task.update(is_finished=True).where(Task.id == first.id).execute()
+
+
+def run(
+    args: argparse.Namespace,
+    read: Callable[[], AbstractContextManager[Any]],
+    write: Callable[[], AbstractContextManager[Any]],
+) -> dict[str, float]:
+    latencies: list[float] = []
+    failures = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def handle(seed: int) -> None:
+        nonlocal failures
+        rng = random.Random(seed)  # noqa: S311
+        while time.perf_counter() < deadline:
+            chat = rng.randint(1, args.chats)
+            writes = rng.random() < args.write_share
+            started = time.perf_counter()
+            try:
+                with write() if writes else read():
+                    (create_and_finish if writes else read_page)(chat)
+            except Exception:
+                with lock:
+                    failures += 1
+                continue
+            with lock:
+                latencies.append((time.perf_counter() - started) * 1000)
+
+    threads = [
+        threading.Thread(target=handle, args=(args.seed + number,))
+        for number in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        'operations_per_second': len(latencies) / args.seconds,
+        'p50_ms': percentiles[49],
+        'p99_ms': percentiles[98],
+        'failed': failures,
+    }
+
+
+def benchmark(args: argparse.Namespace, workdir: Path) -> dict[str, Any]:
+    from database import SQLITE_PRAGMAS, write_transaction
+    from models import MODELS
+    from peewee import SqliteDatabase
+
+    report: dict[str, Any] = {
+        'threads': args.threads,
+        'write_share': args.write_share,
+    }
+    # Before: default journal and synchronous, a connection per handler
+    legacy = SqliteDatabase(workdir / 'legacy.db')
+    populate(legacy, args.chats)
+    with legacy.bind_ctx(MODELS):
+        report['before'] = run(args, lambda: legacy, lambda: legacy)
+    legacy.close()
+
+    database = SqliteDatabase(workdir / 'wal.db', pragmas=SQLITE_PRAGMAS)
+    populate(database, args.chats)
+    with database.bind_ctx(MODELS):
+        report['after'] = run(
+            args, database.atomic, lambda: write_transaction(database)
+        )
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the SQLite setup under concurrent handlers'
+    )
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--write-share', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(Path(workdir))
+        from loguru import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+        report = benchmark(args, Path(workdir))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+# Description: Benchmark of task lookups by message id, as done by the
+# done, cancel and offer buttons, in a chat with a long task history.
+# Compares the lookup the handlers did before, loading every task of the
+# chat and filtering them by message id, with repository.get_task_by_message
+# which reads the unique (chat, message_id) index.
+# Reports latency percentiles of each.
+#
+# Usage: python scripts/lookup_benchmark.py --tasks 100000
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+TOKEN = '1:benchmark'  # noqa: S105
+CHAT_ID = -(10**12)
+INSERT_BATCH_SIZE = 500
+
+
+def configure(workdir: Path) -> None:
+    os.chdir(workdir)
+    (workdir / 'db_files').mkdir()
+    os.environ['DATABASE_URL'] = f'sqlite:///{workdir}/main.db'
+    os.environ.setdefault('TELEGRAM_BOT_API_TOKEN', TOKEN)
+    sys.path.insert(0, str(BOT_DIR))
+
+
+def populate(args: argparse.Namespace, rng: random.Random) -> None:
+    from database import db
+    from models import Chat, Task, User, create_tables
+
+    create_tables()
+    with db.atomic():
+        chat = Chat.create(chat_id=CHAT_ID)
+        users = [User.create(username=f'user_{number}') for number in range(4)]
+        chat.users.add(users)
+        rows = [
+            {
+                'creator': rng.choice(users),
+                'executor': rng.choice(users),
+                'chat': chat,
+                'text': 'Вынести мусор',
+                'message_id': message_id,
+                'is_finished': message_id <= args.tasks - args.open_tasks,
+            }
+            for message_id in range(1, args.tasks + 1)
+        ]
+        for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+            Task.insert_many(
+                rows[offset : offset + INSERT_BATCH_SIZE]
+            ).execute()
+
+
+def legacy_lookup(message_id: int) -> Any:
+    # The handlers before repository.py
+    from models import Chat
+
+    return list(
+        filter(
+            lambda task: task.message_id == message_id,
+            Chat.get(Chat.chat_id == CHAT_ID).tasks,
+        )
+    )[0]
+
+
+def measure(lookup: Callable[[int], Any], message_ids: list[int]) -> Any:
+    latencies = []
+    for message_id in message_ids:
+        started = time.perf_counter()
+        task = lookup(message_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+        if task.message_id != message_id:
+            return {'error': f'found {task.message_id} for {message_id}'}
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        'lookups': len(message_ids),
+        'p50_ms': percentiles[49],
+        'p99_ms': percentiles[98],
+    }
+
+
+def benchmark(args: argparse.Namespace, rng: random.Random) -> dict[str, Any]:
+    from database import db
+    from repository import get_task_by_message
+
+    populate(args, rng)
+    # Buttons are pressed on recent messages, the open tasks
+    recent = range(args.tasks - args.open_tasks + 1, args.tasks + 1)
+    with db.atomic():
+        return {
+            'tasks': args.tasks,
+            'before': measure(
+                legacy_lookup,
+                [rng.choice(recent) for _ in range(args.legacy_lookups)],
+            ),
+            'after': measure(
+                lambda message_id: get_task_by_message(CHAT_ID, message_id),
+                [rng.choice(recent) for _ in range(args.lookups)],
+            ),
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark of task lookups by message id'
+    )
+    parser.add_argument('--tasks', type=int, default=100000)
+    parser.add_argument('--open-tasks', type=int, default=100)
+    parser.add_argument('--lookups', type=int, default=10000)
+    # The old lookup reads the whole chat, fewer of them are enough
+    parser.add_argument('--legacy-lookups', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(Path(workdir))
+        from loguru import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+        report = benchmark(args, random.Random(args.seed))  # noqa: S311
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+# Description: Benchmark of spawning recurring tasks. Fills the database
+# with rules all due today across many chats and runs one spawner tick,
+# for each of the given rule counts. Reports the tick time, the longest
+# write transaction and the traced memory of the tick: what it retains,
+# the scheduled reminders of the new tasks, and its peak above that,
+# which should not grow with the number of rules.
+#
+# Usage: python scripts/recurring_benchmark.py --rules 10000,100000
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+TOKEN = '1:benchmark'  # noqa: S105
+INSERT_BATCH_SIZE = 500
+
+
+def configure(workdir: Path) -> None:
+    os.chdir(workdir)
+    (workdir / 'db_files').mkdir()
+    os.environ['DATABASE_URL'] = f'sqlite:///{workdir}/main.db'
+    os.environ.setdefault('TELEGRAM_BOT_API_TOKEN', TOKEN)
+    sys.path.insert(0, str(BOT_DIR))
+
+
+def populate(args: argparse.Namespace, rules: int, today: Any) -> None:
+    from database import db
+    from models import MODELS, Chat, RecurringTask, User, create_tables
+
+    db.drop_tables(MODELS)
+    create_tables()
+    through = Chat.users.get_through_model()
+    with db.atomic():
+        chats = []
+        for number in range(args.chats):
+            chat = Chat.create(chat_id=-(10**12) - number)
+            users = [
+                User.create(username=f'user_{number}_{user}')
+                for user in range(args.users_per_chat)
+            ]
+            through.insert_many(
+                [{'chat': chat, 'user': user} for user in users]
+            ).execute()
+            chats.append((chat, users[0]))
+        rows = [
+            {
+                'chat': chats[number % len(chats)][0],
+                'creator': chats[number % len(chats)][1],
+                'text': f'Вынести мусор #{number}',
+                'interval_days': 7,
+                'next_occurrence': today,
+            }
+            for number in range(rules)
+        ]
+        for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+            RecurringTask.insert_many(
+                rows[offset : offset + INSERT_BATCH_SIZE]
+            ).execute()
+
+
+def tick(today: Any, traced: bool) -> dict[str, float]:
+    import recurring
+    from database import db
+
+    transactions: list[float] = []
+    write_transaction = recurring.write_transaction
+
+    @contextmanager
+    def timed(database: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        with write_transaction(database):
+            yield
+        transactions.append(time.perf_counter() - started)
+
+    announced = 0
+
+    def on_spawned(_: int, tasks: list[Any]) -> None:
+        nonlocal announced
+        announced += len(tasks)
+
+    recurring.write_transaction = timed
+    if traced:
+        tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        spawned = recurring.RecurringSpawner(db, 0, 0, on_spawned).tick(today)
+        elapsed = time.perf_counter() - started
+        retained, peak = tracemalloc.get_traced_memory() if traced else (0, 0)
+    finally:
+        tracemalloc.stop()
+        recurring.write_transaction = write_transaction
+    result = {
+        'spawned': spawned,
+        'announced': announced,
+        'tick_s': elapsed,
+        'transactions': len(transactions),
+        'longest_transaction_ms': max(transactions) * 1000,
+    }
+    if traced:
+        result['retained_mib'] = retained / 2**20
+        result['peak_above_retained_mib'] = (peak - retained) / 2**20
+    return result
+
+
+def benchmark(args: argparse.Namespace) -> list[dict[str, Any]]:
+    from database import db
+    from models import RecurringTask, Task
+
+    today = datetime.date(2024, 3, 1)
+    report = []
+    for rules in args.rules:
+        populate(args, rules, today)
+        result: dict[str, Any] = {'rules': rules, 'chats': args.chats}
+        result['timed'] = tick(today, traced=False)
+        # Tracing slows the tick, it runs again on the same rules
+        with db.atomic():
+            Task.delete().execute()
+            RecurringTask.update(next_occurrence=today).execute()
+        result['traced'] = tick(today, traced=True)
+        report.append(result)
+        print(json.dumps(result), file=sys.stderr)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark of spawning recurring tasks'
+    )
+    parser.add_argument(
+        '--rules',
+        type=lambda value: [int(rules) for rules in value.split(',')],
+        default=[10000, 100000],
+    )
+    parser.add_argument('--chats', type=int, default=1000)
+    parser.add_argument('--users-per-chat', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(Path(workdir))
+        from loguru import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+        report = benchmark(args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
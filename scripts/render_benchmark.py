@@ -0,0 +1,180 @@
+# Description: Microbenchmark of response rendering. Compares the cost of
+# the texts and keyboards of the common responses as they were rendered
+# before, with keyboards built from buttons and serialized on every send
+# and Markdown escaped on every render, with the rendering module.
+# Reports time and peak traced memory per response; CPython does not count
+# allocations, the peak shows how much a render allocates at once.
+#
+# Usage: python scripts/render_benchmark.py --responses 20000
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+TOKEN = '1:benchmark'  # noqa: S105
+CHAT_ID = -(10**12)
+USERS = ['anna_k', 'boris.p', 'vera_m', 'gleb', 'dina_s']
+TEXTS = [
+    'Вынести мусор!',
+    'Купить молоко (2 л.)',
+    'Полить цветы',
+    'Помыть посуду #кухня',
+    'Оплатить интернет - до 10.05',
+]
+PAGE_SIZE = 10
+
+
+def measure(
+    render: Callable[[Any], Any], cases: list[Any]
+) -> dict[str, float]:
+    started = time.perf_counter()
+    for case in cases:
+        render(case)
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    peaks = []
+    for case in cases[: len(cases) // 10 or 1]:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        render(case)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return {
+        'ns_per_response': elapsed / len(cases) * 10**9,
+        'peak_bytes_per_response': sum(peaks) / len(peaks),
+    }
+
+
+def main() -> None:  # noqa: PLR0915
+    parser = argparse.ArgumentParser(
+        description='Microbenchmark of response rendering'
+    )
+    parser.add_argument('--responses', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ.setdefault('TELEGRAM_BOT_API_TOKEN', TOKEN)
+    sys.path.insert(0, str(BOT_DIR))
+    from callbacks import encode
+    from messages import messages
+    from rendering import OK_BUTTONS, TASK_KEYBOARD, freeze
+    from repository import ActiveTask
+    from telebot.formatting import escape_markdown, mbold
+    from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+    from utils import build_task_message, create_task_list
+
+    def legacy_task_list(tasks: list[Any]) -> str:
+        lines = []
+        for task in tasks:
+            lines.append(f'{mbold(escape_markdown(task.text))}\n')
+            if task.executor:
+                lines.append(f'Исполнитель: @{task.executor}\n\n')
+            else:
+                lines.append('\n')
+        return 'Активные задачи:\n\n' + ''.join(lines)
+
+    def legacy_task_message(task: Any) -> str:
+        return (
+            f'\\#task от @{task.creator.username}\n\n'
+            f'{mbold(task.text)}\n\n'
+            f'{escape_markdown(task.note) or ""}'
+        )
+
+    def legacy_buttons(*buttons: tuple[str, str]) -> InlineKeyboardMarkup:
+        markup = InlineKeyboardMarkup()
+        markup.row_width = 2
+        markup.add(
+            *(
+                InlineKeyboardButton(text, callback_data=data)
+                for text, data in buttons
+            )
+        )
+        return markup
+
+    def legacy_task_markup(task: Any) -> str:
+        return legacy_buttons(
+            ('Выполнить', encode('done', CHAT_ID, task.id)),
+            ('Отменить', encode('cancel', CHAT_ID, task.id)),
+        ).to_json()
+
+    def list_markup() -> InlineKeyboardMarkup:
+        markup = InlineKeyboardMarkup()
+        markup.row(
+            InlineKeyboardButton('▶️', callback_data=encode('page_list_next')),
+        )
+        return markup
+
+    # A cached view is sent again, its keyboard is serialized on every send
+    legacy_view = list_markup()
+    legacy_view.row(
+        *legacy_buttons(
+            ('Удали', encode('ok_remove')), ('Оставь', encode('ok_stay'))
+        ).keyboard[0]
+    )
+    view = list_markup()
+    view.row(*OK_BUTTONS)
+    view = freeze(view)
+
+    rng = random.Random(args.seed)  # noqa: S311
+    pages = [
+        [
+            ActiveTask(
+                rng.randrange(1, 10**7),
+                rng.choice(TEXTS),
+                rng.choice([*USERS, None]),
+            )
+            for _ in range(PAGE_SIZE)
+        ]
+        for _ in range(args.responses)
+    ]
+    tasks = [
+        SimpleNamespace(
+            id=rng.randrange(1, 10**7),
+            text=rng.choice(TEXTS),
+            note='',
+            creator=SimpleNamespace(username=rng.choice(USERS)),
+        )
+        for _ in range(args.responses)
+    ]
+
+    report: dict[str, Any] = {'responses': args.responses}
+    report['task_list'] = {
+        'before': measure(
+            lambda page: legacy_task_list(page) + messages['keep_or_delete'],
+            pages,
+        ),
+        'after': measure(
+            lambda page: create_task_list(page) + messages['keep_or_delete'],
+            pages,
+        ),
+    }
+    report['task_message'] = {
+        'before': measure(
+            lambda task: (legacy_task_message(task), legacy_task_markup(task)),
+            tasks,
+        ),
+        'after': measure(
+            lambda task: (
+                build_task_message(task),
+                TASK_KEYBOARD.render(CHAT_ID, task.id).to_json(),
+            ),
+            tasks,
+        ),
+    }
+    report['cached_view_send'] = {
+        'before': measure(lambda _: legacy_view.to_json(), tasks),
+        'after': measure(lambda _: view.to_json(), tasks),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# Description: Benchmark of the bot startup. Starts the bot process with
+# the webhook runtime against the fake Telegram Bot API of benchmark.py
+# and measures the time from the start of the process to its answer to
+# the first /tasks: cold, without a snapshot, when the state is read from
+# the database before serving, and warm, from the snapshot of that state
+# while the database is read in background.
+#
+# Usage: python scripts/startup_benchmark.py --chats 2000 --runs 3
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from http import HTTPStatus
+from pathlib import Path
+from typing import Any
+from urllib.error import URLError
+
+from benchmark import (
+    BOT_DIR,
+    FakeApiHandler,
+    configure,
+    generate,
+    message,
+    post_update,
+    start_fake_api,
+)
+
+# Time to wait for the first answer before the run is given up
+ANSWER_TIMEOUT = 120
+POLL_INTERVAL = 0.002
+
+
+def free_port() -> int:
+    with socket.socket() as listener:
+        listener.bind(('127.0.0.1', 0))
+        return int(listener.getsockname()[1])
+
+
+def first_answer(update: dict[str, Any], port: int) -> float:
+    # Seconds from the start of the bot process to its first message
+    from webhook import SECRET_HEADER
+
+    with FakeApiHandler.calls_lock:
+        sent_before = FakeApiHandler.calls['sendMessage']
+    url = f'http://127.0.0.1:{port}/'
+    started = time.perf_counter()
+    process = subprocess.Popen(  # noqa: S603
+        [sys.executable, str(BOT_DIR / 'bot.py')]
+    )
+    try:
+        while True:
+            try:
+                if post_update(url, SECRET_HEADER, update) == HTTPStatus.OK:
+                    break
+            except URLError:
+                pass
+            if time.perf_counter() - started > ANSWER_TIMEOUT:
+                raise TimeoutError('The bot did not start')
+            time.sleep(POLL_INTERVAL)
+        while FakeApiHandler.calls['sendMessage'] == sent_before:
+            if time.perf_counter() - started > ANSWER_TIMEOUT:
+                raise TimeoutError('The bot did not answer')
+            time.sleep(POLL_INTERVAL)
+        return time.perf_counter() - started
+    finally:
+        process.kill()
+        process.wait()
+
+
+def benchmark(args: argparse.Namespace, rng: random.Random) -> dict[str, Any]:
+    import snapshot
+    from config import SNAPSHOT_PATH
+    from database import db
+
+    data = generate(
+        argparse.Namespace(
+            chats=args.chats,
+            users_per_chat=args.users_per_chat,
+            tasks_per_chat=args.tasks_per_chat,
+            finished_share=args.finished_share,
+        ),
+        rng,
+    )
+    # The snapshot the bot would have written before a restart
+    snapshot.reconcile(db)
+    snapshot.save(SNAPSHOT_PATH)
+    saved = Path(f'{SNAPSHOT_PATH}.saved')
+    shutil.copy(SNAPSHOT_PATH, saved)
+
+    port = free_port()
+    os.environ.update(
+        {
+            'BOT_RUNTIME': 'webhook',
+            'WEBHOOK_URL': 'https://bot.invalid/',
+            'WEBHOOK_SECRET': 'benchmark',
+            'WEBHOOK_PORT': str(port),
+        }
+    )
+    update_ids = iter(range(10**6))
+
+    def tasks_update() -> dict[str, Any]:
+        chat_id = rng.choice(list(data['chats']))
+        update = {
+            'update_id': next(update_ids),
+            'message': message(
+                chat_id, data['chats'][chat_id][0], '/tasks', 1
+            ),
+        }
+        update['message']['entities'] = [
+            {'type': 'bot_command', 'offset': 0, 'length': len('/tasks')}
+        ]
+        return update
+
+    cold, warm = [], []
+    for _ in range(args.runs):
+        Path(SNAPSHOT_PATH).unlink(missing_ok=True)
+        cold.append(first_answer(tasks_update(), port))
+        shutil.copy(saved, SNAPSHOT_PATH)
+        warm.append(first_answer(tasks_update(), port))
+    return {
+        'chats': args.chats,
+        'tasks': args.chats * args.tasks_per_chat,
+        'snapshot_bytes': saved.stat().st_size,
+        'cold_s': statistics.median(cold),
+        'warm_s': statistics.median(warm),
+        'cold_runs_s': cold,
+        'warm_runs_s': warm,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description='Benchmark of the bot startup'
+    )
+    parser.add_argument('--chats', type=int, default=2000)
+    parser.add_argument('--users-per-chat', type=int, default=5)
+    parser.add_argument('--tasks-per-chat', type=int, default=100)
+    parser.add_argument('--finished-share', type=float, default=0.5)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(Path(workdir), start_fake_api())
+        from loguru import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+        report = benchmark(args, random.Random(args.seed))  # noqa: S311
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
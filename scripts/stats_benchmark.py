@@ -0,0 +1,197 @@
+# Description: Benchmark of /stats on a large database. Compares the
+# per-member counting queries /stats ran before, two COUNT queries for
+# every chat member, with the single grouped query of stats.py. The old
+# path is measured without the (chat, executor, is_finished) index it ran
+# on and with it, so the gain of the index and of the query are separate.
+# Reports latency percentiles and queries per /stats.
+#
+# Usage: python scripts/stats_benchmark.py --chats 10000 --tasks 1000000
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+TOKEN = '1:benchmark'  # noqa: S105
+INSERT_BATCH_SIZE = 500
+COMPOSITE_INDEX = 'task_chat_id_executor_id_is_finished'
+
+
+def configure(workdir: Path) -> None:
+    os.chdir(workdir)
+    (workdir / 'db_files').mkdir()
+    os.environ['DATABASE_URL'] = f'sqlite:///{workdir}/main.db'
+    os.environ.setdefault('TELEGRAM_BOT_API_TOKEN', TOKEN)
+    sys.path.insert(0, str(BOT_DIR))
+
+
+def populate(args: argparse.Namespace, rng: random.Random) -> None:
+    from database import db
+    from models import Chat, Task, User, create_tables
+
+    create_tables()
+    through = Chat.users.get_through_model()
+    today = datetime.date.today()
+    with db.atomic():
+        Chat.insert_many(
+            [{'chat_id': -(10**12) - number} for number in range(args.chats)]
+        ).execute()
+        User.insert_many(
+            [
+                {'username': f'user_{number}'}
+                for number in range(args.chats * args.users_per_chat)
+            ]
+        ).execute()
+        chat_ids = [chat.id for chat in Chat.select(Chat.id).order_by(Chat.id)]
+        user_ids = [user.id for user in User.select(User.id).order_by(User.id)]
+        members = {
+            chat: user_ids[
+                number
+                * args.users_per_chat : (number + 1)
+                * args.users_per_chat
+            ]
+            for number, chat in enumerate(chat_ids)
+        }
+        rows = [
+            {'chat': chat, 'user': user}
+            for chat, users in members.items()
+            for user in users
+        ]
+        for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+            through.insert_many(
+                rows[offset : offset + INSERT_BATCH_SIZE]
+            ).execute()
+
+    tasks_per_chat = args.tasks // args.chats
+    for chat in chat_ids:
+        users = members[chat]
+        rows = [
+            {
+                'creator': rng.choice(users),
+                'executor': rng.choice(users),
+                'chat': chat,
+                'text': 'Вынести мусор',
+                'deadline': today
+                + datetime.timedelta(days=rng.randint(-30, 30)),
+                'is_finished': rng.random() < args.finished_share,
+            }
+            for _ in range(tasks_per_chat)
+        ]
+        with db.atomic():
+            for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+                Task.insert_many(
+                    rows[offset : offset + INSERT_BATCH_SIZE]
+                ).execute()
+
+
+def legacy_stats(chat_id: int) -> list[tuple[str, int, int]]:
+    # /stats before stats.py, two counts for every member of the chat
+    from database import db
+    from models import Chat, Task
+
+    with db:
+        chat = Chat.get(Chat.chat_id == chat_id)
+        return [
+            (
+                user.username,
+                chat.tasks.where(Task.executor == user.id).count(),
+                chat.tasks.where(
+                    Task.executor == user.id,
+                    Task.is_finished == True,  # noqa: E712
+                ).count(),
+            )
+            for user in chat.users
+        ]
+
+
+def measure(
+    stats: Callable[[int], Any], chat_ids: list[int]
+) -> dict[str, float]:
+    from metrics import query_count
+
+    latencies = []
+    queries_before = query_count()
+    for chat_id in chat_ids:
+        started = time.perf_counter()
+        stats(chat_id)
+        latencies.append((time.perf_counter() - started) * 1000)
+    percentiles = statistics.quantiles(latencies, n=100)
+    return {
+        'p50_ms': percentiles[49],
+        'p99_ms': percentiles[98],
+        'mean_ms': statistics.fmean(latencies),
+        'queries_per_stats': (query_count() - queries_before) / len(chat_ids),
+    }
+
+
+def benchmark(args: argparse.Namespace, rng: random.Random) -> dict[str, Any]:
+    from database import db
+    from models import Chat
+    from stats import collect_stats
+
+    started = time.perf_counter()
+    populate(args, rng)
+    populated_s = time.perf_counter() - started
+
+    chat_ids = rng.sample(
+        [chat.chat_id for chat in Chat.select(Chat.chat_id)], args.samples
+    )
+    # The same counts either way
+    counts_match = all(
+        legacy_stats(chat_id)
+        == [
+            (row.username, row.task_count, row.completed_task_count)
+            for row in collect_stats(db, chat_id)
+        ]
+        for chat_id in chat_ids[:10]
+    )
+
+    (index_sql,) = db.execute_sql(
+        'SELECT sql FROM sqlite_master WHERE name = ?', (COMPOSITE_INDEX,)
+    ).fetchone()
+    db.execute_sql(f'DROP INDEX {COMPOSITE_INDEX}')
+    before = measure(legacy_stats, chat_ids)
+    db.execute_sql(index_sql)
+    db.execute_sql('ANALYZE')
+    return {
+        'chats': args.chats,
+        'tasks': args.tasks // args.chats * args.chats,
+        'users_per_chat': args.users_per_chat,
+        'populate_s': populated_s,
+        'counts_match': counts_match,
+        'before': before,
+        'before_with_index': measure(legacy_stats, chat_ids),
+        'after': measure(lambda chat_id: collect_stats(db, chat_id), chat_ids),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark of /stats')
+    parser.add_argument('--chats', type=int, default=10000)
+    parser.add_argument('--tasks', type=int, default=1000000)
+    parser.add_argument('--users-per-chat', type=int, default=4)
+    parser.add_argument('--finished-share', type=float, default=0.8)
+    parser.add_argument('--samples', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(Path(workdir))
+        from loguru import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+        report = benchmark(args, random.Random(args.seed))  # noqa: S311
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+# Description: Benchmark of repeated /tasks. Compares the task list as it
+# was built before the view cache, reading the active tasks of the chat
+# with a query for the executor of each one and building the keyboard on
+# every request, with task_view of the bot on a cache miss, on a hit, and
+# with a share of requests following a change of the chat tasks.
+# Reports latency percentiles, queries per /tasks and the hit rate.
+#
+# Usage: python scripts/task_view_benchmark.py --requests 5000
+#        python scripts/task_view_benchmark.py --change-share 0.2
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+TOKEN = '1:benchmark'  # noqa: S105
+INSERT_BATCH_SIZE = 500
+
+
+def configure(workdir: Path) -> None:
+    os.chdir(workdir)
+    (workdir / 'db_files').mkdir()
+    os.environ.update(
+        {
+            'DATABASE_URL': f'sqlite:///{workdir}/main.db',
+            'TELEGRAM_BOT_API_TOKEN': TOKEN,
+            'BOT_RUNTIME': 'benchmark',
+            'METRICS_PORT': '0',
+        }
+    )
+    sys.path.insert(0, str(BOT_DIR))
+
+
+def populate(args: argparse.Namespace, rng: random.Random) -> list[int]:
+    from database import db
+    from models import Chat, Task, User, create_tables
+
+    create_tables()
+    chat_ids = []
+    with db.atomic():
+        for number in range(args.chats):
+            chat = Chat.create(chat_id=-(10**12) - number)
+            users = [
+                User.create(username=f'user_{number}_{user}')
+                for user in range(args.users_per_chat)
+            ]
+            chat.users.add(users)
+            rows = [
+                {
+                    'creator': rng.choice(users),
+                    'executor': (
+                        rng.choice(users)
+                        if rng.random() < args.assigned_share
+                        else None
+                    ),
+                    'chat': chat,
+                    'text': f'Вынести мусор #{task}',
+                    'is_finished': rng.random() >= args.active_share,
+                }
+                for task in range(args.tasks_per_chat)
+            ]
+            for offset in range(0, len(rows), INSERT_BATCH_SIZE):
+                Task.insert_many(
+                    rows[offset : offset + INSERT_BATCH_SIZE]
+                ).execute()
+            chat_ids.append(chat.chat_id)
+    return chat_ids
+
+
+def legacy_task_list(chat_id: int) -> tuple[str, str]:
+    # /tasks before the view cache, the markup is serialized on send
+    from database import db
+    from models import Chat, Task
+    from telebot.formatting import escape_markdown, mbold
+    from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+    with db.atomic():
+        tasks = Chat.get(Chat.chat_id == chat_id).tasks.where(
+            Task.is_finished == False  # noqa: E712
+        )
+        task_list = 'Активные задачи:\n\n'
+        for task in tasks:
+            task_list += f'{mbold(escape_markdown(task.text))}\n'
+            if task.executor:
+                task_list += f'Исполнитель: @{task.executor.username}\n\n'
+            else:
+                task_list += '\n'
+    markup = InlineKeyboardMarkup()
+    markup.row_width = 2
+    markup.add(
+        InlineKeyboardButton('Удали', callback_data='ok_remove'),
+        InlineKeyboardButton('Оставь', callback_data='ok_stay'),
+    )
+    return task_list, markup.to_json()
+
+
+def measure(
+    request: Callable[[int], Any], chat_ids: list[int]
+) -> dict[str, float]:
+    from metrics import query_count
+    from view_cache import view_cache
+
+    hits, misses = view_cache.hits, view_cache.misses
+    queries_before = query_count()
+    latencies = []
+    for chat_id in chat_ids:
+        started = time.perf_counter()
+        request(chat_id)
+        latencies.append((time.perf_counter() - started) * 10**6)
+    percentiles = statistics.quantiles(latencies, n=100)
+    lookups = view_cache.hits - hits + view_cache.misses - misses
+    return {
+        'p50_us': percentiles[49],
+        'p99_us': percentiles[98],
+        'mean_us': statistics.fmean(latencies),
+        'queries_per_request': (query_count() - queries_before)
+        / len(chat_ids),
+        'hit_rate': (view_cache.hits - hits) / lookups if lookups else 0.0,
+    }
+
+
+def benchmark(args: argparse.Namespace, rng: random.Random) -> dict[str, Any]:
+    from bot import task_view
+    from view_cache import view_cache
+
+    chat_ids = populate(args, rng)
+    requests = [rng.choice(chat_ids) for _ in range(args.requests)]
+    changed = {
+        index
+        for index in range(args.requests)
+        if rng.random() < args.change_share
+    }
+
+    def view(chat_id: int) -> tuple[str, str]:
+        rendered = task_view(chat_id, 'list')
+        return rendered.text, rendered.markup.to_json()
+
+    def uncached(chat_id: int) -> tuple[str, str]:
+        view_cache.invalidate(chat_id)
+        return view(chat_id)
+
+    # A task of the chat changes before some of the requests
+    numbered = iter(range(args.requests))
+
+    def mixed(chat_id: int) -> tuple[str, str]:
+        if next(numbered) in changed:
+            view_cache.invalidate(chat_id)
+        return view(chat_id)
+
+    return {
+        'chats': args.chats,
+        'active_tasks_per_chat': args.tasks_per_chat * args.active_share,
+        'before': measure(legacy_task_list, requests),
+        'uncached': measure(uncached, requests),
+        'cached': measure(view, requests),
+        'mixed': measure(mixed, requests),
+        'change_share': args.change_share,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Benchmark of /tasks')
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--users-per-chat', type=int, default=4)
+    parser.add_argument('--tasks-per-chat', type=int, default=200)
+    parser.add_argument('--active-share', type=float, default=0.25)
+    parser.add_argument('--assigned-share', type=float, default=0.7)
+    parser.add_argument('--requests', type=int, default=5000)
+    # Share of requests after a change of the chat tasks
+    parser.add_argument('--change-share', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(Path(workdir))
+        from loguru import logger
+
+        logger.remove()
+        logger.add(sys.stderr, level='WARNING')
+        report = benchmark(args, random.Random(args.seed))  # noqa: S311
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
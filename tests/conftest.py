@@ -0,0 +1,38 @@
+import os
+import shutil
+import sys
+import tempfile
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+from peewee import Database
+
+BOT_DIR = Path(__file__).resolve().parent.parent / 'housekeeper_tg_bot'
+WORKDIR = Path(tempfile.mkdtemp(prefix='housekeeper-tests-'))
+
+# The bot reads its configuration when its modules are imported, and the
+# modules import each other by name. Worker processes started by the tests
+# inherit both.
+os.environ.update(
+    {
+        'DATABASE_URL': f'sqlite:///{WORKDIR}/main.db',
+        'TELEGRAM_BOT_API_TOKEN': '1:test',
+        'METRICS_PORT': '0',
+    }
+)
+sys.path.insert(0, str(BOT_DIR))
+
+
+def pytest_unconfigure() -> None:
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture()
+def database() -> Iterator[Database]:
+    from database import db
+    from models import MODELS, create_tables
+
+    create_tables()
+    yield db
+    db.drop_tables(MODELS)
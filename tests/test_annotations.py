@@ -0,0 +1,10 @@
+from annotations import AnnotationPipeline
+
+
+def test_task_sent_after_shutdown_is_dropped() -> None:
+    pipeline = AnnotationPipeline(1, 0, lambda _: None)
+    pipeline.shutdown()
+
+    assert not pipeline.submit(1)
+    # The slot is given back
+    assert pipeline._slots.acquire(blocking=False)
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+
+from async_runtime import ChatSerialDispatcher
+from telebot.types import Update
+
+CHATS = (-1, -2, -3)
+UPDATES_PER_CHAT = 5
+# Long enough for the handlers of other chats to overlap
+HANDLE_TIME = 0.02
+
+
+def update(update_id: int, chat_id: int) -> Update:
+    return Update.de_json(
+        {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': 0,
+                'chat': {'id': chat_id, 'type': 'group'},
+                'text': 'Вынести мусор',
+            },
+        }
+    )
+
+
+def test_chats_in_order_and_concurrently() -> None:
+    lock = threading.Lock()
+    handled: defaultdict[int, list[int]] = defaultdict(list)
+    running: defaultdict[int, int] = defaultdict(int)
+    overlaps = {'chat': 0, 'chats': 0}
+
+    def handle(update: Update) -> None:
+        chat_id = update.message.chat.id
+        with lock:
+            running[chat_id] += 1
+            if running[chat_id] > 1:
+                overlaps['chat'] += 1
+            if sum(running.values()) > 1:
+                overlaps['chats'] += 1
+        time.sleep(HANDLE_TIME)
+        with lock:
+            running[chat_id] -= 1
+            handled[chat_id].append(update.update_id)
+
+    async def dispatch() -> int:
+        dispatcher = ChatSerialDispatcher(handle, len(CHATS))
+        for number in range(UPDATES_PER_CHAT):
+            for chat_id in CHATS:
+                dispatcher.submit(update(number * 10 - chat_id, chat_id))
+        await dispatcher.drain()
+        return dispatcher.processed
+
+    assert asyncio.run(dispatch()) == UPDATES_PER_CHAT * len(CHATS)
+    for chat_id in CHATS:
+        assert handled[chat_id] == [
+            number * 10 - chat_id for number in range(UPDATES_PER_CHAT)
+        ]
+    assert overlaps['chat'] == 0
+    assert overlaps['chats'] > 0
@@ -0,0 +1,177 @@
+import datetime
+import multiprocessing
+from collections import Counter
+from collections.abc import Callable, Iterable
+from typing import Any
+
+import database as database_module
+import pytest
+from database import db, write_transaction
+from models import MODELS, Chat, RecurringTask, Task, User, create_tables
+from peewee import Database
+from recurring import spawn_due
+from reminders import ReminderScheduler
+from repository import add_task, finish_task, get_task
+from sharding import HashRing, ownership
+
+# Worker processes share the SQLite file of the tests, the way bot
+# processes share a server database
+PROCESSES = 4
+TASKS = 50
+CHATS = 40
+HOUR = 10
+DEADLINE = datetime.date(2024, 3, 1)
+
+
+def run(function: Callable[..., Any], arguments: Iterable[Any]) -> list[Any]:
+    # Workers are started afresh, as bot processes are, with the
+    # environment of the tests
+    with multiprocessing.get_context('spawn').Pool(PROCESSES) as pool:
+        return pool.map(function, arguments)
+
+
+def create_schema(_: int) -> None:
+    create_tables()
+
+
+def add_tasks(worker: int) -> None:
+    for number in range(TASKS):
+        with write_transaction(db):
+            task = Task(
+                creator=User.get(User.username == 'anna'),
+                chat=Chat.get(Chat.chat_id == -1),
+                text=f'Задача {worker}.{number}',
+            )
+            add_task(task, -1)
+
+
+def finish_tasks(task_ids: list[int]) -> list[int]:
+    # Finishes the tasks as the "done" handler does, returns the tasks
+    # finished by this worker
+    finished = []
+    for task_id in task_ids:
+        with write_transaction(db):
+            task = get_task(task_id)
+            if task is None or task.is_finished:
+                continue
+            finish_task(task, task.chat.chat_id, 'anna')
+        finished.append(task_id)
+    return finished
+
+
+def run_shard(shard: int) -> tuple[list[int], dict[int, int]]:
+    # Background jobs of one shard: reminded tasks and the number of
+    # tasks spawned in each chat
+    ownership.update(shard, HashRing(list(range(PROCESSES))))
+    reminded: list[int] = []
+    now = datetime.datetime.combine(DEADLINE, datetime.time(HOUR - 1))
+    scheduler = ReminderScheduler(
+        HOUR,
+        clock=lambda: now,
+        notify=lambda _, task_ids: reminded.extend(task_ids),
+    )
+    scheduler.rebuild(db)
+    now += datetime.timedelta(hours=1)
+    scheduler.tick()
+    spawned: Counter[int] = Counter()
+    spawn_due(
+        db,
+        DEADLINE,
+        0,
+        lambda chat_id, tasks: spawned.update({chat_id: len(tasks)}),
+    )
+    return reminded, dict(spawned)
+
+
+def create_members() -> User:
+    user = User.create(username='anna')
+    for chat_id in range(-1, -CHATS - 1, -1):
+        Chat.create(chat_id=chat_id).users.add(user)
+    return user
+
+
+def test_schema_created_once(database: Database) -> None:
+    database.drop_tables(MODELS)
+
+    run(create_schema, range(PROCESSES))
+
+    assert all(database.table_exists(model) for model in MODELS)
+
+
+def test_processes_add_tasks(database: Database) -> None:
+    create_members()
+
+    run(add_tasks, range(PROCESSES))
+
+    assert Task.select().count() == PROCESSES * TASKS
+    assert len({task.text for task in Task.select()}) == PROCESSES * TASKS
+
+
+def test_task_finished_by_one_process(database: Database) -> None:
+    user = create_members()
+    chat = Chat.get(Chat.chat_id == -1)
+    task_ids = [
+        Task.create(creator=user, chat=chat, text=f'Задача {number}').id
+        for number in range(TASKS)
+    ]
+
+    # Every worker tries to finish every task, in its own order
+    finished = run(
+        finish_tasks,
+        [task_ids[worker:] + task_ids[:worker] for worker in range(PROCESSES)],
+    )
+
+    assert sorted(sum(finished, [])) == task_ids
+    assert all(task.is_finished for task in Task.select())
+
+
+def test_shards_split_background_jobs(database: Database) -> None:
+    user = create_members()
+    task_ids = []
+    for chat in Chat.select():
+        task_ids.append(
+            Task.create(
+                creator=user, chat=chat, text='Задача', deadline=DEADLINE
+            ).id
+        )
+        RecurringTask.create(
+            creator=user,
+            chat=chat,
+            text='Полить цветы',
+            interval_days=7,
+            next_occurrence=DEADLINE,
+        )
+
+    results = run(run_shard, range(PROCESSES))
+
+    reminded = Counter(
+        task_id for shard_reminded, _ in results for task_id in shard_reminded
+    )
+    assert reminded == Counter(task_ids)
+    spawned: Counter[int] = Counter()
+    for _, shard_spawned in results:
+        spawned.update(shard_spawned)
+    assert spawned == Counter(range(-1, -CHATS - 1, -1))
+    assert (
+        not RecurringTask.select()
+        .where(RecurringTask.next_occurrence <= DEADLINE)
+        .exists()
+    )
+    # Every shard has chats of its own
+    assert all(shard_reminded for shard_reminded, _ in results)
+
+
+def test_pool_sized_to_threads(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(database_module, 'BOT_RUNTIME', 'asyncio')
+    monkeypatch.setattr(database_module, 'ASYNC_WORKERS', 16)
+    monkeypatch.setattr(database_module, 'SEND_QUEUE_WORKERS', 8)
+    monkeypatch.setattr(database_module, 'ANNOTATION_WORKERS', 4)
+    threads = 16 + 8 + 4 + database_module.BACKGROUND_THREADS
+
+    monkeypatch.setattr(database_module, 'DATABASE_POOL_SIZE', 0)
+    assert database_module.pool_size() == threads
+    monkeypatch.setattr(database_module, 'DATABASE_POOL_SIZE', threads + 1)
+    assert database_module.pool_size() == threads + 1
+    monkeypatch.setattr(database_module, 'DATABASE_POOL_SIZE', threads - 1)
+    with pytest.raises(ValueError, match='DATABASE_POOL_SIZE'):
+        database_module.pool_size()
@@ -0,0 +1,147 @@
+import random
+from collections import Counter
+from pathlib import Path
+from typing import Any
+
+import pytest
+import telebot
+from dedup import DedupLog, guard
+from telebot.types import CallbackQuery, Message, Update
+
+CAPACITY = 64
+UPDATES = 500
+BATCH_SIZE = 20
+# Duplicates arrive at most this many updates after the original, well
+# within the ring of the log
+MAX_DELAY = CAPACITY // 8
+DUPLICATE_SHARE = 0.2
+# Share of repeated button presses which come in a new update
+NEW_UPDATE_SHARE = 0.5
+
+USER = {'id': 1, 'is_bot': False, 'first_name': 'Anna'}
+CHAT = {'id': -1, 'type': 'group', 'title': 'Дом'}
+
+
+def message(message_id: int) -> dict[str, Any]:
+    return {
+        'message_id': message_id,
+        'date': 0,
+        'chat': CHAT,
+        'from': USER,
+        'text': f'/task Задача {message_id}',
+    }
+
+
+def record(count: int) -> list[dict[str, Any]]:
+    # A stream as Telegram sends it: messages and button presses
+    updates = []
+    for update_id in range(1, count + 1):
+        if update_id % 3:
+            updates.append(
+                {'update_id': update_id, 'message': message(update_id)}
+            )
+        else:
+            query = {
+                'id': f'query-{update_id}',
+                'from': USER,
+                'chat_instance': '1',
+                'data': 'done',
+                'message': message(update_id),
+            }
+            updates.append({'update_id': update_id, 'callback_query': query})
+    return updates
+
+
+def inject_duplicates(
+    rng: random.Random, updates: list[dict[str, Any]]
+) -> list[dict[str, Any]]:
+    # Updates are delivered again a little later, as after a lost
+    # acknowledgement. A button press may also come again in a new update.
+    stream: list[dict[str, Any]] = []
+    pending: list[tuple[int, dict[str, Any]]] = []
+    # Ids of new updates are past the ids of the recorded ones
+    next_id = 10 * len(updates)
+    for update in updates:
+        stream.append(update)
+        if rng.random() < DUPLICATE_SHARE:
+            duplicate = dict(update)
+            if 'callback_query' in update and rng.random() < NEW_UPDATE_SHARE:
+                duplicate['update_id'] = next_id
+                next_id += 1
+            pending.append(
+                (len(stream) + rng.randint(0, MAX_DELAY), duplicate)
+            )
+        stream.extend(update for due, update in pending if due <= len(stream))
+        pending = [
+            (due, update) for due, update in pending if due > len(stream)
+        ]
+    stream.extend(update for _, update in pending)
+    return stream
+
+
+class Handled:
+    def __init__(self, path: Path) -> None:
+        self.log = DedupLog(str(path), CAPACITY)
+        self.log.load()
+        self.bot = telebot.TeleBot('1:test', threaded=False)
+        self.counts: Counter[str] = Counter()
+        guard(self.bot, self.log)
+
+        @self.bot.message_handler(func=lambda _: True)
+        def on_message(message: Message) -> None:
+            self.counts[f'm{message.message_id}'] += 1
+
+        @self.bot.callback_query_handler(func=lambda _: True)
+        def on_callback(call: CallbackQuery) -> None:
+            self.counts[f'c{call.id}'] += 1
+
+    def replay(self, stream: list[dict[str, Any]]) -> None:
+        for start in range(0, len(stream), BATCH_SIZE):
+            self.bot.process_new_updates(
+                [
+                    Update.de_json(update)
+                    for update in stream[start : start + BATCH_SIZE]
+                ]
+            )
+
+
+def expected(updates: list[dict[str, Any]]) -> Counter[str]:
+    return Counter(
+        f'c{update["callback_query"]["id"]}'
+        if 'callback_query' in update
+        else f'm{update["message"]["message_id"]}'
+        for update in updates
+    )
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_each_update_handled_once(tmp_path: Path, seed: int) -> None:
+    rng = random.Random(seed)
+    updates = record(UPDATES)
+    stream = inject_duplicates(rng, updates)
+    assert len(stream) > len(updates)
+
+    handled = Handled(tmp_path / 'updates.log')
+    handled.replay(stream)
+    handled.log.close()
+
+    assert handled.counts == expected(updates)
+
+
+def test_duplicates_dropped_after_restart(tmp_path: Path) -> None:
+    rng = random.Random(0)
+    updates = record(UPDATES)
+    # The log is compacted several times on the way
+    first = Handled(tmp_path / 'updates.log')
+    first.replay(inject_duplicates(rng, updates))
+    first.log.close()
+
+    # The last updates are delivered again to the restarted bot
+    restarted = Handled(tmp_path / 'updates.log')
+    restarted.replay(updates[-CAPACITY // 4 :])
+    assert restarted.counts == Counter()
+
+    fresh = record(UPDATES + 1)[-1:]
+    restarted.replay(fresh)
+    restarted.log.close()
+    assert restarted.counts == expected(fresh)
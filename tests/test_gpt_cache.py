@@ -0,0 +1,73 @@
+import threading
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+from database import SQLITE_PRAGMAS, state_db
+from gpt_cache import CachedNote, GptCache
+
+KEY = 'Важно помнить об этой задаче:\nвынести мусор'
+VARIANTS = 3
+
+
+class Fetch:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.fetched = threading.Semaphore(0)
+
+    def __call__(self) -> str:
+        self.calls += 1
+        self.fetched.release()
+        return f'заметка {self.calls}'
+
+
+@pytest.fixture()
+def cache(tmp_path: Path) -> Iterator[GptCache]:
+    path = state_db.database
+    state_db.init(str(tmp_path / 'state.db'), pragmas=SQLITE_PRAGMAS)
+    cache = GptCache(max_size=100, max_age=3600, variants=VARIANTS)
+    cache.create_table()
+    yield cache
+    cache.shutdown()
+    state_db.close()
+    state_db.init(path, pragmas=SQLITE_PRAGMAS)
+
+
+def notes() -> list[str]:
+    return [note.text for note in CachedNote.select().order_by(CachedNote.id)]
+
+
+def test_first_request_waits_for_note(cache: GptCache) -> None:
+    fetch = Fetch()
+
+    assert cache.get(KEY, fetch) == 'заметка 1'
+    assert notes() == ['заметка 1']
+
+
+def test_served_from_cache_while_variants_are_fetched(
+    cache: GptCache,
+) -> None:
+    fetch = Fetch()
+    cache.get(KEY, fetch)
+
+    # The cached note is served, one more variant is fetched meanwhile
+    assert cache.get(KEY, fetch) == 'заметка 1'
+    assert fetch.fetched.acquire(timeout=5)
+    cache.shutdown()
+    assert notes() == ['заметка 1', 'заметка 2']
+
+
+def test_no_fetch_once_variants_are_collected(cache: GptCache) -> None:
+    for number in range(VARIANTS):
+        cache.put(KEY, f'заметка {number}')
+    fetch = Fetch()
+
+    for _ in range(10):
+        assert cache.get(KEY, fetch).startswith('заметка')
+    cache.shutdown()
+    assert fetch.calls == 0
+
+
+def test_failed_fetch_is_not_cached(cache: GptCache) -> None:
+    assert cache.get(KEY, lambda: '') == ''
+    assert notes() == []
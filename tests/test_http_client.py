@@ -0,0 +1,168 @@
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import http_client
+import pytest
+import requests
+from http_client import FAILURE_THRESHOLD, CircuitOpenError, HttpClient
+
+BACKOFF = 0.01
+TIMEOUT = 0.2
+RESET_TIMEOUT = 0.2
+
+
+class Stub:
+    # Answers with the given statuses in turn, then with 200, after the
+    # given delays
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.statuses: list[int] = []
+        self.delays: list[float] = []
+        self.delay = 0.0
+        self.requests = 0
+        self.running = 0
+        self.max_running = 0
+
+    def answer(self) -> int:
+        with self.lock:
+            self.requests += 1
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            delay = self.delays.pop(0) if self.delays else self.delay
+            status = self.statuses.pop(0) if self.statuses else HTTPStatus.OK
+        time.sleep(delay)
+        with self.lock:
+            self.running -= 1
+        return status
+
+
+@pytest.fixture()
+def stub() -> Iterator[tuple[Stub, str]]:
+    answers = Stub()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # noqa: N802
+            status = answers.answer()
+            try:
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            except OSError:
+                # The client has timed out
+                pass
+
+        def log_message(self, *args: object) -> None:
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, args=(0.01,), daemon=True
+    ).start()
+    yield answers, f'http://127.0.0.1:{server.server_address[1]}/stub'
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def jitter(monkeypatch: pytest.MonkeyPatch) -> list[tuple[float, float]]:
+    ranges: list[tuple[float, float]] = []
+
+    def uniform(low: float, high: float) -> float:
+        ranges.append((low, high))
+        return 1.0
+
+    monkeypatch.setattr(http_client, 'uniform', uniform)
+    return ranges
+
+
+def test_server_errors_retried_with_jitter(
+    stub: tuple[Stub, str], jitter: list[tuple[float, float]]
+) -> None:
+    answers, url = stub
+    answers.statuses = [HTTPStatus.SERVICE_UNAVAILABLE] * 2
+    client = HttpClient(retries=2, backoff=BACKOFF)
+
+    assert client.get(url).status_code == HTTPStatus.OK
+    assert answers.requests == 3  # noqa: PLR2004
+    assert jitter == [(0.5, 1.5)] * 2
+
+
+def test_last_server_error_returned(stub: tuple[Stub, str]) -> None:
+    answers, url = stub
+    answers.statuses = [HTTPStatus.BAD_GATEWAY] * 3
+    client = HttpClient(retries=2, backoff=BACKOFF)
+
+    assert client.get(url).status_code == HTTPStatus.BAD_GATEWAY
+    assert answers.requests == 3  # noqa: PLR2004
+
+
+def test_timeout_retried(
+    stub: tuple[Stub, str], jitter: list[tuple[float, float]]
+) -> None:
+    answers, url = stub
+    answers.delays = [TIMEOUT * 2]
+    client = HttpClient(retries=1, backoff=BACKOFF)
+
+    assert client.get(url, timeout=TIMEOUT).status_code == HTTPStatus.OK
+    assert answers.requests == 2  # noqa: PLR2004
+    assert len(jitter) == 1
+
+
+def test_last_timeout_raised(stub: tuple[Stub, str]) -> None:
+    answers, url = stub
+    answers.delay = TIMEOUT * 2
+    client = HttpClient(retries=1, backoff=BACKOFF)
+
+    with pytest.raises(requests.Timeout):
+        client.get(url, timeout=TIMEOUT)
+    assert answers.requests == 2  # noqa: PLR2004
+
+
+@pytest.mark.parametrize('recovered', [True, False])
+def test_circuit_opens_and_half_opens(
+    stub: tuple[Stub, str], monkeypatch: pytest.MonkeyPatch, recovered: bool
+) -> None:
+    answers, url = stub
+    monkeypatch.setattr(http_client, 'RESET_TIMEOUT', RESET_TIMEOUT)
+    answers.statuses = [HTTPStatus.INTERNAL_SERVER_ERROR] * FAILURE_THRESHOLD
+    client = HttpClient(retries=0)
+    for _ in range(FAILURE_THRESHOLD):
+        client.get(url)
+
+    # Open: calls fail without reaching the host
+    with pytest.raises(CircuitOpenError):
+        client.get(url)
+    assert answers.requests == FAILURE_THRESHOLD
+
+    # Half open after the timeout: one call goes through
+    time.sleep(RESET_TIMEOUT)
+    if not recovered:
+        answers.statuses = [HTTPStatus.INTERNAL_SERVER_ERROR]
+    client.get(url)
+    assert answers.requests == FAILURE_THRESHOLD + 1
+    if recovered:
+        assert client.get(url).status_code == HTTPStatus.OK
+        assert answers.requests == FAILURE_THRESHOLD + 2  # noqa: PLR2004
+    else:
+        # A failure opens the breaker again right away
+        with pytest.raises(CircuitOpenError):
+            client.get(url)
+        assert answers.requests == FAILURE_THRESHOLD + 1
+
+
+def test_concurrency_limited_per_host(stub: tuple[Stub, str]) -> None:
+    answers, url = stub
+    answers.delay = 0.05
+    client = HttpClient(pool_size=8, host_concurrency=2)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        responses = list(executor.map(lambda _: client.get(url), range(8)))
+
+    assert all(response.status_code == HTTPStatus.OK for response in responses)
+    assert answers.requests == 8  # noqa: PLR2004
+    assert answers.max_running == 2  # noqa: PLR2004
@@ -0,0 +1,64 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+import membership as membership_module
+import pytest
+from database import write_transaction
+from membership import MembershipCache, membership, query_members
+from models import Chat, User
+from peewee import Database
+from repository import add_chat_user
+
+CHATS = 3
+
+
+def database_members() -> dict[int, list[int]]:
+    members: dict[int, list[int]] = {}
+    for chat_id, user_id, _ in query_members().tuples():
+        members.setdefault(chat_id, []).append(user_id)
+    return members
+
+
+def cached_members(cache: MembershipCache) -> dict[int, list[int]]:
+    return {
+        chat_id: sorted(user_id for user_id, _ in users)
+        for chat_id, users in cache.items()
+    }
+
+
+def test_rebuild_keeps_concurrent_changes(
+    database: Database, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    chats = [Chat.create(chat_id=-number) for number in range(1, CHATS + 1)]
+    anna, boris = User.create(username='anna'), User.create(username='boris')
+    for chat in chats:
+        chat.users.add(anna)
+
+    @contextmanager
+    def read_then_changed(db: Database) -> Iterator[None]:
+        # Users join after the members are read, before the rebuild
+        # replaces them
+        with write_transaction(db):
+            yield
+        for chat in chats:
+            with write_transaction(db):
+                add_chat_user(chat.chat_id, boris)
+
+    monkeypatch.setattr(
+        membership_module, 'write_transaction', read_then_changed
+    )
+    membership.rebuild(database)
+
+    assert cached_members(membership) == database_members()
+
+
+def test_user_added_again_kept_once(database: Database) -> None:
+    chat = Chat.create(chat_id=-1)
+    anna = User.create(username='anna')
+    chat.users.add(anna)
+    cache = MembershipCache()
+    cache.rebuild(database)
+
+    cache.add(chat.chat_id, anna)
+
+    assert cached_members(cache) == {chat.chat_id: [anna.id]}
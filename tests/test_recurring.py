@@ -0,0 +1,91 @@
+import datetime
+
+import pytest
+import recurring
+from models import Chat, RecurringTask, Task, User
+from peewee import Database
+from recurring import MAX_INTERVAL_DAYS, RecurringSpawner, parse_repeat
+from repository import ActiveTask
+from sharding import ownership
+
+TODAY = datetime.date(2024, 3, 1)
+RULES = 7
+BATCH_SIZE = 3
+
+
+def test_batches_committed_and_announced_one_by_one(
+    database: Database, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(ownership, '_state', None)
+    monkeypatch.setattr(recurring, 'BATCH_SIZE', BATCH_SIZE)
+    user = User.create(username='anna')
+    chat = Chat.create(chat_id=-1)
+    chat.users.add(user)
+    for number in range(RULES):
+        RecurringTask.create(
+            creator=user,
+            chat=chat,
+            text=f'Полить цветы {number}',
+            interval_days=7,
+            next_occurrence=TODAY,
+        )
+    announced: list[tuple[int, int, bool]] = []
+
+    def on_spawned(chat_id: int, tasks: list[ActiveTask]) -> None:
+        # (chat, tasks, whether the write transaction is still open)
+        announced.append((chat_id, len(tasks), database.in_transaction()))
+
+    spawner = RecurringSpawner(database, 0, 0, on_spawned)
+
+    assert spawner.tick(TODAY) == RULES
+    assert announced == [(-1, 3, False), (-1, 3, False), (-1, 1, False)]
+    assert Task.select().count() == RULES
+    assert spawner.tick(TODAY) == 0
+
+
+def test_rule_which_can_not_be_moved_is_skipped(
+    database: Database, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Its next occurrence overflows datetime.date
+    monkeypatch.setattr(ownership, '_state', None)
+    user = User.create(username='anna')
+    chat = Chat.create(chat_id=-1)
+    chat.users.add(user)
+    for interval_days in (7, 3000000, 7):
+        RecurringTask.create(
+            creator=user,
+            chat=chat,
+            text=f'Раз в {interval_days} дн.',
+            interval_days=interval_days,
+            next_occurrence=TODAY,
+        )
+    announced: list[str] = []
+
+    def on_spawned(chat_id: int, tasks: list[ActiveTask]) -> None:
+        announced.extend(task.text for task in tasks)
+
+    spawner = RecurringSpawner(database, 0, 0, on_spawned)
+
+    assert spawner.tick(TODAY) == 2  # noqa: PLR2004
+    assert announced == ['Раз в 7 дн.', 'Раз в 7 дн.']
+    assert Task.select().count() == 2  # noqa: PLR2004
+    assert spawner.tick(TODAY) == 0
+
+
+@pytest.mark.parametrize(
+    ('text', 'expected'),
+    [
+        ('/repeat 7 Вынести мусор', (7, 'Вынести мусор')),
+        (
+            f'/repeat {MAX_INTERVAL_DAYS} Поменять фильтр',
+            (MAX_INTERVAL_DAYS, 'Поменять фильтр'),
+        ),
+        ('/repeat 0 Вынести мусор', None),
+        ('/repeat 3000000 Вынести мусор', None),
+        ('/repeat ² Вынести мусор', None),
+        ('/repeat -1 Вынести мусор', None),
+        ('/repeat 7', None),
+    ],
+)
+def test_parse_repeat(text: str, expected: tuple[int, str] | None) -> None:
+    assert parse_repeat(text) == expected
@@ -0,0 +1,280 @@
+import datetime
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+import pytest
+import reminders as reminders_module
+import repository
+from database import db, write_transaction
+from models import Chat, Task, User
+from peewee import Database
+from reminders import ReminderScheduler
+from repository import (
+    add_task,
+    finish_task,
+    get_open_tasks,
+    get_task,
+    set_task_executor,
+)
+from utils import create_reminder
+
+HOUR = 10
+DEADLINE = datetime.date(2024, 3, 1)
+CHAT_ID = -1
+
+
+class FakeClock:
+    def __init__(self, now: datetime.datetime) -> None:
+        self.now = now
+
+    def __call__(self) -> datetime.datetime:
+        return self.now
+
+    def set(self, day: datetime.date, hour: int, minute: int = 0) -> None:
+        self.now = datetime.datetime.combine(day, datetime.time(hour, minute))
+
+
+class Reminded:
+    def __init__(self) -> None:
+        self.calls: list[tuple[int, list[int]]] = []
+        self.texts: list[str] = []
+
+    def __call__(self, chat_id: int, task_ids: list[int]) -> None:
+        # What the bot would send, read while the tasks are as they are now
+        self.calls.append((chat_id, task_ids))
+        tasks = get_open_tasks(task_ids)
+        if tasks:
+            self.texts.append(create_reminder(tasks))
+
+    def take(self) -> list[tuple[int, list[int]]]:
+        calls, self.calls = self.calls, []
+        return calls
+
+
+@pytest.fixture()
+def clock() -> FakeClock:
+    return FakeClock(datetime.datetime(2024, 2, 28, 12))
+
+
+@pytest.fixture()
+def reminded() -> Reminded:
+    return Reminded()
+
+
+@pytest.fixture()
+def scheduler(
+    database: Database,
+    clock: FakeClock,
+    reminded: Reminded,
+    monkeypatch: pytest.MonkeyPatch,
+) -> ReminderScheduler:
+    scheduler = ReminderScheduler(HOUR, clock=clock, notify=reminded)
+    monkeypatch.setattr(repository, 'reminders', scheduler)
+    return scheduler
+
+
+@pytest.fixture()
+def users(database: Database) -> list[User]:
+    chat = Chat.create(chat_id=CHAT_ID)
+    users = [User.create(username=name) for name in ('anna_k', 'boris')]
+    chat.users.add(users)
+    return users
+
+
+def create_task(users: list[User], deadline: datetime.date) -> Task:
+    with write_transaction(db):
+        task = Task(
+            creator=users[0],
+            executor=users[0],
+            chat=Chat.get(Chat.chat_id == CHAT_ID),
+            text='Вынести мусор',
+            deadline=deadline,
+        )
+        add_task(task, CHAT_ID)
+    return task
+
+
+def test_due_at_reminder_hour_of_deadline(
+    scheduler: ReminderScheduler,
+    clock: FakeClock,
+    reminded: Reminded,
+    users: list[User],
+) -> None:
+    task = create_task(users, DEADLINE)
+    later = create_task(users, DEADLINE + datetime.timedelta(days=2))
+
+    clock.set(DEADLINE - datetime.timedelta(days=1), 23, 59)
+    assert scheduler.tick() == 0
+    clock.set(DEADLINE, HOUR - 1, 59)
+    assert scheduler.tick() == 0
+    clock.set(DEADLINE, HOUR)
+    assert scheduler.tick() == 1
+    assert reminded.take() == [(CHAT_ID, [task.id])]
+    assert later.id in {task_id for task_id, _, _ in scheduler.items()}
+
+
+def test_reminded_once_a_day(
+    scheduler: ReminderScheduler,
+    clock: FakeClock,
+    reminded: Reminded,
+    users: list[User],
+) -> None:
+    task = create_task(users, DEADLINE)
+
+    clock.set(DEADLINE, HOUR, 30)
+    scheduler.tick()
+    clock.set(DEADLINE, 23)
+    assert scheduler.tick() == 0
+    clock.set(DEADLINE + datetime.timedelta(days=1), HOUR)
+    assert scheduler.tick() == 1
+    assert reminded.take() == [(CHAT_ID, [task.id])] * 2
+
+
+def test_overdue_task_waits_for_next_slot(
+    scheduler: ReminderScheduler,
+    clock: FakeClock,
+    reminded: Reminded,
+    users: list[User],
+) -> None:
+    clock.set(DEADLINE, HOUR + 2)
+    create_task(users, DEADLINE - datetime.timedelta(days=3))
+
+    assert scheduler.tick() == 0
+    clock.set(DEADLINE + datetime.timedelta(days=1), HOUR)
+    assert scheduler.tick() == 1
+
+
+def test_reassigned_task_reminded_once_with_new_executor(
+    scheduler: ReminderScheduler,
+    clock: FakeClock,
+    reminded: Reminded,
+    users: list[User],
+) -> None:
+    task = create_task(users, DEADLINE)
+    with write_transaction(db):
+        set_task_executor(get_task(task.id), CHAT_ID, 'boris')
+
+    clock.set(DEADLINE, HOUR)
+    assert scheduler.tick() == 1
+    assert reminded.take() == [(CHAT_ID, [task.id])]
+    assert '@boris' in reminded.texts[0]
+    assert 'anna' not in reminded.texts[0]
+
+
+def test_finished_task_not_reminded(
+    scheduler: ReminderScheduler,
+    clock: FakeClock,
+    reminded: Reminded,
+    users: list[User],
+) -> None:
+    task = create_task(users, DEADLINE)
+    kept = create_task(users, DEADLINE)
+
+    clock.set(DEADLINE, HOUR)
+    scheduler.tick()
+    assert reminded.take() == [(CHAT_ID, [task.id, kept.id])]
+    with write_transaction(db):
+        finish_task(get_task(task.id), CHAT_ID, None)
+
+    clock.set(DEADLINE + datetime.timedelta(days=1), HOUR)
+    assert scheduler.tick() == 1
+    assert reminded.take() == [(CHAT_ID, [kept.id])]
+    assert task.id not in {task_id for task_id, _, _ in scheduler.items()}
+
+
+def test_rebuild_skips_finished_tasks(
+    scheduler: ReminderScheduler,
+    clock: FakeClock,
+    reminded: Reminded,
+    users: list[User],
+    database: Database,
+) -> None:
+    task = create_task(users, DEADLINE)
+    kept = create_task(users, DEADLINE)
+    with write_transaction(database):
+        finish_task(get_task(task.id), CHAT_ID, None)
+
+    restarted = ReminderScheduler(HOUR, clock=clock, notify=reminded)
+    restarted.rebuild(database)
+    clock.set(DEADLINE, HOUR)
+    assert restarted.tick() == 1
+    assert reminded.take() == [(CHAT_ID, [kept.id])]
+
+
+def database_reminders() -> set[int]:
+    return {
+        task.id
+        for task in Task.select(Task.id).where(
+            Task.is_finished == False  # noqa: E712
+        )
+    }
+
+
+def scheduled_reminders(scheduler: ReminderScheduler) -> set[int]:
+    return {task_id for task_id, _, _ in scheduler.items()}
+
+
+def test_rebuild_keeps_concurrent_changes(
+    scheduler: ReminderScheduler,
+    users: list[User],
+    database: Database,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    finished = create_task(users, DEADLINE)
+    create_task(users, DEADLINE)
+
+    @contextmanager
+    def read_then_changed(db: Database) -> Iterator[None]:
+        # Tasks change after they are read, before the rebuild replaces
+        # the reminders
+        with write_transaction(db):
+            yield
+        create_task(users, DEADLINE)
+        with write_transaction(db):
+            finish_task(get_task(finished.id), CHAT_ID, None)
+
+    monkeypatch.setattr(
+        reminders_module, 'write_transaction', read_then_changed
+    )
+    scheduler.rebuild(database)
+
+    assert scheduled_reminders(scheduler) == database_reminders()
+
+
+def test_rebuild_waits_for_task_being_added(
+    scheduler: ReminderScheduler,
+    users: list[User],
+    database: Database,
+) -> None:
+    # The task is scheduled before the rebuild starts and committed while
+    # it runs
+    scheduled = threading.Event()
+    committed = threading.Event()
+
+    def add() -> None:
+        with write_transaction(db):
+            task = Task(
+                creator=users[0],
+                chat=Chat.get(Chat.chat_id == CHAT_ID),
+                text='Вынести мусор',
+                deadline=DEADLINE,
+            )
+            add_task(task, CHAT_ID)
+            scheduled.set()
+            committed.wait()
+
+    writer = threading.Thread(target=add)
+    writer.start()
+    scheduled.wait()
+    rebuild = threading.Thread(target=scheduler.rebuild, args=(database,))
+    rebuild.start()
+    # Time for the rebuild to read the tasks, if it does not wait
+    time.sleep(0.2)
+    committed.set()
+    writer.join()
+    rebuild.join()
+
+    assert scheduled_reminders(scheduler) == database_reminders()
+    assert len(database_reminders()) == 1
@@ -0,0 +1,134 @@
+import pytest
+from database import db, write_transaction
+from models import Chat, Task, User
+from peewee import Database
+from repository import (
+    TaskPage,
+    active_tasks_page,
+    add_tasks,
+    delete_task,
+    finish_task,
+    get_chat_task,
+    get_task,
+    iter_active_tasks,
+)
+
+CHAT_ID = -1
+OTHER_CHAT_ID = -2
+SIZE = 3
+
+
+@pytest.fixture()
+def task_ids(database: Database) -> list[int]:
+    # Seven tasks of the chat, added at the same moment with the tasks of
+    # another chat between them, so only their ids order them
+    user = User.create(username='anna')
+    chat = Chat.create(chat_id=CHAT_ID)
+    other = Chat.create(chat_id=OTHER_CHAT_ID)
+    with write_transaction(db):
+        for number in range(7):
+            add_tasks(chat, user, [f'Задача {number}'], [user])
+            add_tasks(other, user, ['Чужая задача'], [])
+    return [
+        task.id
+        for task in Task.select(Task.id)
+        .where(Task.chat == chat)
+        .order_by(Task.id)
+    ]
+
+
+def page_ids(page: TaskPage) -> list[int]:
+    return [task.id for task in page.tasks]
+
+
+def test_first_page(task_ids: list[int]) -> None:
+    page = active_tasks_page(CHAT_ID, SIZE)
+
+    assert page_ids(page) == task_ids[:3]
+    assert not page.has_previous
+    assert page.has_next
+    assert page.tasks[0].executor == 'anna'
+
+
+def test_next_pages(task_ids: list[int]) -> None:
+    middle = active_tasks_page(CHAT_ID, SIZE, after_id=task_ids[2])
+    last = active_tasks_page(CHAT_ID, SIZE, after_id=task_ids[5])
+
+    assert page_ids(middle) == task_ids[3:6]
+    assert middle.has_previous
+    assert middle.has_next
+    assert page_ids(last) == task_ids[6:]
+    assert last.has_previous
+    assert not last.has_next
+
+
+def test_previous_pages(task_ids: list[int]) -> None:
+    middle = active_tasks_page(CHAT_ID, SIZE, before_id=task_ids[6])
+    first = active_tasks_page(CHAT_ID, SIZE, before_id=task_ids[3])
+
+    assert page_ids(middle) == task_ids[3:6]
+    assert middle.has_previous
+    assert middle.has_next
+    assert page_ids(first) == task_ids[:3]
+    assert not first.has_previous
+    assert first.has_next
+
+
+def test_pages_cover_every_task_once(task_ids: list[int]) -> None:
+    forward: list[int] = []
+    page = active_tasks_page(CHAT_ID, SIZE)
+    forward += page_ids(page)
+    while page.has_next:
+        page = active_tasks_page(CHAT_ID, SIZE, after_id=page.tasks[-1].id)
+        forward += page_ids(page)
+    backward = page_ids(page)
+    while page.has_previous:
+        page = active_tasks_page(CHAT_ID, SIZE, before_id=page.tasks[0].id)
+        backward = page_ids(page) + backward
+
+    assert forward == task_ids
+    assert backward == task_ids
+
+
+def test_cursor_of_removed_task(task_ids: list[int]) -> None:
+    with write_transaction(db):
+        delete_task(get_task(task_ids[2]), CHAT_ID)
+        finish_task(get_task(task_ids[3]), CHAT_ID, None)
+
+    after_deleted = active_tasks_page(CHAT_ID, SIZE, after_id=task_ids[2])
+    before_finished = active_tasks_page(CHAT_ID, SIZE, before_id=task_ids[3])
+
+    assert page_ids(after_deleted) == task_ids[4:7]
+    assert page_ids(before_finished) == task_ids[:2]
+
+
+def test_previous_page_of_removed_tasks_falls_back_to_first(
+    task_ids: list[int],
+) -> None:
+    # Nothing is left before the cursor, the first page is shown instead of
+    # an empty one
+    with write_transaction(db):
+        for task_id in task_ids[:3]:
+            finish_task(get_task(task_id), CHAT_ID, None)
+
+    page = active_tasks_page(CHAT_ID, SIZE, before_id=task_ids[3])
+
+    assert page_ids(page) == task_ids[3:6]
+    assert not page.has_previous
+    assert page.has_next
+
+
+def test_iter_active_tasks_backward(task_ids: list[int]) -> None:
+    tasks = iter_active_tasks(CHAT_ID, 2, before_id=task_ids[4])
+
+    assert [task.id for task in tasks] == [task_ids[3], task_ids[2]]
+
+
+def test_chat_task_only_in_its_chat(task_ids: list[int]) -> None:
+    other_id = Task.get(
+        Task.chat == Chat.get(Chat.chat_id == OTHER_CHAT_ID)
+    ).id
+
+    assert get_chat_task(CHAT_ID, task_ids[0]).id == task_ids[0]
+    assert get_chat_task(CHAT_ID, other_id) is None
+    assert get_chat_task(CHAT_ID, None) is None
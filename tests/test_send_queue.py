@@ -0,0 +1,144 @@
+import threading
+import time
+from collections.abc import Callable, Iterator
+from typing import Any
+
+import pytest
+from send_queue import TOO_MANY_REQUESTS, Priority, SendQueue
+from telebot.apihelper import ApiTelegramException
+
+FAST = 1000.0
+TIMEOUT = 5
+# Messages a second of a rate limited chat
+CHAT_RATE = 1.0
+
+
+@pytest.fixture()
+def started() -> Iterator[Callable[..., SendQueue]]:
+    queues = []
+
+    def start(chat_rate: float = FAST, chat_burst: int = 1000) -> SendQueue:
+        queue = SendQueue(4, FAST, chat_rate, chat_burst)
+        queues.append(queue)
+        return queue
+
+    yield start
+    for queue in queues:
+        queue.stop()
+
+
+class Log:
+    def __init__(self) -> None:
+        self.calls: list[tuple[int, str]] = []
+        self.done = threading.Semaphore(0)
+
+    def call(self, chat_id: int, name: str) -> str:
+        self.calls.append((chat_id, name))
+        self.done.release()
+        return name
+
+    def wait(self, count: int) -> None:
+        for _ in range(count):
+            assert self.done.acquire(timeout=TIMEOUT)
+
+    def of(self, chat_id: int) -> list[str]:
+        return [name for chat, name in self.calls if chat == chat_id]
+
+
+def test_calls_of_chat_in_order_by_priority(
+    started: Callable[..., SendQueue],
+) -> None:
+    queue = started()
+    log = Log()
+    for name, priority in [
+        ('edit', Priority.NORMAL),
+        ('delete', Priority.LOW),
+        ('send', Priority.NORMAL),
+        ('cleanup', Priority.LOW),
+        ('reply', Priority.NORMAL),
+    ]:
+        queue.post(-1, log.call, -1, name, priority=priority)
+    for number in range(10):
+        queue.post(-2, log.call, -2, f'send {number}')
+
+    queue.start()
+    log.wait(15)
+
+    assert log.of(-1) == ['edit', 'send', 'reply', 'delete', 'cleanup']
+    assert log.of(-2) == [f'send {number}' for number in range(10)]
+
+
+def test_rate_limited_chat_does_not_hold_others(
+    started: Callable[..., SendQueue],
+) -> None:
+    queue = started(chat_rate=CHAT_RATE, chat_burst=1)
+    queue.start()
+    log = Log()
+    posted = time.monotonic()
+    for number in range(3):
+        queue.post(-1, log.call, -1, f'send {number}')
+    # Posting does not wait for the chat
+    assert time.monotonic() - posted < 1 / CHAT_RATE
+
+    sent = threading.Event()
+    queue.post(-2, log.call, -2, 'send', on_sent=lambda _: sent.set())
+    assert sent.wait(TIMEOUT)
+    assert log.of(-1) == ['send 0']
+
+    log.wait(4)
+    assert log.of(-1) == ['send 0', 'send 1', 'send 2']
+    assert time.monotonic() - posted > 1 / CHAT_RATE
+
+
+def test_flood_wait_retries_in_order(
+    started: Callable[..., SendQueue],
+) -> None:
+    queue = started()
+    log = Log()
+    floods = [
+        ApiTelegramException(
+            'sendMessage',
+            None,
+            {
+                'error_code': TOO_MANY_REQUESTS,
+                'description': 'Too Many Requests',
+                'parameters': {'retry_after': 1},
+            },
+        )
+    ]
+
+    def flooded(name: str) -> str:
+        if floods:
+            raise floods.pop()
+        return log.call(-1, name)
+
+    results: list[Any] = []
+    queue.post(-1, flooded, 'first', on_sent=results.append)
+    queue.post(-1, log.call, -1, 'second')
+    assert queue.pending() == 2  # noqa: PLR2004
+    queue.start()
+    log.wait(2)
+
+    assert log.of(-1) == ['first', 'second']
+    assert results == ['first']
+
+
+def test_failure_passed_to_callback(
+    started: Callable[..., SendQueue],
+) -> None:
+    queue = started()
+    queue.start()
+    failed = threading.Event()
+    errors: list[Exception] = []
+
+    def fail() -> None:
+        raise ValueError('message to edit not found')
+
+    def on_failure(error: Exception) -> None:
+        errors.append(error)
+        failed.set()
+
+    queue.post(-1, fail, on_sent=errors.append, on_failure=on_failure)
+
+    assert failed.wait(TIMEOUT)
+    assert [type(error) for error in errors] == [ValueError]
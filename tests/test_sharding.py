@@ -0,0 +1,96 @@
+import threading
+import time
+from typing import Any
+
+import pytest
+from sharding import HashRing, ShardDispatcher, connect, ownership
+from telebot.types import Update
+
+CHATS = 50
+HANDLING_TIME = 0.002
+
+
+class Events:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.events: list[tuple[str, int]] = []
+
+    def add(self, event: str, number: int) -> None:
+        with self._lock:
+            self.events.append((event, number))
+
+
+class FakeBot:
+    def __init__(self, events: Events) -> None:
+        self._events = events
+
+    def process_new_updates(self, updates: list[Update]) -> None:
+        for update in updates:
+            time.sleep(HANDLING_TIME)
+            self._events.add('handled', update.update_id)
+
+
+class ShardThread:
+    # A shard served in a thread instead of a bot process
+    def __init__(self, dispatcher: ShardDispatcher, events: Events) -> None:
+        shard = len(dispatcher._processes)
+        host, port = dispatcher._listener.address
+        events.add('spawned', shard)
+        self._thread = threading.Thread(
+            target=lambda: connect(
+                shard, f'{host}:{port}', dispatcher._authkey.hex()
+            ).serve(FakeBot(events), 2, 100),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def wait(self) -> None:
+        self._thread.join()
+
+
+def update(update_id: int, chat_id: int) -> dict[str, Any]:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'group'},
+            'text': 'Задача',
+        },
+    }
+
+
+def test_moved_chats_handled_before_new_shard_starts(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(ownership, '_state', None)
+    events = Events()
+    dispatcher = ShardDispatcher(1)
+    monkeypatch.setattr(
+        dispatcher,
+        '_spawn',
+        lambda: dispatcher._processes.append(ShardThread(dispatcher, events)),
+    )
+    dispatcher.start()
+    try:
+        for chat in range(CHATS):
+            dispatcher.submit(update(chat, -chat))
+        dispatcher.add_shard()
+        moved = [
+            chat for chat in range(CHATS) if HashRing([0, 1]).owner(-chat)
+        ]
+        assert moved
+        for chat in moved:
+            dispatcher.submit(update(CHATS + chat, -chat))
+        dispatcher.drain()
+    finally:
+        dispatcher.stop()
+
+    spawned = events.events.index(('spawned', 1))
+    before, after = events.events[:spawned], events.events[spawned + 1 :]
+    assert sorted(
+        number for event, number in before if event == 'handled'
+    ) == list(range(CHATS))
+    assert sorted(number for _, number in after) == [
+        CHATS + chat for chat in moved
+    ]
@@ -0,0 +1,38 @@
+from messages import messages
+from utils import MESSAGE_LENGTH_LIMIT, split_message
+
+HEADER = messages['bulk_created'].format(500, '')
+FOOTER = messages['keep_or_delete']
+
+
+def test_short_message_not_split() -> None:
+    lines = ['Вынести мусор — @anna', 'Помыть посуду']
+
+    assert split_message(HEADER, lines, FOOTER) == [
+        HEADER + '\n'.join(lines) + FOOTER
+    ]
+
+
+def test_long_message_split_by_lines() -> None:
+    lines = [
+        f'Задача {number} — @user_with_a_long_name_{number}'
+        for number in range(500)
+    ]
+
+    parts = split_message(HEADER, lines, FOOTER)
+
+    assert len(parts) > 1
+    assert all(len(part) <= MESSAGE_LENGTH_LIMIT for part in parts)
+    assert all(part.endswith(FOOTER) for part in parts)
+    assert parts[0].startswith(HEADER)
+    body = '\n'.join(part.removesuffix(FOOTER) for part in parts)
+    assert body.removeprefix(HEADER).split('\n') == lines
+
+
+def test_too_long_line_cut() -> None:
+    parts = split_message(HEADER, ['a' * 10000, 'b'], FOOTER)
+
+    assert [len(part) for part in parts] == [
+        MESSAGE_LENGTH_LIMIT,
+        len('b' + FOOTER),
+    ]
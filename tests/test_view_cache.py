@@ -0,0 +1,48 @@
+import threading
+
+from database import db, write_transaction
+from models import Chat, Task, User
+from peewee import Database
+from repository import add_task
+from telebot.types import InlineKeyboardMarkup
+from view_cache import RenderedView, view_cache
+
+CHAT_ID = -1
+
+
+def render_count() -> RenderedView:
+    # The number of tasks of the chat, as another thread reads it
+    with db.atomic():
+        count = Task.select().join(Chat).where(Chat.chat_id == CHAT_ID).count()
+    return RenderedView(str(count), InlineKeyboardMarkup())
+
+
+def test_view_rendered_before_commit_not_kept(database: Database) -> None:
+    user = User.create(username='anna')
+    Chat.create(chat_id=CHAT_ID)
+    view_cache.invalidate(CHAT_ID)
+    added = threading.Event()
+    rendered = threading.Event()
+
+    def write() -> None:
+        with write_transaction(db):
+            add_task(
+                Task(
+                    creator=user,
+                    chat=Chat.get(Chat.chat_id == CHAT_ID),
+                    text='Вынести мусор',
+                ),
+                CHAT_ID,
+            )
+            added.set()
+            # A reader misses the cache while the task is not committed
+            rendered.wait()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    added.wait()
+    assert view_cache.get(CHAT_ID, 'count', render_count).text == '0'
+    rendered.set()
+    writer.join()
+
+    assert view_cache.get(CHAT_ID, 'count', render_count).text == '1'
@@ -0,0 +1,123 @@
+import random
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+import pytest
+import workload as workload_module
+from database import write_transaction
+from models import Chat, Task, User
+from peewee import Database
+from repository import (
+    add_task,
+    add_tasks,
+    delete_task,
+    finish_task,
+    get_task,
+    set_task_executor,
+)
+from workload import WorkloadCounter, workload
+
+CHATS = 3
+USERS = 4
+STEPS = 300
+OPERATIONS = ['create', 'bulk', 'assign', 'finish', 'delete']
+
+
+def database_loads() -> Counter[tuple[int, int]]:
+    # Tasks of every executor, counted row by row
+    loads: Counter[tuple[int, int]] = Counter()
+    for task in Task.select(Task, Chat).join(Chat):
+        if task.executor_id is not None:
+            loads[task.chat.chat_id, task.executor_id] += 1
+    return loads
+
+
+def cached_loads(counter: WorkloadCounter) -> Counter[tuple[int, int]]:
+    return Counter(
+        {
+            (chat_id, user_id): load
+            for chat_id, user_id, load in counter.items()
+        }
+    )
+
+
+def apply(
+    rng: random.Random, operation: str, chat: Chat, users: list[User]
+) -> None:
+    # Changes a task the way the handlers do, in a write transaction
+    tasks = [
+        task.id
+        for task in Task.select(Task.id, Task.is_finished).where(
+            Task.chat == chat
+        )
+        if operation == 'delete' or not task.is_finished
+    ]
+    if operation == 'create' or (operation != 'bulk' and not tasks):
+        add_task(
+            Task(creator=rng.choice(users), chat=chat, text='Задача'),
+            chat.chat_id,
+        )
+    elif operation == 'bulk':
+        count = rng.randint(1, 5)
+        executors = rng.choice([[], rng.choices(users, k=count)])
+        add_tasks(chat, rng.choice(users), ['Задача'] * count, executors)
+    else:
+        task = get_task(rng.choice(tasks))
+        username = rng.choice(users).username
+        if operation == 'assign':
+            set_task_executor(task, chat.chat_id, username)
+        elif operation == 'finish':
+            finish_task(task, chat.chat_id, rng.choice([None, username]))
+        else:
+            delete_task(task, chat.chat_id)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_cached_loads_match_database(database: Database, seed: int) -> None:
+    rng = random.Random(seed)
+    chats = [Chat.create(chat_id=-number) for number in range(1, CHATS + 1)]
+    users = [User.create(username=f'user_{number}') for number in range(USERS)]
+    for chat in chats:
+        chat.users.add(users)
+    workload.rebuild(database)
+
+    for _ in range(STEPS):
+        operation = rng.choice(OPERATIONS)
+        with write_transaction(database):
+            apply(rng, operation, rng.choice(chats), users)
+        assert cached_loads(workload) == database_loads(), operation
+
+    rebuilt = WorkloadCounter()
+    rebuilt.rebuild(database)
+    assert cached_loads(rebuilt) == cached_loads(workload)
+
+
+def test_rebuild_keeps_concurrent_changes(
+    database: Database, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    rng = random.Random(0)
+    chats = [Chat.create(chat_id=-number) for number in range(1, CHATS + 1)]
+    users = [User.create(username=f'user_{number}') for number in range(USERS)]
+    for chat in chats:
+        chat.users.add(users)
+    for operation in ['create', 'bulk'] * 5:
+        with write_transaction(database):
+            apply(rng, operation, rng.choice(chats), users)
+
+    @contextmanager
+    def counted_then_changed(db: Database) -> Iterator[None]:
+        # Handlers change tasks after the counts are read, before the
+        # rebuild replaces the loads
+        with write_transaction(db):
+            yield
+        for _ in range(STEPS // 10):
+            with write_transaction(db):
+                apply(rng, rng.choice(OPERATIONS), rng.choice(chats), users)
+
+    monkeypatch.setattr(
+        workload_module, 'write_transaction', counted_then_changed
+    )
+    workload.rebuild(database)
+
+    assert cached_loads(workload) == database_loads()